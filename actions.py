@@ -1,43 +1,70 @@
-from rasa_sdk import Action, Tracker
-from rasa_sdk.executor import CollectingDispatcher
+from rasa_sdk import Action
 from rasa_sdk.events import SlotSet, AllSlotsReset, Restarted
-from actions.servicerec.api import ServiceRecommenderAPI, SessionAttributesAPI
+from actions.servicerec.api import AsyncSessionAttributesAPI, ApiResponse
+from actions.servicerec.text import normalize_text
+from actions.pipeline import (
+    Pipeline,
+    RecommendationPipeline,
+    Stage,
+    CacheLookup,
+    UpstreamCall,
+    LocalSearchFallback,
+    ParseServices,
+    SetRecommendationsSlot,
+    Prefetcher
+)
+from actions.servicerec.metrics import METRICS_PORT, METRICS_ADDRESS, measure_action, start_metrics_server
+from actions.servicerec.tracing import span, trace_action
+import asyncio
 import json
+import functools
+import logging
 from urllib.parse import urlparse, parse_qs, urlencode
-from actions.utils import Filters, find_municipality
+from actions.ranking import rank_services, bm25_rerank, query_variants, reciprocal_rank_fusion
+from actions.slots import (
+    SCHEMA_FIELDS,
+    extract_slots,
+    to_int,
+    to_bool,
+    to_municipality,
+    to_search_text,
+    to_sort_term,
+    to_filter
+)
+from actions.utils import find_municipality, municipality_name, find_service
+from actions.utils import municipality_index
 from actions.utils import (
     LIFE_SITUATION_SLOTS,
-    DEFAULT_LIFE_SITUATION_FEATURES,
-    DEFAULT_LIFE_SITUATION_METER_VALUES,
-    MIN_FEATURE_VALUE,
-    MAX_FEATURE_VALUE,
     AGE_SLOT,
     DEFAULT_AGE_VALUE,
     MUNICIPALITY_SLOT,
     MUNICIPALITY_FILTER_SLOT,
-    DEFAULT_MUNICIPALITY_VALUE,
     MUNICIPALITY_NAME_SLOT,
     SESSION_TRANSFER_TARGET_SERVICE_SLOT,
-    DEFAULT_SESSION_TRANSFER_TARGET_SERVICE,
     SEARCH_TEXT_SLOT,
-    DEFAULT_SEARCH_TEXT_VALUE,
-    INCLUDE_NATIONAL_SERVICES_SLOT,
-    INCLUDE_NATIONAL_SERVICES_DEFAULT_VALUE,
     RESULT_LIMIT_SLOT,
     DEFAULT_RESULT_LIMIT,
-    RERANK_SLOT,
+    RERANK_MODE,
+    LOCAL_RERANK_CANDIDATES,
+    PREFETCH_RECOMMENDATIONS,
+    TEXT_SEARCH_MODE,
+    FANOUT_RRF_K,
     DEFAULT_SESSION_ID,
-    API_FILTERS,
     RECOMMENDATIONS_SLOT,
     BUTTON_PRESSED_SLOT,
     BUTTON_PRESSED_INTENT,
     SHOW_API_CALL_PARAMETERS_SLOT,
-    WHITELIST_SLOT,
-    BLACKLIST_SLOT,
-    MUNICIPALITY_CODES
+    SERVICE_DETAILS_EXPIRED_MESSAGE
 )
 
-af = Filters().filters
+logger = logging.getLogger(__name__)
+
+# Metrics are best effort: a taken port must not stop the action server.
+if METRICS_PORT:
+    try:
+        start_metrics_server(int(METRICS_PORT), METRICS_ADDRESS)
+    except OSError as e:
+        logger.warning('Metrics server not started on port %s: %s', METRICS_PORT, e)
 
 
 # todo: Add responses for different languages.
@@ -69,35 +96,52 @@ class CarouselTemplate:
         self.template['payload']['elements'].append(element.element)
         return self.template
 
-class CarouselElement:
+    def add_rendered_element(self, element: dict):
+        """ Adds an element rendered by ElementTemplate. """
+        self.template['payload']['elements'].append(element)
+        return self.template
 
-    def __init__(self, service_id: str, name: str, image_url: str = None):
-        self.service_id = service_id
-        self.payload_body = f'/{BUTTON_PRESSED_INTENT}' + \
-                            '{"' + f'{BUTTON_PRESSED_SLOT}' + \
-                            '":"' + f'{self.service_id}'
+class ElementTemplate:
+    """
+    Carousel element of a service compiled once. Button titles and the payload
+    prefix are fixed at compile time, and only service id and name are filled
+    in. The button pressed slot value is encoded with json, so payloads stay
+    valid whatever characters the service id has. Rendered elements are cached
+    per (service_id, name, image_url) and shared, so they must not be modified.
+    """
 
-        self.element = {
+    # Button title and the suffix of the button pressed slot value.
+    BUTTONS = (
+        ('Lisätietoja', 'moreinfo'),
+        ('Yhteystiedot', 'contactinfo'),
+        ('Palvelun kotisivu', 'homepage')
+    )
+
+    def __init__(self, buttons: tuple = BUTTONS, intent: str = BUTTON_PRESSED_INTENT,
+                 slot: str = BUTTON_PRESSED_SLOT, cache_size: int = 4096):
+        self.buttons = tuple(buttons)
+        self.payload_prefix = f'/{intent}{{{json.dumps(slot, ensure_ascii=False)}:'
+        self.render = functools.lru_cache(maxsize=cache_size)(self._render)
+
+    def payload(self, service_id: str, button_id: str) -> str:
+        return self.payload_prefix + json.dumps(f'{service_id}_{button_id}', ensure_ascii=False) + '}'
+
+    def _render(self, service_id: str, name: str, image_url: str = None) -> dict:
+        return {
             'title': name,
             'image_url': image_url,
-            'buttons': [{
-                'title': 'Lisätietoja',
-                'type': 'postback',
-                'payload': self.payload_body + '_moreinfo"}'
-                },
-                {
-                'title': 'Yhteystiedot',
-                'type': 'postback',
-                'payload': self.payload_body + '_contactinfo"}'
-                },
-                {
-                'title': 'Palvelun kotisivu',
-                'type': 'postback',
-                'payload': self.payload_body + '_homepage"}'
-                }
-            ]
+            'buttons': [{'title': title, 'type': 'postback', 'payload': self.payload(service_id, button_id)}
+                        for title, button_id in self.buttons]
         }
 
+ELEMENT_TEMPLATE = ElementTemplate()
+
+class CarouselElement:
+
+    def __init__(self, service_id: str, name: str, image_url: str = None):
+        self.service_id = service_id
+        self.element = ELEMENT_TEMPLATE.render(service_id, name, image_url)
+
 class ApiParams:
     def __init__(self):
         self.session_id = DEFAULT_SESSION_ID
@@ -116,46 +160,25 @@ class ApiParams:
                 self.params[arg] = kwargs[arg]
         return self.params
 
-class ApiFilters:
-    def __init__(self):
-        self.filters = {}
-
-    def add_filters(self, **kwargs):
-        """ Updates api filters """
-
-        for arg in kwargs:
-            if not kwargs[arg]:
-                if isinstance(kwargs[arg], (int, float)):
-                    self.filters[arg] = kwargs[arg]
-                else:
-                    continue
-            else:
-                self.filters[arg] = kwargs[arg]
-        return self.filters
-
 class ValidateSlots:
+    """
+    Validation of single slots. Recommendation actions read all their slots
+    at once with slots.extract_slots, and these use the same converters.
+    """
 
     @staticmethod
     def validate_result_limit(tracker):
         """
         Will check if result limit slot has a proper value. Otherwise default limit is used.
         """
-        try:
-            limit = int(tracker.get_slot(RESULT_LIMIT_SLOT))
-        except:
-            limit = DEFAULT_RESULT_LIMIT
-        return limit
+        return to_int(tracker.get_slot(RESULT_LIMIT_SLOT), DEFAULT_RESULT_LIMIT)
 
     @staticmethod
     def validate_age(tracker):
         """
         Will check if age slot has a proper value.
         """
-        try:
-            age = int(tracker.get_slot(AGE_SLOT))
-        except:
-            age = DEFAULT_AGE_VALUE
-        return age
+        return to_int(tracker.get_slot(AGE_SLOT), DEFAULT_AGE_VALUE)
 
     @staticmethod
     def validate_municipality(tracker):
@@ -165,24 +188,14 @@ class ValidateSlots:
         municipality filter slot is different and is validated by its
         own class method as it may contain list of values.
         """
-        try:
-            slot_content = tracker.get_slot(MUNICIPALITY_SLOT)
-            if isinstance(slot_content, str):
-                code = find_municipality(slot_content)
-        except:
-            code = DEFAULT_MUNICIPALITY_VALUE
-        return code
+        return to_municipality(tracker.get_slot(MUNICIPALITY_SLOT))
 
     @staticmethod
     def validate_search_text(tracker):
         """
         Will check if search text slot has a value. Otherwise default value is used.
         """
-        try:
-            search_text = str(tracker.get_slot(SEARCH_TEXT_SLOT))
-        except:
-            search_text = DEFAULT_SEARCH_TEXT_VALUE
-        return search_text
+        return to_search_text(tracker.get_slot(SEARCH_TEXT_SLOT))
 
     @staticmethod
     def validate_feat(tracker):
@@ -190,22 +203,7 @@ class ValidateSlots:
             values determined in LIFE_SITUATION_SLOTS. In case a feature slot has
             invalid value it has no effect on recommendations.
         """
-
-        feats = {}
-        for key in LIFE_SITUATION_SLOTS.keys():
-            try:
-                slot_value = int(tracker.get_slot(LIFE_SITUATION_SLOTS[key]))
-                if MAX_FEATURE_VALUE >= slot_value >= MIN_FEATURE_VALUE:
-                    feats[key] = [slot_value]
-                else:
-                    continue
-            except:
-                continue
-
-        if not bool(feats):
-            feats = DEFAULT_LIFE_SITUATION_METER_VALUES
-
-        return feats
+        return SCHEMA_FIELDS['life_situation_meters'].read(tracker.current_slot_values())
 
     @staticmethod
     def validate_list_slot(tracker, codefilter):
@@ -213,87 +211,297 @@ class ValidateSlots:
         Check if list slot has a proper value which has corresponding
         code. Otherwise the slot value does not effective factor.
         """
-
-        try:
-            slot_value = tracker.get_slot(codefilter.slot)
-            validated_slot_value = codefilter.validate_selection(slot_value)
-        except:
-            return None
-
-        return validated_slot_value
+        return to_filter(codefilter, tracker.get_slot(codefilter.slot))
 
     @staticmethod
     def validate_bool_slot(tracker, slot_name):
         """
         Will check if boolean slot holds proper value. If not, filter is not used.
         """
+        return to_bool(tracker.get_slot(slot_name))
 
-        try:
-            slot_value = tracker.get_slot(slot_name)
-            if isinstance(slot_value, str):
-                try:
-                    int_value = int(slot_value)
-                    if int_value == 1:
-                        return True
-                    else:
-                        return False
-                except:
-                    if slot_value.lower() == 'yes':
-                        return True
-                    else:
-                        return False
-            if isinstance(slot_value, bool):
-                return slot_value
-        except:
-            return None
+    @staticmethod
+    def validate_sort_term(tracker, slot_name):
+        """
+        Will check if whitelist or blacklist slot has a value. Otherwise 'NULL' is used.
+        """
+        return to_sort_term(tracker.get_slot(slot_name))
 
     def validate_filters(self, tracker):
-        api_filters = ApiFilters()
+        """
+        Validates all filter slots in one pass. Filters without a valid value
+        are left out.
+        """
+        return SCHEMA_FIELDS['service_filters'].read(tracker.current_slot_values())
 
-        api_filters.add_filters(
-            include_national_services=self.validate_bool_slot(tracker, INCLUDE_NATIONAL_SERVICES_SLOT),
-            municipality_codes=self.validate_list_slot(tracker, af['municipality_filter']),
-            region_codes=self.validate_list_slot(tracker, af['region_filter']),
-            hospital_district_codes=self.validate_list_slot(tracker, af['hospital_district_filter']),
-            service_classes=self.validate_list_slot(tracker, af['service_class_filter']),
-            target_groups=self.validate_list_slot(tracker, af['target_group_filter']),
-            service_collections=self.validate_list_slot(tracker, af['service_collection_filter'])
-        )
+class WhiteBlackList:
+    """ Reorders recommended services with whitelist and blacklist terms (see ranking.rank_services). """
 
-        return api_filters.filters
+    def __init__(self, services: dict):
+        self.services = services
 
-class WhiteBlackList:
-  def __init__(self, services: dict):
-    self.services = services
-
-  @staticmethod
-  def sort_by_weight(elem):
-    return elem[3]
-
-  def resort_by_match(self, white: str, black: str):
-    weighted_services = []
-    ids = [service['service_id'] for service in self.services['recommended_services']]
-    names = [service['service_name'] for service in self.services['recommended_services']]
-    descriptions = [service['service_description'] for service in self.services['recommended_services']]
-
-    for sid, name, desc in zip(ids, names, descriptions):
-        if white in desc:
-            weighted_services.append((sid, name, desc, 1))
+    def resort_by_match(self, white, black):
+        return rank_services(self.services, whitelist=white, blacklist=black)
+
+LIFE_SITUATION_PARAMS = ('limit', 'rerank', 'life_situation_meters', 'service_filters')
+TEXT_SEARCH_PARAMS = ('limit', 'rerank', 'search_text', 'service_filters')
+WHITEBLACKLIST_PARAMS = ('limit', 'search_text', 'service_filters')
+
+class ExtractSlots(Stage):
+    """ Reads the given fields of slots.SLOT_SCHEMA, and show_params, from the
+        tracker in one pass into context.snapshot and context.slots. """
+    name = 'extract_slots'
+
+    def __init__(self, *slots):
+        self.slots = slots
+        self.fields = slots if 'show_params' in slots else slots + ('show_params',)
+
+    async def __call__(self, context):
+        context.snapshot = extract_slots(context.tracker, self.fields)
+        context.slots.update(context.snapshot.as_dict(self.slots))
+
+class BuildParams(Stage):
+    """ Builds api parameters from the given validated slots. """
+    name = 'params'
+
+    def __init__(self, *params):
+        self.params = params
+
+    async def __call__(self, context):
+        api_params = ApiParams()
+        api_params.add_params(**{param: context.slots.get(param) for param in self.params})
+        context.params = api_params.params
+
+def show_params(context) -> bool:
+    """ Whether api parameters are shown, from the snapshot if slots have been extracted. """
+    if context.snapshot is not None and context.snapshot.show_params is not None:
+        return context.snapshot.show_params
+    return show_request_parameters(context.tracker, SHOW_API_CALL_PARAMETERS_SLOT)
+
+class ShowParams(Stage):
+    """ Shows api parameters if the show parameters slot is set. """
+    name = 'show_params'
+
+    async def __call__(self, context):
+        if show_params(context):
+            context.dispatcher.utter_message(f'hakuparametrit: {str(json.dumps(context.params))}')
+
+class LocalRerankParams(Stage):
+    """ In local rerank mode asks the api for more candidates without reranking,
+        so that they can be reranked by Bm25Ranking. """
+    name = 'rerank_params'
+
+    def __init__(self, mode: str = RERANK_MODE, candidates: int = LOCAL_RERANK_CANDIDATES):
+        self.mode = mode
+        self.candidates = candidates
+
+    async def __call__(self, context):
+        if self.mode != 'local' or not context.slots.get('rerank'):
+            return
+
+        context.params = dict(context.params, rerank=False,
+                              limit=max(context.slots['limit'], self.candidates))
+
+class FanOutSearch(Stage):
+    """ In fanout TEXT_SEARCH_MODE sends variants of the search text (see
+        ranking.query_variants) to the api concurrently, and fuses their results
+        with reciprocal rank fusion. Each variant is cached and coalesced on its
+        own, so this stage replaces CacheLookup: the cached response of the
+        original search text alone is not the fused result. Otherwise the
+        cached response is used or the upstream stage is run.
+
+        With a LocalSearchFallback upstream which has an index, the variants
+        share its latency budget, and the search is answered from the index if
+        no variant answers in time. Otherwise, if every variant fails, the run
+        stops like in UpstreamCall. The api is not called again either way. """
+    name = 'upstream'
+
+    def __init__(self, upstream: Stage, mode: str = TEXT_SEARCH_MODE, k: int = FANOUT_RRF_K):
+        self.upstream = upstream
+        self.api = upstream.api
+        self.mode = mode
+        self.k = k
+
+    @property
+    def local_search(self):
+        """ The upstream stage if it can answer from a local search index. """
+        if isinstance(self.upstream, LocalSearchFallback) and self.upstream.index is not None:
+            return self.upstream
+        return None
+
+    async def __call__(self, context):
+        if context.response is not None:
+            return
+
+        variants = self.variants(context.params) if self.mode == 'fanout' else []
+
+        if len(variants) < 2:
+            context.response = self.api.cached_response(context.params, context.method)
+            await self.upstream(context)
+            return
+
+        local_search = self.local_search
+        with span('fanout', variants=len(variants)):
+            tasks = [asyncio.ensure_future(self.search(dict(context.params, search_text=variant), context.method))
+                     for variant in variants]
+            done, pending = await asyncio.wait(tasks, timeout=local_search and local_search.latency_budget)
+
+        # Late variants are not cancelled, so their responses are still cached.
+        for task in pending:
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+        errors = [task.exception() for task in done]
+        for error in errors:
+            if error is not None and not isinstance(error, ConnectionError):
+                raise error
+
+        results = []
+        failed = None
+        for task in tasks:
+            if task not in done or task.exception() is not None:
+                continue
+            response = task.result()
+            if response.ok:
+                results.append(response.json())
+            elif failed is None:
+                failed = response
+
+        if not results:
+            self.fail(context, failed, local_search)
+            return
+
+        fused = reciprocal_rank_fusion([result.get('recommended_services') or [] for result in results],
+                                       k=self.k, limit=context.params.get('limit'))
+        context.response = ApiResponse.from_json(dict(results[0], recommended_services=fused))
+
+    @staticmethod
+    def fail(context, response, local_search):
+        """ Handles a search where no variant succeeded like the upstream stage
+            handles a failed api call. """
+        if response is not None and (local_search is None or response.status_code < 500):
+            context.response = response
+        elif local_search is not None:
+            local_search.search_locally(context)
         else:
-            if black in desc:
-                weighted_services.append((sid, name, desc, 1000))
-            else:
-                weighted_services.append((sid, name, desc, 2))
+            context.fallback('api_error')
+            context.stop(API_ERROR_MESSAGE)
+
+    async def search(self, params: dict, method: str):
+        return self.api.cached_response(params, method) or await self.api.fetch(params, method)
+
+    @staticmethod
+    def variants(params: dict) -> list:
+        """ Variants of the search text. Name of the municipality of the filters
+            is appended, and words which are municipality names are stripped. """
+        search_text = params.get('search_text')
+        codes = (params.get('service_filters') or {}).get('municipality_codes') or []
+        municipality = municipality_name(codes[0]) if len(codes) == 1 else None
+        names = municipality_index()
+        words = tuple(word for word in normalize_text(search_text or '').split() if word in names)
+        return query_variants(search_text, municipality, words)
+
+class ShowSortParameters(Stage):
+    """ Shows whitelist and blacklist used in sorting if api parameters are shown. """
+    name = 'show_sort_params'
+
+    async def __call__(self, context):
+        # Enable if you want to display actual parameters sent to api!
+        if show_params(context):
+            context.dispatcher.utter_message(f'tulosten sorttausparametrit: whitelist: {context.slots["whitelist"]}, '
+                                             f'blacklist: {context.slots["blacklist"]} ')
+
+class WhiteBlackListRanking(Stage):
+    """ Sorts recommendations with weighted terms of whitelist and blacklist slots,
+        e.g. 'nuoret^2, opiskelu'. """
+    name = 'rank'
+
+    async def __call__(self, context):
+        context.ranked_services = rank_services(context.services,
+                                                whitelist=context.slots['whitelist'],
+                                                blacklist=context.slots['blacklist'])
+
+class Bm25Ranking(Stage):
+    """ In local rerank mode reranks the candidates with BM25 against the search
+        text and keeps the requested number of them. """
+    name = 'rank'
+
+    def __init__(self, mode: str = RERANK_MODE):
+        self.mode = mode
+
+    async def __call__(self, context):
+        if self.mode != 'local' or not context.slots.get('rerank'):
+            return
+
+        context.ranked_services = bm25_rerank(context.services, context.slots['search_text'],
+                                              limit=context.slots['limit'])
+
+class RenderList(Stage):
+    """ Outputs recommendations as a list of services with buttons. """
+    name = 'render'
+
+    async def __call__(self, context):
+        services = context.ranked_services['recommended_services']
+
+        if not services:
+            context.fallback('no_services')
+            context.dispatcher.utter_message(NO_SERVICES_MESSAGE)
+        else:
+            context.dispatcher.utter_message('Palvelusuositukset:')
+
+        for service in services:
+            element = ELEMENT_TEMPLATE.render(service['service_id'], service['service_name'])
+            context.dispatcher.utter_message(template=f'Palvelu: {service["service_name"]}',
+                                             buttons=element['buttons'])
 
-    weighted_services.sort(key=self.sort_by_weight)
-    new_services = {'recommended_services': []}
-    for x in weighted_services:
-        new_services['recommended_services'].append({'service_id': x[0],
-                                                     'service_name': x[1],
-                                                     'service_description': x[2],
-                                                     'weight': x[3]})
+class RenderCarousel(Stage):
+    """ Outputs recommendations as a carousel. """
+    name = 'render'
 
-    return new_services
+    async def __call__(self, context):
+        services = context.ranked_services['recommended_services']
+
+        if not services:
+            context.fallback('no_services')
+            context.dispatcher.utter_message(NO_SERVICES_MESSAGE)
+        else:
+            context.dispatcher.utter_message('Palvelusuositukset:')
+
+        with span('carousel_template', services=len(services)):
+            ct = CarouselTemplate()
+
+            for service in services:
+                ct.add_rendered_element(ELEMENT_TEMPLATE.render(service['service_id'], service['service_name']))
+
+        context.dispatcher.utter_message(attachment=ct.template)
+
+def recommendation_pipeline(params: tuple, render: Stage, ranking: Stage = None, error_messages=None,
+                            local_rerank: bool = False, local_search: bool = False, fanout: bool = False):
+    """
+    Pipeline which calls the api with the given parameters taken from slots,
+    optionally reorders the recommendations and renders them. With local_rerank
+    the recommendations are reranked in the action server in local RERANK_MODE.
+    With local_search the local search index answers when the api cannot, and
+    with fanout variants of the search text are searched in fanout TEXT_SEARCH_MODE.
+    """
+    stages = [ExtractSlots(*params), BuildParams(*params)]
+    if local_rerank:
+        stages.append(LocalRerankParams())
+        ranking = ranking or Bm25Ranking()
+    upstream = LocalSearchFallback() if local_search else UpstreamCall()
+    if fanout:
+        upstream = FanOutSearch(upstream)
+    # A fan-out search looks up the cache of each variant itself. The cached
+    # response of the original search text alone is not the fused result.
+    stages += [ShowParams()] if fanout else [ShowParams(), CacheLookup()]
+    stages += [
+        upstream,
+        ParseServices(error_messages=error_messages)
+    ]
+    if ranking is not None:
+        stages.append(ranking)
+    stages += [render, SetRecommendationsSlot()]
+
+    return Pipeline(stages)
 
 class ActionShowInfo(Action):
     """
@@ -302,310 +510,116 @@ class ActionShowInfo(Action):
     def name(self):
         return 'action_show_info'
 
-    @staticmethod
-    def remove_duplicates(records: list):
-        out = []
-        for r in records:
-            if r not in out:
-                out.append(r)
-        return out
-
     @staticmethod
     def get_service(service_list, service_id):
-        for service in service_list['recommended_services']:
-            if service['service_id'] == service_id:
-                return service
+        return find_service(service_list, service_id)
 
     def empty_message(self, dispatcher):
         dispatcher.utter_message(NO_SERVICE_CHANNEL_ITEMS_MESSAGE)
 
+    @measure_action
     def run(self, dispatcher, tracker, domain):
         services = tracker.get_slot(RECOMMENDATIONS_SLOT)
         selection = tracker.get_slot(BUTTON_PRESSED_SLOT)
-        service_id, button_id = str(selection).split('_')
+        service_id, button_id = str(selection).rsplit('_', 1)
         service = self.get_service(services, service_id)
 
+        if button_id not in ('contactinfo', 'moreinfo', 'homepage'):
+            return []
+
+        if service is None:
+            dispatcher.utter_message(SERVICE_DETAILS_EXPIRED_MESSAGE)
+            return []
+
+        if not service.channels:
+            dispatcher.utter_message(NO_SERVICE_CHANNELS_MESSAGE)
+            return []
+
         if button_id == 'contactinfo':
-            if service['service_channels']:
-                dispatcher.utter_message(template=f'{service["service_name"]} -palvelun palvelukanavien yhtestiedot:')
-                for record in service['service_channels']:
-                    emails = '\n'.join(map(str, self.remove_duplicates(record['emails'])))
-                    phone_numbers = '\n'.join(map(str, self.remove_duplicates(record['phone_numbers'])))
-                    address = record['address']
-                    dispatcher.utter_message(template=f'{record["service_channel_name"]}: ')
-                    if emails:
-                        dispatcher.utter_message(template=f'Sähköposti: {emails}')
-                    if phone_numbers:
-                        dispatcher.utter_message(template=f'Puhelin: {phone_numbers}')
-                    if address:
-                        dispatcher.utter_message(template=f'Osoite: {address}')
-            else:
-                dispatcher.utter_message(NO_SERVICE_CHANNELS_MESSAGE)
+            dispatcher.utter_message(template=f'{service.service_name} -palvelun palvelukanavien yhtestiedot:')
+            for channel in service.channels:
+                dispatcher.utter_message(template=f'{channel.name}: ')
+                if channel.emails:
+                    dispatcher.utter_message(template=f'Sähköposti: {channel.emails}')
+                if channel.phone_numbers:
+                    dispatcher.utter_message(template=f'Puhelin: {channel.phone_numbers}')
+                if channel.address:
+                    dispatcher.utter_message(template=f'Osoite: {channel.address}')
 
         if button_id == 'moreinfo':
-            if service['service_channels']:
-                dispatcher.utter_message(template=f'{service["service_name"]} -palvelun palvelukanavien lisätiedot:')
-                for record in service['service_channels']:
-                    hours = '\n'.join(map(str, record['service_hours']))
-                    dispatcher.utter_message(template=f'{record["service_channel_name"]}: ')
-                    if hours:
-                        dispatcher.utter_message(template=f'Aukioloajat: {hours}')
-                    else:
-                        self.empty_message(dispatcher)
-            else:
-                dispatcher.utter_message(NO_SERVICE_CHANNELS_MESSAGE)
+            dispatcher.utter_message(template=f'{service.service_name} -palvelun palvelukanavien lisätiedot:')
+            for channel in service.channels:
+                dispatcher.utter_message(template=f'{channel.name}: ')
+                if channel.service_hours:
+                    dispatcher.utter_message(template=f'Aukioloajat: {channel.service_hours}')
+                else:
+                    self.empty_message(dispatcher)
 
         if button_id == 'homepage':
-            if service['service_channels']:
-                dispatcher.utter_message(template=f'{service["service_name"]} -palvelun palvelukanavien kotisivut:')
-                for record in service['service_channels']:
-                    web_pages = '\n'.join(map(str, record['web_pages']))
-                    dispatcher.utter_message(template=f'{record["service_channel_name"]}: ')
-                    if web_pages:
-                        dispatcher.utter_message(template=f'Web-sivut: {web_pages}')
-                    else:
-                        self.empty_message(dispatcher)
-            else:
-                dispatcher.utter_message(NO_SERVICE_CHANNELS_MESSAGE)
+            dispatcher.utter_message(template=f'{service.service_name} -palvelun palvelukanavien kotisivut:')
+            for channel in service.channels:
+                dispatcher.utter_message(template=f'{channel.name}: ')
+                if channel.web_pages:
+                    dispatcher.utter_message(template=f'Web-sivut: {channel.web_pages}')
+                else:
+                    self.empty_message(dispatcher)
 
         return []
 
-class ServiceListByLifeSituation(Action, ValidateSlots):
+class ServiceListByLifeSituation(RecommendationPipeline, Action):
     """
     Get service recommendations based on slot values collected by the bot.
     Tracker store slots must follow naming convention determined in
     LIFE_SITUATION_SLOTS dictionary to have an effect on recommendation.
+    Outputs recommendations as a list to the bot interface.
     """
 
+    method = 'recommend_service'
+    pipeline = recommendation_pipeline(LIFE_SITUATION_PARAMS, RenderList())
+
     def name(self):
         return 'action_service_list_by_life_situation'
 
-    def run(self, dispatcher, tracker, domain):
-        """
-        Fetches slot values from the bot tracker store, validates slot values,
-        and calls service recommender api to fetch recommended services based on
-        the recommend service method.
-        Outputs recommendations as a list to the bot interface.
-        Results slot with recommended services.
-        """
-
-        api_params = ApiParams()
-
-        api_params.add_params(limit=self.validate_result_limit(tracker),
-                              rerank=ValidateSlots.validate_bool_slot(tracker, RERANK_SLOT),
-                              life_situation_meters=self.validate_feat(tracker),
-                              service_filters=self.validate_filters(tracker))
-
-        if show_request_parameters(tracker, SHOW_API_CALL_PARAMETERS_SLOT):
-            dispatcher.utter_message(f'hakuparametrit: {str(json.dumps(api_params.params))}')
-
-        try:
-            api = ServiceRecommenderAPI()
-
-            response = api.get_recommendations(params=api_params.params,
-                                               method='recommend_service')
-
-            if response.ok:
-                services = response.json()
-
-                ids = [service['service_id'] for service in services['recommended_services']]
-                names = [service['service_name'] for service in services['recommended_services']]
-
-                if not ids:
-                    dispatcher.utter_message(NO_SERVICES_MESSAGE)
-                else:
-                    dispatcher.utter_message('Palvelusuositukset:')
-
-                for service_id, name in zip(ids, names):
-                    element = CarouselElement(service_id, name)
-                    dispatcher.utter_message(template=f'Palvelu: {name}',
-                                             buttons=element.element['buttons'])
-            else:
-                dispatcher.utter_message(template=API_ERROR_MESSAGE)
-        except ConnectionError:
-            services = None
-            dispatcher.utter_message(template=API_ERROR_MESSAGE)
-
-        return [SlotSet(RECOMMENDATIONS_SLOT, services)]
-
-class ServiceCarouselByLifeSituation(Action, ValidateSlots):
+class ServiceCarouselByLifeSituation(RecommendationPipeline, Action):
     """
     Get service recommendations based on slot values collected by the bot.
     Tracker store slots must follow naming convention determined in
     LIFE_SITUATION_SLOTS dictionary to have an effect on recommendation.
+    Outputs recommendations as a carousel to the bot interface.
     """
 
+    method = 'recommend_service'
+    pipeline = recommendation_pipeline(LIFE_SITUATION_PARAMS, RenderCarousel())
+
     def name(self):
         return 'action_service_carousel_by_life_situation'
 
-    def run(self, dispatcher, tracker, domain):
-        """
-        Fetches slot values from the bot tracker store, validates slot values,
-        and calls service recommender api to fetch recommended services based on
-        the recommend service method.
-        Outputs recommendations as a carousel to the bot interface.
-        Results slot with recommended services.
-        """
-
-        api_params = ApiParams()
-
-        api_params.add_params(limit=self.validate_result_limit(tracker),
-                              rerank=ValidateSlots.validate_bool_slot(tracker, RERANK_SLOT),
-                              life_situation_meters=self.validate_feat(tracker),
-                              service_filters=self.validate_filters(tracker))
-
-        if show_request_parameters(tracker, SHOW_API_CALL_PARAMETERS_SLOT):
-            dispatcher.utter_message(f'hakuparametrit: {str(json.dumps(api_params.params))}')
-
-        try:
-            api = ServiceRecommenderAPI()
-
-            response = api.get_recommendations(params=api_params.params,
-                                               method='recommend_service')
-
-            if response.ok:
-                services = response.json()
-
-                ids = [service['service_id'] for service in services['recommended_services']]
-                names = [service['service_name'] for service in services['recommended_services']]
-
-                if not ids:
-                    dispatcher.utter_message(NO_SERVICES_MESSAGE)
-                else:
-                    dispatcher.utter_message('Palvelusuositukset:')
-
-                ct = CarouselTemplate()
-
-                for service_id, name in zip(ids, names):
-                    element = CarouselElement(service_id, name)
-                    ct.add_element(element)
-
-                dispatcher.utter_message(attachment=ct.template)
-            else:
-                dispatcher.utter_message(template=API_ERROR_MESSAGE)
-        except ConnectionError:
-            services = None
-            dispatcher.utter_message(template=API_ERROR_MESSAGE)
-
-        return [SlotSet(RECOMMENDATIONS_SLOT, services)]
-
-class ServiceListByTextSearch(Action, ValidateSlots):
+class ServiceListByTextSearch(RecommendationPipeline, Action):
     """
     Get service recommendations based on unstructured text input.
     Presents recommended services as a list.
     """
 
+    method = 'text_search'
+    pipeline = recommendation_pipeline(TEXT_SEARCH_PARAMS, RenderList(), local_rerank=True,
+                                       local_search=True, fanout=True)
+
     def name(self):
         return 'action_service_list_by_text_search'
 
-    def run(self, dispatcher, tracker, domain):
-        """
-        Fetches slot values from the bot tracker store, validates slot values,
-        and calls service recommender api to fetch recommended services based on
-        the text search method.
-        Outputs recommendations as a list to the bot interface.
-        Results slot with recommended services.
-        """
-
-        api_params = ApiParams()
-
-        api_params.add_params(limit=self.validate_result_limit(tracker),
-                              rerank=ValidateSlots.validate_bool_slot(tracker, RERANK_SLOT),
-                              search_text=self.validate_search_text(tracker),
-                              service_filters=self.validate_filters(tracker))
-
-        if show_request_parameters(tracker, SHOW_API_CALL_PARAMETERS_SLOT):
-            dispatcher.utter_message(f'hakuparametrit: {str(json.dumps(api_params.params))}')
-
-        try:
-            api = ServiceRecommenderAPI()
-
-            response = api.get_recommendations(params=api_params.params,
-                                               method='text_search')
-
-            if response.ok:
-                services = response.json()
-
-                ids = [service['service_id'] for service in services['recommended_services']]
-                names = [service['service_name'] for service in services['recommended_services']]
-
-                if not ids:
-                    dispatcher.utter_message(NO_SERVICES_MESSAGE)
-                else:
-                    dispatcher.utter_message('Palvelusuositukset:')
-
-                for service_id, name in zip(ids, names):
-                    element = CarouselElement(service_id, name)
-                    dispatcher.utter_message(template=f'Palvelu: {name}',
-                                             buttons=element.element['buttons'])
-            else:
-                dispatcher.utter_message(template=API_ERROR_MESSAGE)
-        except ConnectionError:
-            services = None
-            dispatcher.utter_message(template=API_ERROR_MESSAGE)
-
-        return [SlotSet(RECOMMENDATIONS_SLOT, services)]
-
-class ServiceCarouselByTextSearch(Action, ValidateSlots):
+class ServiceCarouselByTextSearch(RecommendationPipeline, Action):
     """
     Get service recommendations based on unstructured text input.
     Presents recommended services as a carousel.
     """
 
+    method = 'text_search'
+    pipeline = recommendation_pipeline(TEXT_SEARCH_PARAMS, RenderCarousel(), local_rerank=True,
+                                       local_search=True, fanout=True)
+
     def name(self):
         return 'action_service_carousel_by_text_search'
 
-    def run(self, dispatcher, tracker, domain):
-        """
-        Fetches slot values from the bot tracker store, validates slot values,
-        and calls service recommender api to fetch recommended services based on
-        the text search method.
-        Outputs recommendations as a carousel to the bot interface.
-        Results slot with recommended services.
-        """
-
-        api_params = ApiParams()
-
-        api_params.add_params(limit=self.validate_result_limit(tracker),
-                              rerank=ValidateSlots.validate_bool_slot(tracker, RERANK_SLOT),
-                              search_text=self.validate_search_text(tracker),
-                              service_filters=self.validate_filters(tracker))
-
-        if show_request_parameters(tracker, SHOW_API_CALL_PARAMETERS_SLOT):
-            dispatcher.utter_message(f'hakuparametrit: {str(json.dumps(api_params.params))}')
-
-        try:
-            api = ServiceRecommenderAPI()
-
-            response = api.get_recommendations(params=api_params.params,
-                                               method='text_search')
-
-            if response.ok:
-                services = response.json()
-
-                ids = [service['service_id'] for service in services['recommended_services']]
-                names = [service['service_name'] for service in services['recommended_services']]
-
-                if not ids:
-                    dispatcher.utter_message(NO_SERVICES_MESSAGE)
-                else:
-                    dispatcher.utter_message('Palvelusuositukset:')
-
-                ct = CarouselTemplate()
-
-                for service_id, name in zip(ids, names):
-                    element = CarouselElement(service_id, name)
-                    ct.add_element(element)
-
-                dispatcher.utter_message(attachment=ct.template)
-            else:
-                dispatcher.utter_message(template=API_ERROR_MESSAGE)
-        except ConnectionError:
-            services = None
-            dispatcher.utter_message(template=API_ERROR_MESSAGE)
-
-        return [SlotSet(RECOMMENDATIONS_SLOT, services)]
-
 class ActionRestarted(Action):
     """
     Restarts bot session.
@@ -613,6 +627,7 @@ class ActionRestarted(Action):
     def name(self):
         return 'action_restart_chat'
 
+    @measure_action
     def run(self, dispatcher, tracker, domain):
         return[Restarted()]
 
@@ -623,14 +638,12 @@ class ActionSlotReset(Action):
     def name(self):
         return 'action_slot_reset'
 
+    @measure_action
     def run(self, dispatcher, tracker, domain):
         return[AllSlotsReset()]
 
 def show_request_parameters(tracker, slot):
-    slot_value = ValidateSlots.validate_bool_slot(tracker, slot)
-    if not slot_value:
-        return False
-    return slot_value
+    return bool(ValidateSlots.validate_bool_slot(tracker, slot))
 """ -----------------------------------------------------------------------
     Down below actions are bot specific demos or use case specific actions
     rather than generic ones above. 
@@ -642,36 +655,17 @@ def show_request_parameters(tracker, slot):
     -----------------------------------------------------------------------
 """
 
-class ServiceDemo(Action, ValidateSlots):
+class DemoParams(Stage):
     """
-    Service recommendation using free text search demo action.
-    Slots are collected but not used to make the search
+    Parameters of ServiceDemo are hard coded to get the wanted results for demo
+    purposes. Only municipality is taken from the kunta slot.
     """
+    name = 'params'
 
-    def name(self):
-        return 'action_service_demo'
+    async def __call__(self, context):
+        code = find_municipality(context.tracker.get_slot('kunta')) or '297'
 
-    def run(self, dispatcher, tracker, domain):
-        """
-        Fetches slot values from the bot tracker store and makes a customized api call
-        to fetch wanted services
-        """
-
-        try:
-            toimiala = str(tracker.get_slot('toimiala'))
-        except:
-            toimiala = 'kauneudenhoito'
-
-        try:
-            kunta = str(tracker.get_slot('kunta')).lower().capitalize()
-            value_list = list(MUNICIPALITY_CODES.values())
-            key_list = list(MUNICIPALITY_CODES.keys())
-            code = key_list[value_list.index(kunta)]
-        except:
-            code = '297'
-
-        # parameters here are hard coded to get the wanted results for demo purposes
-        params = {
+        context.params = {
         'search_text': 'terveyden suojelu laki ilmoitus kuopiossa',
         'service_filters': {
             'include_national_services': False,
@@ -682,36 +676,26 @@ class ServiceDemo(Action, ValidateSlots):
         }
 
         # Enable if you want to display actual parameters sent to api!
-        dispatcher.utter_message(f'hakuparametrit: {str(params)}')
-
-        try:
-            api = ServiceRecommenderAPI()
-            response = api.get_recommendations(params=params,
-                                               method='text_search')
-
-            if response.ok:
-                services = response.json()
-                ids = [service['service_id'] for service in services['recommended_services']]
-                names = [service['service_name'] for service in services['recommended_services']]
-
-                if not ids:
-                    dispatcher.utter_message(NO_SERVICES_MESSAGE)
-                else:
-                    dispatcher.utter_message('Palvelusuositukset:')
+        context.dispatcher.utter_message(f'hakuparametrit: {str(context.params)}')
 
-                for service_id, name in zip(ids, names):
-                    element = CarouselElement(service_id, name)
-                    dispatcher.utter_message(template=f'Palvelu: {name}',
-                                            buttons=element.element['buttons'])
-            else:
-                dispatcher.utter_message(template=API_ERROR_MESSAGE)
-                dispatcher.utter_message(str(response))
+class ServiceDemo(RecommendationPipeline, Action):
+    """
+    Service recommendation using free text search demo action.
+    Slots are collected but not used to make the search
+    """
 
-        except ConnectionError:
-            services = None
-            dispatcher.utter_message(template=API_ERROR_MESSAGE)
+    method = 'text_search'
+    pipeline = Pipeline([
+        DemoParams(),
+        CacheLookup(),
+        UpstreamCall(),
+        ParseServices(error_messages=lambda response: [API_ERROR_MESSAGE, str(response)]),
+        RenderList(),
+        SetRecommendationsSlot()
+    ])
 
-        return[SlotSet(RECOMMENDATIONS_SLOT, services)]
+    def name(self):
+        return 'action_service_demo'
 
 class HNRedirectAction(Action):
     """
@@ -721,6 +705,7 @@ class HNRedirectAction(Action):
     def name(self):
         return 'action_hn_redirect'
 
+    @measure_action
     def run(self, dispatcher, tracker, domain):
         on_tampereella = tracker.get_slot('hn_asuu_tre_alue')
         on_nuori = tracker.get_slot('hn_on_13_17v')
@@ -739,7 +724,7 @@ class HNRedirectAction(Action):
         dispatcher.utter_message(template="utter_hn_ei_palvelun_piirissä")
         return []
 
-class WhiteBlackListByTextSearch(Action, ValidateSlots):
+class WhiteBlackListByTextSearch(RecommendationPipeline, Action):
     """
     Get service recommendations based on text search and whitelist/blacklist items.
     Purpose is to call aurora api service recommendation endpoint with blacklist and whitelist
@@ -748,148 +733,43 @@ class WhiteBlackListByTextSearch(Action, ValidateSlots):
     it is transparent to the user.
     """
 
+    method = 'text_search'
+    pipeline = recommendation_pipeline(WHITEBLACKLIST_PARAMS + ('whitelist', 'blacklist'),
+                                       RenderList(),
+                                       ranking=WhiteBlackListRanking(),
+                                       error_messages=lambda response: [response.text])
+
     def name(self):
         return 'action_service_list_by_whiteblack_text_search'
 
-    def run(self, dispatcher, tracker, domain):
-        """
-        Fetches slot values from the bot tracker store, validates slot values,
-        and calls service recommender api to fetch recommended services. Blacklist
-        and whitelist are passed also with the request eventhough endpoint doesn't
-        yet support them.
-        Outputs recommendations as a list to the bot interface.
-        Results slot with recommended services.
-        """
-
-        api_params = ApiParams()
-
-        api_params.add_params(limit=self.validate_result_limit(tracker),
-                              search_text=self.validate_search_text(tracker),
-                              service_filters=self.validate_filters(tracker))
-
-        try:
-            whitelist_text = tracker.get_slot(WHITELIST_SLOT)
-            blacklist_text = tracker.get_slot(BLACKLIST_SLOT)
-        except:
-            whitelist_text = 'NULL'
-            blacklist_text = 'NULL'
-
-        if not whitelist_text:
-            whitelist_text = 'NULL'
-        if not blacklist_text:
-            blacklist_text = 'NULL'
-
-        api_params.params['whitelist'] = whitelist_text
-        api_params.params['blacklist'] = blacklist_text
-
-        if show_request_parameters(tracker, SHOW_API_CALL_PARAMETERS_SLOT):
-            dispatcher.utter_message(f'hakuparametrit: {str(json.dumps(api_params.params))}')
-
-        try:
-            api = ServiceRecommenderAPI()
-
-            response = api.get_recommendations(params=api_params.params,
-                                               method='text_search')
-
-            if response.ok:
-                services = response.json()
-                wh = WhiteBlackList(services)
-                resorted_services = wh.resort_by_match(white=whitelist_text, black=blacklist_text)
-                new_services = resorted_services
-
-                ids = [service['service_id'] for service in new_services['recommended_services']]
-                names = [service['service_name'] for service in new_services['recommended_services']]
-
-                if not ids:
-                    dispatcher.utter_message(NO_SERVICES_MESSAGE)
-                else:
-                    dispatcher.utter_message('Palvelusuositukset:')
-
-                for service_id, name in zip(ids, names):
-                    element = CarouselElement(service_id, name)
-                    dispatcher.utter_message(template=f'Palvelu: {name}',
-                                             buttons=element.element['buttons'])
-
-                return [SlotSet(RECOMMENDATIONS_SLOT, services)]
-
-            else:
-                dispatcher.utter_message(template=response.text)
-        except ConnectionError:
-            services = None
-            dispatcher.utter_message(template=API_ERROR_MESSAGE)
-
-class WhiteBlackListByTextSearchSort(Action, ValidateSlots):
+class WhiteBlackListByTextSearchSort(RecommendationPipeline, Action):
     """
     Get service recommendations based on text search and whitelist/blacklist items.
     Purpose is to call aurora api service recommendation endpoint and sort results
     with blacklist and whitelist items in custom sorter.
     """
 
+    method = 'text_search'
+    pipeline = Pipeline([
+        ExtractSlots(*WHITEBLACKLIST_PARAMS, 'whitelist', 'blacklist'),
+        BuildParams(*WHITEBLACKLIST_PARAMS),
+        ShowParams(),
+        ShowSortParameters(),
+        CacheLookup(),
+        UpstreamCall(),
+        ParseServices(),
+        WhiteBlackListRanking(),
+        RenderList(),
+        SetRecommendationsSlot()
+    ])
+
     def name(self):
         return 'action_service_list_by_whiteblack_text_search_sorted'
 
-    def run(self, dispatcher, tracker, domain):
-        """
-        Fetches slot values from the bot tracker store, validates slot values,
-        and calls service recommender api to fetch recommended services. Recommendations
-        are sorted by simple sorter function which uses blacklisted and whitelisted slot
-        values for sorting services.
-        """
-
-        api_params = ApiParams()
-
-        api_params.add_params(limit=self.validate_result_limit(tracker),
-                              search_text=self.validate_search_text(tracker),
-                              service_filters=self.validate_filters(tracker))
-
-        try:
-            whitelist_text = tracker.get_slot(WHITELIST_SLOT)
-            blacklist_text = tracker.get_slot(BLACKLIST_SLOT)
-        except:
-            whitelist_text = 'NULL'
-            blacklist_text = 'NULL'
-
-        if not whitelist_text:
-            whitelist_text = 'NULL'
-        if not blacklist_text:
-            blacklist_text = 'NULL'
-
-        # Enable if you want to display actual parameters sent to api!
-        if show_request_parameters(tracker, SHOW_API_CALL_PARAMETERS_SLOT):
-            dispatcher.utter_message(f'hakuparametrit: {str(json.dumps(api_params.params))}')
-            dispatcher.utter_message(f'tulosten sorttausparametrit: whitelist: {whitelist_text}, blacklist: {blacklist_text} ')
-
-        try:
-            api = ServiceRecommenderAPI()
-
-            response = api.get_recommendations(params=api_params.params,
-                                               method='text_search')
-
-            if response.ok:
-                services = response.json()
-                wh = WhiteBlackList(services)
-                resorted_services = wh.resort_by_match(white=whitelist_text, black=blacklist_text)
-                new_services = resorted_services
-
-                ids = [service['service_id'] for service in new_services['recommended_services']]
-                names = [service['service_name'] for service in new_services['recommended_services']]
-
-                if not ids:
-                    dispatcher.utter_message(NO_SERVICES_MESSAGE)
-                else:
-                    dispatcher.utter_message('Palvelusuositukset:')
-
-                for service_id, name in zip(ids, names):
-                    element = CarouselElement(service_id, name)
-                    dispatcher.utter_message(template=f'Palvelu: {name}',
-                                             buttons=element.element['buttons'])
-            else:
-                dispatcher.utter_message(template=API_ERROR_MESSAGE)
-        except ConnectionError:
-            services = None
-            dispatcher.utter_message(template=API_ERROR_MESSAGE)
-
-        return [SlotSet(RECOMMENDATIONS_SLOT, services)]
+# Recommendations by life situation usually follow fetching of session attributes.
+# List and carousel actions build the same params, so one prefetch serves both.
+LIFE_SITUATION_PREFETCHER = Prefetcher(ServiceListByLifeSituation.pipeline.before('show_params'),
+                                       ServiceListByLifeSituation.method)
 
 class FetchSessionAttributes(Action):
     """
@@ -899,7 +779,9 @@ class FetchSessionAttributes(Action):
     def name(self):
         return 'action_fetch_session_attributes'
 
-    def run(self, dispatcher, tracker, domain):
+    @measure_action
+    @trace_action
+    async def run(self, dispatcher, tracker, domain):
         """
         Documentation
         """
@@ -908,8 +790,8 @@ class FetchSessionAttributes(Action):
         auroraai_access_token = metadata['auroraaiAccessToken']
 
         attribute_params = {'access_token': str(auroraai_access_token)}
-        session_attributes = SessionAttributesAPI()
-        response = session_attributes.get_attributes(params=attribute_params)
+        session_attributes = AsyncSessionAttributesAPI()
+        response = await session_attributes.get_attributes(params=attribute_params)
         attributes = response.json()
 
         # Store all fetched data into slots (atm data can contain [age, municipality_code, life_situation_meters])
@@ -924,18 +806,20 @@ class FetchSessionAttributes(Action):
             except:
                 pass
 
-        try:
-            all_slots.append(SlotSet(MUNICIPALITY_SLOT, str(attributes["municipality_code"])))
-            all_slots.append(SlotSet(MUNICIPALITY_FILTER_SLOT, str(attributes["municipality_code"])))
-            all_slots.append(SlotSet(MUNICIPALITY_NAME_SLOT, MUNICIPALITY_CODES[str(attributes["municipality_code"])]))
-        except:
-            pass
+        municipality_code = find_municipality(attributes.get("municipality_code"))
+        if municipality_code:
+            all_slots.append(SlotSet(MUNICIPALITY_SLOT, municipality_code))
+            all_slots.append(SlotSet(MUNICIPALITY_FILTER_SLOT, municipality_code))
+            all_slots.append(SlotSet(MUNICIPALITY_NAME_SLOT, municipality_name(municipality_code)))
 
         try:
             all_slots.append(SlotSet(AGE_SLOT, str(attributes["age"])))
         except:
             pass
 
+        if PREFETCH_RECOMMENDATIONS:
+            await LIFE_SITUATION_PREFETCHER.prefetch(tracker, all_slots)
+
         return all_slots
 
 class PostSessionAttributes(Action, ValidateSlots):
@@ -946,7 +830,9 @@ class PostSessionAttributes(Action, ValidateSlots):
     def name(self):
         return 'action_post_session_attributes'
 
-    def run(self, dispatcher, tracker, domain):
+    @measure_action
+    @trace_action
+    async def run(self, dispatcher, tracker, domain):
         """
         Documentation
         """
@@ -965,9 +851,9 @@ class PostSessionAttributes(Action, ValidateSlots):
                               session_attributes=attributes.params
                               )
 
-        api_for_session = SessionAttributesAPI()
+        api_for_session = AsyncSessionAttributesAPI()
 
-        response = api_for_session.post_attributes(params=api_params.params)
+        response = await api_for_session.post_attributes(params=api_params.params)
 
         URL = response.text
 
@@ -0,0 +1,133 @@
+""" Runs every action of actions.py end to end against a local stand-in of the
+aurora api, and reports throughput and latency percentiles per action.
+
+Run from the directory which contains the actions package:
+
+    python actions/benchmarks/bench_actions.py --runs 500 --concurrency 20 --latency 0.02
+    python actions/benchmarks/bench_actions.py --json before.json
+
+Response caches are disabled unless --cache is given, so that every run calls
+the stub api. Results written with --json can be compared between commits.
+"""
+import argparse
+import asyncio
+import inspect
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from rasa_sdk import Action, Tracker
+from rasa_sdk.executor import CollectingDispatcher
+
+from actions import actions
+from actions.servicerec import api
+from actions.utils import RECOMMENDATIONS_SLOT
+
+from stub_api import add_stub_arguments, stub_from_arguments
+from trackers import random_slots, tracker_state
+from report import summarize, format_table, write_json
+
+
+def action_classes(names: list = None) -> list:
+    """ Action classes defined in actions.py, optionally only the named ones. """
+    classes = [cls for cls in vars(actions).values()
+               if inspect.isclass(cls) and issubclass(cls, Action) and cls.__module__ == actions.__name__]
+    if names:
+        classes = [cls for cls in classes if cls().name() in names or cls.__name__ in names]
+    return classes
+
+
+def disable_caches():
+    for cache in api.RESPONSE_CACHES.values():
+        cache.maxsize = 0
+
+
+async def run_action(action: Action, tracker: Tracker):
+    dispatcher = CollectingDispatcher()
+    events = action.run(dispatcher, tracker, {})
+    if inspect.isawaitable(events):
+        events = await events
+    return events
+
+
+async def recommendations_for_show_info(rng: random.Random) -> dict:
+    """ Recommendations slot value as left by a recommendation action, for action_show_info. """
+    tracker = Tracker.from_dict(tracker_state('benchmark', random_slots(rng)))
+    events = await run_action(actions.ServiceListByTextSearch(), tracker)
+    return next(event['value'] for event in events if event.get('name') == RECOMMENDATIONS_SLOT)
+
+
+async def bench_action(action: Action, runs: int, concurrency: int, rng: random.Random,
+                       recommendations: dict) -> dict:
+    trackers = [Tracker.from_dict(tracker_state(f'benchmark-{i}', random_slots(rng, recommendations)))
+                for i in range(runs)]
+    latencies = []
+    errors = 0
+    queue = iter(trackers)
+
+    async def worker():
+        nonlocal errors
+        for tracker in queue:
+            started = time.perf_counter()
+            try:
+                await run_action(action, tracker)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    duration = time.perf_counter() - started
+
+    return summarize(action.name(), latencies, errors, duration)
+
+
+async def main_async(args) -> list:
+    stub = stub_from_arguments(args, seed=args.seed)
+    api.URL = await stub.start()
+
+    if not args.cache:
+        disable_caches()
+
+    rng = random.Random(args.seed)
+    results = []
+
+    try:
+        recommendations = await recommendations_for_show_info(rng)
+
+        for cls in action_classes(args.actions):
+            action = cls()
+            for _ in range(args.warmup):
+                await run_action(action, Tracker.from_dict(tracker_state('warmup', random_slots(rng, recommendations))))
+            results.append(await bench_action(action, args.runs, args.concurrency, rng, recommendations))
+    finally:
+        await api.close_async_session()
+        await stub.stop()
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark actions against a local aurora api stub.')
+    parser.add_argument('--runs', type=int, default=200, help='runs per action')
+    parser.add_argument('--concurrency', type=int, default=10, help='concurrent runs')
+    parser.add_argument('--warmup', type=int, default=5, help='runs per action before measuring')
+    parser.add_argument('--actions', nargs='*', help='names or class names of the actions to run, default all')
+    parser.add_argument('--cache', action='store_true', help='keep response caches enabled')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the random slot values')
+    parser.add_argument('--json', help='write results to this file')
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(main_async(args))
+
+    print(format_table(results))
+    if args.json:
+        write_json(args.json, results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
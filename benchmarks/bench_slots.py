@@ -0,0 +1,89 @@
+""" Benchmarks slot validation in isolation: reading every slot of a turn one by
+one with the validate methods of ValidateSlots, against one pass of
+slots.extract_slots into a SlotSnapshot.
+
+Run from the directory which contains the actions package:
+
+    python actions/benchmarks/bench_slots.py --runs 20000
+    python actions/benchmarks/bench_slots.py --json slots.json
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from rasa_sdk import Tracker
+
+from actions.actions import ValidateSlots, show_request_parameters, LIFE_SITUATION_PARAMS, TEXT_SEARCH_PARAMS
+from actions.slots import extract_slots
+from actions.utils import RERANK_SLOT, SHOW_API_CALL_PARAMETERS_SLOT, WHITELIST_SLOT, BLACKLIST_SLOT
+
+from trackers import random_slots, tracker_state
+from report import summarize, format_table, write_json
+
+
+def validate_per_slot(tracker: Tracker) -> dict:
+    """ Every slot validated with its own ValidateSlots call. """
+    validate = ValidateSlots()
+    return {
+        'limit': validate.validate_result_limit(tracker),
+        'rerank': validate.validate_bool_slot(tracker, RERANK_SLOT),
+        'age': validate.validate_age(tracker),
+        'municipality': validate.validate_municipality(tracker),
+        'search_text': validate.validate_search_text(tracker),
+        'life_situation_meters': validate.validate_feat(tracker),
+        'service_filters': validate.validate_filters(tracker),
+        'whitelist': validate.validate_sort_term(tracker, WHITELIST_SLOT),
+        'blacklist': validate.validate_sort_term(tracker, BLACKLIST_SLOT),
+        'show_params': show_request_parameters(tracker, SHOW_API_CALL_PARAMETERS_SLOT)
+    }
+
+
+EXTRACTORS = {
+    'per_slot': validate_per_slot,
+    'snapshot': lambda tracker: extract_slots(tracker),
+    'snapshot_life_situation': lambda tracker: extract_slots(tracker, LIFE_SITUATION_PARAMS + ('show_params',)),
+    'snapshot_text_search': lambda tracker: extract_slots(tracker, TEXT_SEARCH_PARAMS + ('show_params',))
+}
+
+
+def bench_extractor(name: str, extract, trackers: list) -> dict:
+    latencies = []
+    errors = 0
+
+    started = time.perf_counter()
+    for tracker in trackers:
+        run_started = time.perf_counter()
+        try:
+            extract(tracker)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - run_started)
+    duration = time.perf_counter() - started
+
+    return summarize(name, latencies, errors, duration)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark slot validation of recommendation actions.')
+    parser.add_argument('--runs', type=int, default=10000, help='trackers validated per extractor')
+    parser.add_argument('--extractors', nargs='*', choices=sorted(EXTRACTORS), help='extractors to run, default all')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the random slot values')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    trackers = [Tracker.from_dict(tracker_state(f'benchmark-{i}', random_slots(rng))) for i in range(args.runs)]
+
+    results = [bench_extractor(name, EXTRACTORS[name], trackers) for name in args.extractors or EXTRACTORS]
+
+    print(format_table(results))
+    if args.json:
+        write_json(args.json, results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+""" Load test of the action server webhook.
+
+Posts realistic action requests (random 3x10d meters, municipalities of
+MUNICIPALITY_CODES, search texts) for every action of actions.py concurrently
+to the /webhook endpoint. Concurrency is stepped up level by level, and latency
+percentiles, error rate and throughput are reported per level, together with
+the saturation point: the level after which throughput no longer grows, errors
+exceed --max-error-rate or p95 latency exceeds --slo-ms.
+
+Run from the directory which contains the actions package. With --spawn-server
+the tool starts the local api stub and an action server using it:
+
+    python actions/benchmarks/load_webhook.py --spawn-server --levels 1 2 4 8 16 32 64 --duration 10
+
+Against an already running action server (started with AURORA_API_ENDPOINT
+pointing to benchmarks/stub_api.py):
+
+    python actions/benchmarks/load_webhook.py --url http://localhost:5055/webhook
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import aiohttp
+import rasa_sdk
+
+from stub_api import add_stub_arguments, stub_from_arguments
+from trackers import random_slots, tracker_state
+from report import summarize, format_table, write_json
+from bench_actions import action_classes
+
+SERVER_START_TIMEOUT = 60
+
+
+def action_request(action_name: str, sender_id: str, rng: random.Random, recommendations: dict) -> dict:
+    """ Body of a webhook request as sent by rasa. """
+    return {
+        'next_action': action_name,
+        'sender_id': sender_id,
+        'tracker': tracker_state(sender_id, random_slots(rng, recommendations)),
+        'domain': {},
+        'version': rasa_sdk.__version__
+    }
+
+
+async def run_level(url: str, action_names: list, concurrency: int, duration: float,
+                    rng: random.Random, recommendations: dict, timeout: float) -> tuple:
+    """ Posts requests with the given number of concurrent conversations for
+        duration seconds. Returns summary of the level and summaries per action. """
+    latencies = {name: [] for name in action_names}
+    errors = {name: 0 for name in action_names}
+    deadline = time.perf_counter() + duration
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+
+        async def conversation(index: int):
+            sender_id = f'load-{concurrency}-{index}'
+            while time.perf_counter() < deadline:
+                action_name = rng.choice(action_names)
+                body = action_request(action_name, sender_id, rng, recommendations)
+                started = time.perf_counter()
+                try:
+                    async with session.post(url, json=body) as response:
+                        await response.read()
+                        failed = response.status != 200
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    failed = True
+                latencies[action_name].append(time.perf_counter() - started)
+                errors[action_name] += failed
+
+        started = time.perf_counter()
+        await asyncio.gather(*[conversation(i) for i in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    level = summarize(f'concurrency {concurrency}', all_latencies, sum(errors.values()), elapsed)
+    level['concurrency'] = concurrency
+    per_action = [summarize(f'{concurrency} {name}', latencies[name], errors[name], elapsed)
+                  for name in action_names if latencies[name]]
+    return level, per_action
+
+
+def saturation_point(levels: list, min_gain: float, max_error_rate: float, slo_ms: float = None):
+    """ Returns (level, reason) of the first level which is saturated: throughput
+        grows less than min_gain over the previous level, error rate is above
+        max_error_rate or p95 latency is above slo_ms. None if no level is saturated. """
+    previous = None
+
+    for level in levels:
+        if level['error_rate'] > max_error_rate:
+            return level, f'error rate {level["error_rate"]:.1%}'
+        if slo_ms is not None and level['p95_ms'] > slo_ms:
+            return level, f'p95 {level["p95_ms"]:.1f} ms'
+        if previous is not None and level['throughput'] < previous['throughput'] * (1 + min_gain):
+            return level, f'throughput {level["throughput"]:.1f}/s vs {previous["throughput"]:.1f}/s'
+        previous = level
+
+    return None, None
+
+
+async def wait_for_server(url: str, process: subprocess.Popen):
+    health_url = url.rsplit('/', 1)[0] + '/health'
+    deadline = time.perf_counter() + SERVER_START_TIMEOUT
+
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError('Action server exited')
+            try:
+                async with session.get(health_url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+
+    raise RuntimeError('Action server did not start')
+
+
+def spawn_server(port: int, api_url: str) -> subprocess.Popen:
+    """ Starts an action server of the actions package which uses the api at api_url. """
+    env = dict(os.environ, AURORA_API_ENDPOINT=api_url)
+    cwd = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return subprocess.Popen([sys.executable, '-m', 'rasa_sdk', '--actions', 'actions', '--port', str(port)],
+                            cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def main_async(args) -> tuple:
+    stub = stub_from_arguments(args, seed=args.seed)
+    rng = random.Random(args.seed)
+    recommendations = {'recommended_services': stub.services}
+    action_names = args.actions or [cls().name() for cls in action_classes()]
+
+    server = None
+    url = args.url
+
+    if args.spawn_server:
+        api_url = await stub.start(port=args.stub_port)
+        server = spawn_server(args.server_port, api_url)
+        url = f'http://127.0.0.1:{args.server_port}/webhook'
+
+    levels = []
+    per_action = []
+
+    try:
+        if server is not None:
+            await wait_for_server(url, server)
+
+        for concurrency in args.levels:
+            level, actions = await run_level(url, action_names, concurrency, args.duration,
+                                             rng, recommendations, args.timeout)
+            levels.append(level)
+            per_action += actions
+            print(f'concurrency {concurrency}: {level["throughput"]:.1f} req/s, '
+                  f'p95 {level["p95_ms"]:.1f} ms, errors {level["error_rate"]:.1%}', file=sys.stderr)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        await stub.stop()
+
+    return levels, per_action
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the action server webhook.')
+    parser.add_argument('--url', default='http://localhost:5055/webhook', help='webhook of the action server')
+    parser.add_argument('--spawn-server', action='store_true',
+                        help='start the api stub and an action server using it')
+    parser.add_argument('--server-port', type=int, default=5056, help='port of the spawned action server')
+    parser.add_argument('--stub-port', type=int, default=0, help='port of the api stub, default any free port')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64],
+                        help='numbers of concurrent conversations, run in order')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per level')
+    parser.add_argument('--timeout', type=float, default=30, help='request timeout in seconds')
+    parser.add_argument('--actions', nargs='*', help='action names to call, default all actions')
+    parser.add_argument('--min-gain', type=float, default=0.05,
+                        help='throughput growth between levels below which the server is saturated')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='highest acceptable error rate')
+    parser.add_argument('--slo-ms', type=float, help='highest acceptable p95 latency in milliseconds')
+    parser.add_argument('--per-action', action='store_true', help='report also per action and level')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the random slot values')
+    parser.add_argument('--json', help='write results to this file')
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    levels, per_action = asyncio.run(main_async(args))
+
+    print(format_table(levels))
+    if args.per_action:
+        print()
+        print(format_table(per_action))
+
+    saturated, reason = saturation_point(levels, args.min_gain, args.max_error_rate, args.slo_ms)
+    if saturated is None:
+        print(f'\nNot saturated up to concurrency {levels[-1]["concurrency"]}')
+    else:
+        index = levels.index(saturated)
+        sustained = levels[index - 1]['concurrency'] if index > 0 else None
+        print(f'\nSaturated at concurrency {saturated["concurrency"]} ({reason}), '
+              f'sustained concurrency {sustained}')
+
+    if args.json:
+        write_json(args.json, levels + per_action, vars(args))
+
+
+if __name__ == '__main__':
+    main()
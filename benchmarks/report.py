@@ -0,0 +1,60 @@
+""" Latency statistics and result tables of benchmarks and load tests. """
+import json
+import math
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """ Nearest-rank percentile of sorted values, 0 if there are none. """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(name: str, latencies: list, errors: int, duration: float) -> dict:
+    """ Summary of the runs of one benchmark. Latencies are in seconds, as is duration
+        (wall clock time of all runs). """
+    latencies = sorted(latencies)
+    runs = len(latencies)
+    return {
+        'name': name,
+        'runs': runs,
+        'errors': errors,
+        'error_rate': errors / runs if runs else 0.0,
+        'throughput': runs / duration if duration > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0.0) * 1000
+    }
+
+
+# Column, width and number format of result tables.
+COLUMNS = (
+    ('runs', 7, 'd'),
+    ('errors', 7, 'd'),
+    ('throughput', 11, '.1f'),
+    ('p50_ms', 9, '.2f'),
+    ('p95_ms', 9, '.2f'),
+    ('p99_ms', 9, '.2f'),
+    ('max_ms', 9, '.2f')
+)
+
+
+def format_table(results: list, columns: tuple = COLUMNS) -> str:
+    """ Results as a text table with a row per benchmark. """
+    name_width = max([len('name')] + [len(result['name']) for result in results])
+    lines = ['name'.ljust(name_width) + ''.join(column.rjust(width + 1) for column, width, _ in columns)]
+
+    for result in results:
+        lines.append(result['name'].ljust(name_width) +
+                     ''.join(format(result[column], number_format).rjust(width + 1)
+                             for column, width, number_format in columns))
+
+    return '\n'.join(lines)
+
+
+def write_json(path: str, results: list, settings: dict):
+    """ Writes results with the settings used, for comparing runs of different commits. """
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'settings': settings, 'results': results}, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,143 @@
+""" Local stand-in of the aurora api for benchmarks and load tests.
+
+Implements recommend_service, text_search and session_attributes with
+configurable latency and payload size:
+
+    python benchmarks/stub_api.py --port 8081 --latency 0.05 --services 10
+
+and point AURORA_API_ENDPOINT of the action server to http://127.0.0.1:8081/.
+"""
+import argparse
+import asyncio
+import random
+
+from aiohttp import web
+
+ACCESS_TOKEN = 'stub-access-token'
+
+SEARCH_WORDS = ('nuoret', 'työttömyys', 'asuminen', 'terveys', 'perhe', 'opiskelu',
+                'talous', 'mielenterveys', 'harrastukset', 'vanhemmat')
+
+
+def make_service(index: int, description_length: int, channels: int) -> dict:
+    words = ' '.join(SEARCH_WORDS[(index + i) % len(SEARCH_WORDS)] for i in range(description_length // 10 + 1))
+    return {
+        'service_id': f'00000000-0000-0000-0000-{index:012d}',
+        'service_name': f'Palvelu {index}',
+        'service_description': words[:description_length],
+        'service_channels': [{
+            'service_channel_id': f'10000000-0000-0000-0000-{index * 100 + channel:012d}',
+            'service_channel_name': f'Palvelukanava {index}.{channel}',
+            'emails': [f'palvelu{index}@example.fi'],
+            'phone_numbers': ['+358 40 1234567'],
+            'address': f'Esimerkkikatu {index}, 00100 Helsinki',
+            'service_hours': ['ma-pe 8-16'],
+            'web_pages': [f'https://palvelu{index}.example.fi']
+        } for channel in range(channels)]
+    }
+
+
+class StubApi:
+    """
+    Aurora api stand-in. Every request waits latency seconds (plus up to jitter
+    seconds) before responding. Recommendation methods return limit (at most
+    services) services, each with a description of description_length characters
+    and the given number of service channels. A share of error_rate requests
+    fails with status 500.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, services: int = 10,
+                 description_length: int = 500, channels: int = 2, error_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.services = [make_service(i, description_length, channels) for i in range(services)]
+        self.requests = {}
+        self._runner = None
+        self.url = None
+
+    async def _wait(self, method: str) -> bool:
+        """ Waits the latency of a request and tells whether it fails. """
+        self.requests[method] = self.requests.get(method, 0) + 1
+        await asyncio.sleep(self.latency + self.jitter * self.random.random())
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    async def recommend(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = await request.json()
+
+        if await self._wait(method):
+            return web.json_response({'detail': 'stub error'}, status=500)
+
+        limit = int(params.get('limit') or len(self.services))
+        return web.json_response({'recommended_services': self.services[:limit]})
+
+    async def post_session_attributes(self, request: web.Request) -> web.Response:
+        await request.json()
+
+        if await self._wait('session_attributes'):
+            return web.Response(text='stub error', status=500)
+
+        return web.Response(text=f'https://stub.example.fi/?auroraai_access_token={ACCESS_TOKEN}')
+
+    async def get_session_attributes(self, request: web.Request) -> web.Response:
+        if await self._wait('session_attributes'):
+            return web.json_response({'detail': 'stub error'}, status=500)
+
+        return web.json_response({
+            'age': 30,
+            'municipality_code': '837',
+            'life_situation_meters': {'family': [5], 'health': [7]}
+        })
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/session_attributes', self.post_session_attributes)
+        app.router.add_get('/session_attributes', self.get_session_attributes)
+        app.router.add_post('/{method:recommend_service|text_search}', self.recommend)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """ Starts serving and returns url of the api. """
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}/'
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds each api request takes')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency in seconds')
+    parser.add_argument('--services', type=int, default=10, help='services in a response at most')
+    parser.add_argument('--description-length', type=int, default=500, help='characters in a service description')
+    parser.add_argument('--channels', type=int, default=2, help='service channels of a service')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing with 500')
+
+
+def stub_from_arguments(args, seed: int = None) -> StubApi:
+    return StubApi(latency=args.latency, jitter=args.jitter, services=args.services,
+                   description_length=args.description_length, channels=args.channels,
+                   error_rate=args.error_rate, seed=seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a local stand-in of the aurora api.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    web.run_app(stub_from_arguments(args).app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
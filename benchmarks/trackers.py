@@ -0,0 +1,84 @@
+""" Realistic tracker states for benchmarks and load tests. """
+import random
+
+from actions.classification_codes import MUNICIPALITY_CODES
+from actions.utils import (
+    LIFE_SITUATION_SLOTS,
+    MUNICIPALITY_SLOT,
+    MUNICIPALITY_FILTER_SLOT,
+    SEARCH_TEXT_SLOT,
+    RESULT_LIMIT_SLOT,
+    RERANK_SLOT,
+    AGE_SLOT,
+    SESSION_TRANSFER_TARGET_SERVICE_SLOT,
+    RECOMMENDATIONS_SLOT,
+    BUTTON_PRESSED_SLOT,
+    WHITELIST_SLOT,
+    BLACKLIST_SLOT
+)
+
+SEARCH_TEXTS = (
+    'nuorten työttömyys',
+    'asumisen tuki',
+    'mielenterveyspalvelut nuorille',
+    'lapsiperheen kotipalvelu',
+    'velkaneuvonta',
+    'harrastukset ja vapaa-aika',
+    'opiskelijan terveydenhuolto',
+    'omaishoidon tuki',
+    'työkokeilu',
+    'päihdepalvelut'
+)
+
+SORT_TERMS = ('nuoret', 'perhe', 'terveys', 'talous', None)
+
+TARGET_SERVICES = ('fc66cd13-ae36-4592-b18d-e095a8d9a481', 'a24bd700-290a-41d8-b64a-8746ea20851b')
+
+BUTTONS = ('moreinfo', 'contactinfo', 'homepage')
+
+
+def random_slots(rng: random.Random, recommendations: dict = None) -> dict:
+    """ Slot values of a conversation: random 3x10d meters, a municipality as code or
+        name (sometimes misspelled), a search text and the other slots read by the actions. """
+    meters = rng.sample(sorted(LIFE_SITUATION_SLOTS), rng.randint(1, len(LIFE_SITUATION_SLOTS)))
+    code, name = rng.choice(sorted(MUNICIPALITY_CODES.items()))
+
+    municipality = rng.choice((code, name, name.lower(), name[:-1]))
+
+    slots = {LIFE_SITUATION_SLOTS[meter]: str(rng.randint(0, 10)) for meter in meters}
+    slots.update({
+        MUNICIPALITY_SLOT: municipality,
+        MUNICIPALITY_FILTER_SLOT: [municipality],
+        SEARCH_TEXT_SLOT: rng.choice(SEARCH_TEXTS),
+        RESULT_LIMIT_SLOT: str(rng.randint(3, 10)),
+        RERANK_SLOT: rng.choice(('yes', 'no', None)),
+        AGE_SLOT: str(rng.randint(13, 90)),
+        WHITELIST_SLOT: rng.choice(SORT_TERMS),
+        BLACKLIST_SLOT: rng.choice(SORT_TERMS),
+        SESSION_TRANSFER_TARGET_SERVICE_SLOT: rng.choice(TARGET_SERVICES),
+        'kunta': name,
+        'session_started_metadata': {'auroraaiAccessToken': 'stub-access-token'}
+    })
+
+    if recommendations:
+        services = recommendations.get('recommended_services') or []
+        slots[RECOMMENDATIONS_SLOT] = recommendations
+        if services:
+            service = rng.choice(services)
+            slots[BUTTON_PRESSED_SLOT] = f'{service["service_id"]}_{rng.choice(BUTTONS)}'
+
+    return slots
+
+
+def tracker_state(sender_id: str, slots: dict) -> dict:
+    """ Tracker as sent to the action server in the tracker field of a webhook request. """
+    return {
+        'sender_id': sender_id,
+        'slots': slots,
+        'latest_message': {'intent': {}, 'entities': [], 'text': None},
+        'events': [],
+        'paused': False,
+        'followup_action': None,
+        'active_loop': {},
+        'latest_action_name': None
+    }
@@ -333,6 +333,68 @@ MUNICIPALITY_CODES = {
     "992": "Äänekoski"
 }
 
+# Swedish names of bilingual municipalities and of municipalities with an established Swedish name.
+MUNICIPALITY_SWEDISH_NAMES = {
+    "049": "Esbo",
+    "075": "Fredrikshamn",
+    "078": "Hangö",
+    "091": "Helsingfors",
+    "092": "Vanda",
+    "106": "Hyvinge",
+    "109": "Tavastehus",
+    "149": "Ingå",
+    "186": "Träskända",
+    "202": "S:t Karins",
+    "205": "Kajana",
+    "231": "Kaskö",
+    "235": "Grankulla",
+    "245": "Kervo",
+    "257": "Kyrkslätt",
+    "272": "Karleby",
+    "280": "Korsnäs",
+    "287": "Kristinestad",
+    "288": "Kronoby",
+    "322": "Kimitoön",
+    "398": "Lahtis",
+    "405": "Villmanstrand",
+    "407": "Lappträsk",
+    "423": "Lundo",
+    "434": "Lovisa",
+    "440": "Larsmo",
+    "444": "Lojo",
+    "445": "Pargas",
+    "475": "Malax",
+    "478": "Mariehamn",
+    "491": "S:t Michel",
+    "499": "Korsholm",
+    "504": "Mörskom",
+    "529": "Nådendal",
+    "545": "Närpes",
+    "564": "Uleåborg",
+    "598": "Jakobstad",
+    "599": "Pedersöre",
+    "609": "Björneborg",
+    "611": "Borgnäs",
+    "624": "Pyttis",
+    "638": "Borgå",
+    "678": "Brahestad",
+    "680": "Reso",
+    "684": "Raumo",
+    "710": "Raseborg",
+    "740": "Nyslott",
+    "753": "Sibbo",
+    "755": "Sjundeå",
+    "837": "Tammerfors",
+    "851": "Torneå",
+    "853": "Åbo",
+    "858": "Tusby",
+    "893": "Nykarleby",
+    "895": "Nystad",
+    "905": "Vasa",
+    "927": "Vichtis",
+    "946": "Vörå"
+}
+
 HOSPITAL_DISTRICT_CODES = {
     "00": "Ahvenanmaa",
     "03": "Varsinais-Suomen SHP",
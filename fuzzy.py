@@ -0,0 +1,142 @@
+""" Approximate string matching for correcting typos in user input, e.g. municipality names. """
+import threading
+from collections import OrderedDict
+
+
+def edit_distance(a: str, b: str) -> int:
+    """ Number of single character insertions, deletions, substitutions and
+        transpositions of adjacent characters needed to turn a into b
+        (optimal string alignment distance). """
+    if a == b:
+        return 0
+    if not a:
+        return len(b)
+    if not b:
+        return len(a)
+
+    previous_row = None
+    row = list(range(len(b) + 1))
+
+    for i in range(1, len(a) + 1):
+        before_previous_row, previous_row = previous_row, row
+        row = [i] + [0] * len(b)
+
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            row[j] = min(previous_row[j] + 1,
+                         row[j - 1] + 1,
+                         previous_row[j - 1] + cost)
+
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], before_previous_row[j - 2] + 1)
+
+    return row[-1]
+
+
+def deletions(text: str, max_distance: int) -> set:
+    """ Strings made by deleting at most max_distance characters from text. """
+    result = {text}
+    edge = {text}
+
+    for _ in range(max_distance):
+        edge = {word[:i] + word[i + 1:] for word in edge for i in range(len(word))} - result
+        result |= edge
+
+    return result
+
+
+class DeletionIndex:
+    """
+    Symmetric deletion index of strings. Two strings within edit distance k of
+    each other share a string made by deleting at most k characters from each,
+    so candidates of a query are found with dictionary lookups of the deletions
+    of the query, and only they are compared with edit_distance.
+    """
+
+    def __init__(self, items: dict, max_distance: int = 2):
+        self.max_distance = max_distance
+        self.items = dict(items)
+        self.index = {}
+
+        for key in self.items:
+            for deletion in deletions(key, max_distance):
+                self.index.setdefault(deletion, set()).add(key)
+
+    def search(self, query: str, max_distance: int) -> list:
+        """ Returns (distance, key, value) tuples of keys within max_distance of
+            query, closest first. """
+        max_distance = min(max_distance, self.max_distance)
+        candidates = set()
+
+        for deletion in deletions(query, max_distance):
+            candidates |= self.index.get(deletion, set())
+
+        matches = []
+        for key in candidates:
+            if abs(len(key) - len(query)) > max_distance:
+                continue
+            distance = edit_distance(query, key)
+            if distance <= max_distance:
+                matches.append((distance, key, self.items[key]))
+
+        matches.sort(key=lambda match: (match[0], match[1]))
+        return matches
+
+
+class FuzzyMatcher:
+    """
+    Matches text to the values of a normalized key -> value index allowing typos.
+    A match is accepted if its confidence (1 - distance / length of text) is at
+    least min_confidence and no other value is equally close. Results are kept
+    in a bounded cache.
+
+    Attributes
+    ----------
+    min_confidence : float
+        lowest accepted confidence of a match.
+    max_distance : int
+        largest accepted edit distance regardless of text length.
+    min_length : int
+        shorter texts are not matched approximately.
+    """
+
+    def __init__(self, index: dict, min_confidence: float = 0.8, max_distance: int = 2,
+                 min_length: int = 4, cache_size: int = 1024):
+        self.index = DeletionIndex(index, max_distance=max_distance)
+        self.min_confidence = min_confidence
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allowed_distance(self, text: str) -> int:
+        if len(text) < self.min_length:
+            return 0
+        return min(self.max_distance, int(len(text) * (1 - self.min_confidence) + 1e-9))
+
+    def match(self, text: str):
+        """ Returns value of the closest key or None if there is no confident match. """
+        with self._lock:
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                return self._cache[text]
+
+        max_distance = self.allowed_distance(text)
+        value = None
+
+        if max_distance > 0:
+            matches = self.index.search(text, max_distance)
+            if matches:
+                best_distance = matches[0][0]
+                best_values = {matched_value for distance, _, matched_value in matches
+                               if distance == best_distance}
+                if len(best_values) == 1:
+                    value = best_values.pop()
+
+        with self._lock:
+            self._cache[text] = value
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return value
@@ -0,0 +1,265 @@
+""" Versioned snapshots of the koodisto.fi classification codes used by the api filters.
+
+A snapshot is compiled from koodisto exports with
+
+    python -m actions.koodisto compile --version 2022-06-01 --output koodisto.json \
+        region=maakunta.csv municipality=kunta.json ...
+
+and taken into use by pointing KOODISTO_SNAPSHOT environment variable to the file.
+Without exports the snapshot is compiled from classification_codes.py. The action
+server checks the snapshot file for changes every KOODISTO_RELOAD_INTERVAL seconds
+and swaps to a new snapshot without a restart.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from actions.classification_codes import (
+    REGION_CODES,
+    MUNICIPALITY_CODES,
+    MUNICIPALITY_SWEDISH_NAMES,
+    HOSPITAL_DISTRICT_CODES,
+    SERVICE_CLASS_CODES,
+    TARGET_GROUP_CODES,
+    SERCVICE_COLLECTION_CODES
+)
+
+SNAPSHOT_FORMAT = 1
+
+# Tables of a snapshot and their content in classification_codes.py.
+CLASSIFICATION_CODE_TABLES = {
+    'region': REGION_CODES,
+    'municipality': MUNICIPALITY_CODES,
+    'municipality_sv': MUNICIPALITY_SWEDISH_NAMES,
+    'hospital_district': HOSPITAL_DISTRICT_CODES,
+    'service_class': SERVICE_CLASS_CODES,
+    'target_group': TARGET_GROUP_CODES,
+    'service_collection': SERCVICE_COLLECTION_CODES
+}
+
+# Field of a koodisto export used as the value of a code. Other tables use the finnish label.
+EXPORT_VALUE_FIELDS = {
+    'service_class': 'uri'
+}
+
+
+def snapshot_table(name: str, rows) -> dict:
+    """ Code table of the rows of a snapshot file, which are [code, value] pairs. """
+    if not isinstance(rows, list) or not all(isinstance(row, list) and len(row) == 2 and isinstance(row[0], str)
+                                             for row in rows):
+        raise ValueError(f'Table {name} of a koodisto snapshot is not a list of [code, value] rows')
+    return dict(rows)
+
+
+class KoodistoSnapshot:
+    """
+    Immutable set of code tables with a version. Data derived from the tables
+    (e.g. lookup indexes) can be memoized with cached(), so that it is rebuilt
+    automatically when a new snapshot is taken into use.
+    """
+
+    def __init__(self, tables: dict, version: str):
+        self.version = version
+        self._tables = {name: dict(sorted(codes.items())) for name, codes in tables.items()}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> dict:
+        """ Returns codes of the table as code -> value dictionary. Must not be modified. """
+        return self._tables.get(name, {})
+
+    @property
+    def tables(self):
+        return list(self._tables)
+
+    def cached(self, key, build):
+        """ Returns build() memoized by key for the lifetime of the snapshot. """
+        try:
+            return self._cache[key]
+        except KeyError:
+            with self._lock:
+                if key not in self._cache:
+                    self._cache[key] = build()
+                return self._cache[key]
+
+    @classmethod
+    def from_classification_codes(cls):
+        return cls(CLASSIFICATION_CODE_TABLES, version='classification_codes')
+
+    @classmethod
+    def load(cls, path: str):
+        """ Reads a snapshot written by write(). Raises ValueError if the file is
+            not a snapshot of SNAPSHOT_FORMAT, so that a malformed file never
+            replaces the snapshot in use. """
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+
+        if not isinstance(data, dict) or data.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f'Unsupported koodisto snapshot format in {path}')
+
+        tables = data.get('tables')
+        if not isinstance(tables, dict) or not isinstance(data.get('version'), str):
+            raise ValueError(f'Koodisto snapshot {path} has no version or tables')
+
+        return cls({name: snapshot_table(name, rows) for name, rows in tables.items()}, version=data['version'])
+
+    def write(self, path: str):
+        """ Writes snapshot atomically, so a running server never reads a partial file.
+            Tables are stored as rows sorted by code. """
+        data = {
+            'format': SNAPSHOT_FORMAT,
+            'version': self.version,
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'tables': {name: list(codes.items()) for name, codes in self._tables.items()}
+        }
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class KoodistoStore:
+    """
+    Holds the snapshot in use. Snapshot is loaded on first use from path, or
+    from classification_codes.py if path is not set. The file is checked for
+    changes at most every reload_interval seconds, and a changed file is loaded
+    and swapped in. If loading fails, the previous snapshot is kept.
+    """
+
+    def __init__(self, path: str = None, reload_interval: float = 60, clock=time.monotonic):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.clock = clock
+        self._snapshot = None
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def snapshot(self) -> KoodistoSnapshot:
+        snapshot = self._snapshot
+
+        if snapshot is None or (self.path and self.clock() - self._checked >= self.reload_interval):
+            with self._lock:
+                if self._snapshot is None or self.clock() - self._checked >= self.reload_interval:
+                    self._refresh()
+            snapshot = self._snapshot
+
+        return snapshot
+
+    def _refresh(self):
+        self._checked = self.clock()
+
+        if not self.path:
+            if self._snapshot is None:
+                self._snapshot = KoodistoSnapshot.from_classification_codes()
+            return
+
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime != self._mtime:
+                self._snapshot = KoodistoSnapshot.load(self.path)
+                self._mtime = mtime
+        except (OSError, ValueError, KeyError):
+            if self._snapshot is None:
+                self._snapshot = KoodistoSnapshot.from_classification_codes()
+
+    def reload(self):
+        """ Checks the snapshot file immediately. """
+        with self._lock:
+            self._refresh()
+        return self._snapshot
+
+    def swap(self, snapshot: KoodistoSnapshot):
+        """ Takes the given snapshot into use. """
+        with self._lock:
+            self._snapshot = snapshot
+            self._checked = self.clock()
+
+    def table(self, name: str) -> dict:
+        return self.snapshot.table(name)
+
+
+KOODISTO = KoodistoStore(path=os.getenv('KOODISTO_SNAPSHOT'),
+                         reload_interval=float(os.getenv('KOODISTO_RELOAD_INTERVAL', 60)))
+
+
+def read_export(path: str) -> list:
+    """ Reads a koodisto.fi code list export (json or csv) into a list of
+        dictionaries with code, fi, sv and uri keys. """
+    if path.endswith('.csv'):
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            rows = [{key.lower(): value for key, value in row.items()} for row in csv.DictReader(f)]
+        return [{'code': row.get('codevalue'),
+                 'fi': row.get('preflabel_fi'),
+                 'sv': row.get('preflabel_sv'),
+                 'uri': row.get('uri')} for row in rows]
+
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        data = data.get('results', [])
+
+    return [{'code': item.get('codeValue'),
+             'fi': item.get('prefLabel', {}).get('fi'),
+             'sv': item.get('prefLabel', {}).get('sv'),
+             'uri': item.get('uri')} for item in data]
+
+
+def compile_tables(exports: dict) -> dict:
+    """ Compiles code tables from exports given as table name -> export path.
+        Tables without an export are taken from classification_codes.py. """
+    tables = {name: dict(codes) for name, codes in CLASSIFICATION_CODE_TABLES.items()}
+
+    for name, path in exports.items():
+        if name not in CLASSIFICATION_CODE_TABLES:
+            raise ValueError(f'Unknown koodisto table: {name}')
+
+        rows = [row for row in read_export(path) if row['code']]
+        value_field = EXPORT_VALUE_FIELDS.get(name, 'fi')
+        tables[name] = {row['code']: row[value_field] for row in rows if row[value_field]}
+
+        if name == 'municipality':
+            tables['municipality_sv'] = {row['code']: row['sv'] for row in rows
+                                         if row['sv'] and row['sv'] != row['fi']}
+
+    return tables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compile koodisto exports into a snapshot.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    compile_parser = subparsers.add_parser('compile')
+    compile_parser.add_argument('--output', required=True, help='path of the snapshot file')
+    compile_parser.add_argument('--version', default=datetime.now(timezone.utc).strftime('%Y-%m-%d'),
+                                help='version of the snapshot, defaults to current date')
+    compile_parser.add_argument('exports', nargs='*', metavar='TABLE=PATH',
+                                help=f'koodisto export of a table, tables: {", ".join(CLASSIFICATION_CODE_TABLES)}')
+
+    args = parser.parse_args(argv)
+
+    exports = dict(export.split('=', 1) for export in args.exports)
+    snapshot = KoodistoSnapshot(compile_tables(exports), version=args.version)
+    snapshot.write(args.output)
+
+    for name in snapshot.tables:
+        print(f'{name}: {len(snapshot.table(name))} codes')
+    print(f'Wrote koodisto snapshot {snapshot.version} to {args.output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
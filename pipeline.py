@@ -0,0 +1,335 @@
+""" Recommendation pipeline shared by the service recommendation actions.
+
+A recommendation is made by running a sequence of stages over a PipelineContext:
+
+    slot extraction -> param building -> cache -> upstream call -> parse
+    -> post ranking -> rendering -> recommendations slot
+
+Stages are small objects with a name and an async __call__(context). Actions
+are configured with a Pipeline of stages, so a stage can be swapped (e.g. a
+different ranking or rendering) without touching the others. Duration of every
+stage is recorded in context.timings and in the stage duration metric.
+"""
+import asyncio
+import time
+
+from rasa_sdk.events import SlotSet
+
+from actions import search_index
+from actions.servicerec.api import AsyncServiceRecommenderAPI, ApiResponse
+from actions.servicerec.metrics import STAGE_DURATION, FALLBACK_MESSAGES, PREFETCHES, measure_action
+from actions.servicerec.tracing import span, trace_action
+from actions.utils import API_ERROR_MESSAGE, RECOMMENDATIONS_SLOT, compact_recommendations
+
+
+class PipelineContext:
+    """
+    State of one run of a pipeline.
+
+    Attributes
+    ----------
+    slots : dict
+        validated slot values by name.
+    snapshot : SlotSnapshot
+        validated slot values of the turn (see slots.py), None until extracted.
+    params : dict
+        parameters of the api call.
+    response : ApiResponse
+        response of the api, cached or fetched.
+    services : dict
+        recommendations parsed from the response, None if there are none.
+    ranked_services : dict
+        recommendations in the order they are shown.
+    events : list
+        events returned by the action.
+    stopped : bool
+        set by a stage which ended the run, e.g. after an api error.
+    timings : dict
+        duration of each stage in seconds.
+    """
+
+    def __init__(self, dispatcher, tracker, domain, method: str = None, action: str = None):
+        self.dispatcher = dispatcher
+        self.tracker = tracker
+        self.domain = domain
+        self.method = method
+        self.action = action
+        self.slots = {}
+        self.snapshot = None
+        self.params = {}
+        self.response = None
+        self.services = None
+        self.ranked_services = None
+        self.events = []
+        self.stopped = False
+        self.timings = {}
+
+    def stop(self, message: str = None):
+        """ Ends the run. Only stages with always_run are run after this. """
+        if message:
+            self.dispatcher.utter_message(template=message)
+        self.stopped = True
+
+    def fallback(self, fallback: str):
+        """ Counts a fallback message (api_error, no_services) shown by the action. """
+        FALLBACK_MESSAGES.inc(action=self.action, fallback=fallback)
+
+
+class Stage:
+    """
+    Base class of pipeline stages. Stages must not keep state of a run in
+    themselves, since the same pipeline serves concurrent requests.
+
+    Attributes
+    ----------
+    name : str
+        name of the stage in timings.
+    always_run : bool
+        stage is run also after the run has been stopped.
+    """
+    name = 'stage'
+    always_run = False
+
+    async def __call__(self, context: PipelineContext):
+        raise NotImplementedError
+
+
+class Pipeline:
+    """ Ordered stages of a recommendation. """
+
+    def __init__(self, stages: list):
+        self.stages = list(stages)
+
+    async def run(self, context: PipelineContext) -> PipelineContext:
+        for stage in self.stages:
+            if context.stopped and not stage.always_run:
+                continue
+
+            started = time.perf_counter()
+            try:
+                with span('pipeline.' + stage.name):
+                    await stage(context)
+            finally:
+                duration = time.perf_counter() - started
+                context.timings[stage.name] = duration
+                STAGE_DURATION.observe(duration, action=context.action, stage=stage.name)
+
+        return context
+
+    def replace(self, name: str, stage: Stage):
+        """ Returns a copy of the pipeline with the named stage replaced. """
+        if name not in self.names:
+            raise KeyError(f'Pipeline has no stage {name}')
+        return Pipeline([stage if old.name == name else old for old in self.stages])
+
+    def before(self, name: str):
+        """ Returns a copy of the pipeline with the stages before the named stage. """
+        if name not in self.names:
+            raise KeyError(f'Pipeline has no stage {name}')
+        return Pipeline(self.stages[:self.names.index(name)])
+
+    def without(self, name: str):
+        """ Returns a copy of the pipeline without the named stage. """
+        return Pipeline([stage for stage in self.stages if stage.name != name])
+
+    @property
+    def names(self) -> list:
+        return [stage.name for stage in self.stages]
+
+
+class RecommendationPipeline:
+    """
+    Mixin for actions which run a recommendation pipeline. Subclasses set
+    method (api method) and pipeline.
+    """
+    method = None
+    pipeline = None
+
+    @measure_action
+    @trace_action
+    async def run(self, dispatcher, tracker, domain):
+        context = PipelineContext(dispatcher, tracker, domain, method=self.method, action=self.name())
+        await self.pipeline.run(context)
+        return context.events
+
+
+class CacheLookup(Stage):
+    """ Takes a cached response of the api call if there is one. """
+    name = 'cache'
+
+    def __init__(self, api=None):
+        self.api = api or AsyncServiceRecommenderAPI()
+
+    async def __call__(self, context):
+        context.response = self.api.cached_response(context.params, context.method)
+
+
+class UpstreamCall(Stage):
+    """ Calls the api unless the response was already found. Stops the run on
+        connection problems. """
+    name = 'upstream'
+
+    def __init__(self, api=None):
+        self.api = api or AsyncServiceRecommenderAPI()
+
+    async def __call__(self, context):
+        if context.response is not None:
+            return
+
+        try:
+            context.response = await self.api.fetch(context.params, context.method)
+        except ConnectionError:
+            context.fallback('api_error')
+            context.stop(API_ERROR_MESSAGE)
+
+
+class LocalSearchFallback(UpstreamCall):
+    """ Calls the api like UpstreamCall, but answers from the local search index
+        (see search_index.py) when the api is down, returns a server error or
+        does not answer within latency_budget seconds. The api call is not
+        cancelled when the budget is exceeded, so its response is still cached.
+        Without an index this is the same as UpstreamCall. """
+
+    def __init__(self, api=None, index=None, latency_budget: float = None):
+        super().__init__(api)
+        self._index = index
+        self.latency_budget = search_index.LOCAL_SEARCH_LATENCY_BUDGET if latency_budget is None else latency_budget
+
+    @property
+    def index(self):
+        return self._index or search_index.LOCAL_SEARCH_INDEX
+
+    async def __call__(self, context):
+        index = self.index
+        if context.response is not None or index is None:
+            await super().__call__(context)
+            return
+
+        try:
+            response = await self.fetch_within_budget(context)
+        except ConnectionError:
+            response = None
+
+        if response is not None and response.status_code < 500:
+            context.response = response
+            return
+
+        self.search_locally(context)
+
+    def search_locally(self, context):
+        """ Answers from the local search index. """
+        context.fallback('local_search')
+        with span('local_search'):
+            context.response = ApiResponse.from_json(self.index.search_params(context.params))
+
+    async def fetch_within_budget(self, context):
+        """ Response of the api, None if it did not answer in time. """
+        task = asyncio.ensure_future(self.api.fetch(context.params, context.method))
+        done, _ = await asyncio.wait({task}, timeout=self.latency_budget)
+
+        if not done:
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            return None
+
+        return task.result()
+
+
+class ParseServices(Stage):
+    """ Parses recommendations from the response. On an error response the
+        messages given by error_messages(response) are shown and the run stops. """
+    name = 'parse'
+
+    def __init__(self, error_messages=None):
+        self.error_messages = error_messages or (lambda response: [API_ERROR_MESSAGE])
+
+    async def __call__(self, context):
+        response = context.response
+
+        if not response.ok:
+            context.fallback('api_error')
+            for message in self.error_messages(response):
+                context.dispatcher.utter_message(template=message)
+            context.stop()
+            return
+
+        context.services = response.json()
+        context.ranked_services = context.services
+
+
+class SetRecommendationsSlot(Stage):
+    """ Stores the recommendations as shown, or None after an error, into the recommendations slot. """
+    name = 'slot'
+    always_run = True
+
+    async def __call__(self, context):
+        context.events.append(SlotSet(RECOMMENDATIONS_SLOT, compact_recommendations(context.ranked_services)))
+
+
+class SlotOverlay:
+    """ Tracker with the slot values of events which rasa has not yet applied to
+        it, e.g. the events an action is about to return. """
+
+    def __init__(self, tracker, events: list):
+        self.tracker = tracker
+        self.slots = {event['name']: event['value'] for event in events if event.get('event') == 'slot'}
+
+    def get_slot(self, key: str):
+        if key in self.slots:
+            return self.slots[key]
+        return self.tracker.get_slot(key)
+
+    def current_slot_values(self) -> dict:
+        return dict(self.tracker.current_slot_values(), **self.slots)
+
+    def __getattr__(self, name):
+        return getattr(self.tracker, name)
+
+
+class Prefetcher:
+    """
+    Speculatively calls the api for an action which is likely to follow, so
+    that its response is in the response cache when the action runs. Params are
+    built by the param stages of the action's pipeline (e.g.
+    pipeline.before('show_params')), so they are the same as the action builds.
+    The call is made in the background, and identical calls of the action made
+    while it is in flight are coalesced with it.
+    """
+
+    def __init__(self, pipeline: Pipeline, method: str, api=None):
+        self.pipeline = pipeline
+        self.method = method
+        self.api = api or AsyncServiceRecommenderAPI()
+        self._tasks = set()
+
+    async def params(self, tracker, events: list = ()) -> dict:
+        """ Params the action would build from tracker after events. """
+        context = PipelineContext(dispatcher=None, tracker=SlotOverlay(tracker, events), domain={},
+                                  method=self.method, action='prefetch')
+        await self.pipeline.run(context)
+        return context.params
+
+    async def prefetch(self, tracker, events: list = ()):
+        """ Starts the api call unless its response is already cached. Returns the task of the call. """
+        params = await self.params(tracker, events)
+
+        if self.api.cached_response(params, self.method) is not None:
+            PREFETCHES.inc(method=self.method, result='cached')
+            return None
+
+        task = asyncio.ensure_future(self.api.fetch(params, self.method))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            result = 'cancelled'
+        elif task.exception() is not None or not task.result().ok:
+            result = 'error'
+        else:
+            result = 'ok'
+        PREFETCHES.inc(method=self.method, result=result)
+
+    def pending(self) -> int:
+        return len(self._tasks)
@@ -0,0 +1,256 @@
+""" Reordering of recommended services: weighted whitelist and blacklist terms,
+local BM25 re-ranking against the search text, and fusion of the results of
+several text search queries. """
+import functools
+import math
+import re
+from collections import Counter, deque
+
+from actions.servicerec.text import tokenize, normalize_text, FINNISH_STOPWORDS
+
+NULL_TERM = 'NULL'
+
+TERM_SEPARATOR = re.compile(r'[,;\n]+')
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton of a set of patterns. Finds which of the patterns
+    occur in a text in one pass over the text, regardless of the number of
+    patterns.
+    """
+
+    def __init__(self, patterns: list):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+
+        outputs = [set()]
+        for index, pattern in enumerate(self.patterns):
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    outputs.append(set())
+                node = next_node
+            outputs[node].add(index)
+
+        # Children of the root fail to the root, deeper nodes to the longest
+        # proper suffix of their path which is also in the automaton.
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self._goto[node].items():
+                queue.append(next_node)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_node] = self._goto[fail].get(char, 0)
+                outputs[next_node] |= outputs[self._fail[next_node]]
+
+        self._output = [frozenset(output) for output in outputs]
+
+    def matches(self, text: str) -> set:
+        """ Returns indexes of the patterns which occur in text. """
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        node = 0
+
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found |= output[node]
+
+        return found
+
+
+def parse_terms(value, sign: int = 1) -> list:
+    """ Parses terms of a whitelist or blacklist slot into (term, weight) pairs.
+        Terms are separated with commas, semicolons or newlines, or given as a
+        list, and a term may have a weight after a caret, e.g. 'nuoret^2, perhe'.
+        Weights of blacklist terms (sign -1) are negative. """
+    if value is None:
+        return []
+
+    items = value if isinstance(value, (list, tuple)) else TERM_SEPARATOR.split(str(value))
+    terms = []
+
+    for item in items:
+        term, weight = str(item), 1.0
+        if '^' in term:
+            head, _, tail = term.rpartition('^')
+            try:
+                term, weight = head, float(tail)
+            except ValueError:
+                pass
+
+        term = term.strip().casefold()
+        if term and term != NULL_TERM.casefold():
+            terms.append((term, sign * weight))
+
+    return terms
+
+
+class TermMatcher:
+    """ Weighted terms compiled into one casefolded automaton. Score of a text is
+        the sum of the weights of the distinct terms occurring in it. """
+
+    def __init__(self, terms: tuple):
+        weights = {}
+        for term, weight in terms:
+            weights[term] = weights.get(term, 0.0) + weight
+
+        self.terms = list(weights)
+        self.weights = [weights[term] for term in self.terms]
+        self.automaton = AhoCorasick(self.terms)
+
+    def score(self, text: str) -> float:
+        if not text:
+            return 0.0
+        return sum(self.weights[index] for index in self.automaton.matches(text.casefold()))
+
+
+@functools.lru_cache(maxsize=256)
+def compile_terms(terms: tuple) -> TermMatcher:
+    """ Returns TermMatcher of the (term, weight) pairs, cached per term set. """
+    return TermMatcher(terms)
+
+
+def term_matcher(whitelist, blacklist):
+    """ Returns TermMatcher of whitelist and blacklist slot values, None if there are no terms. """
+    terms = parse_terms(whitelist, 1) + parse_terms(blacklist, -1)
+    if not terms:
+        return None
+    return compile_terms(tuple(sorted(terms)))
+
+
+def rank_services(services: dict, whitelist, blacklist, field: str = 'service_description') -> dict:
+    """
+    Orders recommended services by the score of their descriptions: services
+    with whitelist terms first and services with blacklist terms last. Sort is
+    stable, so services with equal scores keep the order of the api. Service
+    records are not copied or modified, and keep all their fields.
+    """
+    recommended = services.get('recommended_services') or []
+    matcher = term_matcher(whitelist, blacklist)
+
+    if matcher is None or not recommended:
+        return services
+
+    scores = [matcher.score(service.get(field)) for service in recommended]
+    order = sorted(range(len(recommended)), key=lambda i: -scores[i])
+
+    return dict(services, recommended_services=[recommended[i] for i in order])
+
+
+@functools.lru_cache(maxsize=4096)
+def analyze(text: str) -> tuple:
+    """ Stemmed tokens of a text, cached since the same services are recommended often. """
+    return tuple(tokenize(text)) if text else ()
+
+
+class Bm25Index:
+    """
+    In-memory Okapi BM25 index of a small set of documents, e.g. the candidate
+    services of a search. Documents are lists of stemmed tokens.
+    """
+
+    def __init__(self, documents: list, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_frequencies = [Counter(document) for document in documents]
+        self.lengths = [len(document) for document in documents]
+        self.average_length = sum(self.lengths) / len(documents) if documents else 0.0
+
+        document_frequencies = Counter(term for frequencies in self.term_frequencies for term in frequencies)
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequencies.items()}
+
+    def scores(self, query: list) -> list:
+        """ BM25 score of every document for the query tokens. """
+        query_terms = [term for term in set(query) if term in self.idf]
+        scores = []
+
+        for frequencies, length in zip(self.term_frequencies, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self.average_length) if self.average_length else self.k1
+            score = 0.0
+            for term in query_terms:
+                tf = frequencies.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+
+        return scores
+
+
+def bm25_rerank(services: dict, search_text: str, limit: int = None,
+                fields: tuple = ('service_name', 'service_description')) -> dict:
+    """
+    Orders recommended services by BM25 score of their name and description
+    against search_text, and keeps at most limit of them. Sort is stable, so
+    services the search text does not match keep the order of the api.
+    """
+    recommended = services.get('recommended_services') or []
+    query = analyze(search_text)
+
+    if not recommended or not query:
+        return dict(services, recommended_services=recommended[:limit])
+
+    documents = [[token for field in fields for token in analyze(service.get(field))] for service in recommended]
+    scores = Bm25Index(documents).scores(query)
+    order = sorted(range(len(recommended)), key=lambda i: -scores[i])
+
+    return dict(services, recommended_services=[recommended[i] for i in order][:limit])
+
+
+def query_variants(search_text: str, municipality: str = None, municipality_words: tuple = ()) -> list:
+    """
+    Variants of a text search query: the original text, the normalized text
+    without stopwords, the text with the municipality name appended (unless
+    it is already in the text) and the text without municipality_words, the
+    words of the text which are municipality names. Variants with the same
+    normalized text are left out, since the api gives them the same results.
+    """
+    original = str(search_text or '')
+    words = normalize_text(original).split()
+    normalized = ' '.join(word for word in words if word not in FINNISH_STOPWORDS)
+
+    variants = [original, normalized]
+    if municipality and normalize_text(municipality) not in words:
+        variants.append(f'{original} {municipality}')
+    if municipality_words:
+        variants.append(' '.join(word for word in normalized.split() if word not in municipality_words))
+
+    unique = {}
+    for variant in variants:
+        key = normalize_text(variant)
+        if key and key not in unique:
+            unique[key] = variant.strip()
+
+    return list(unique.values())
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60, limit: int = None, key: str = 'service_id') -> list:
+    """
+    Fuses ranked lists of services into one with reciprocal rank fusion: score
+    of a service is the sum of 1 / (k + rank) over the lists it is in. Services
+    with equal scores are in the order they were first seen, so the first list
+    decides ties. Record of a service is taken from the first list it is in.
+    """
+    scores = {}
+    records = {}
+
+    for ranking in rankings:
+        for rank, service in enumerate(ranking, start=1):
+            service_id = service[key]
+            scores[service_id] = scores.get(service_id, 0.0) + 1.0 / (k + rank)
+            records.setdefault(service_id, service)
+
+    order = sorted(scores, key=lambda service_id: -scores[service_id])
+    return [records[service_id] for service_id in order][:limit]
@@ -0,0 +1,373 @@
+""" Local inverted index of the services catalog, used to answer text searches
+when the aurora api is down or too slow.
+
+An index is built from a services.json catalog export (records with id, names,
+descriptions and municipalities, as loaded in text_search.ipynb) with
+
+    python -m actions.search_index build --output services.idx services.json
+
+and taken into use by pointing LOCAL_SEARCH_INDEX environment variable to the
+file. The file is memory-mapped when the action server starts, so it is not
+read into memory and is shared between worker processes. Search ranks services
+with Okapi BM25 over stemmed tokens of names, descriptions and municipality
+names, and can be restricted to municipality codes like the api.
+
+File layout (little-endian):
+
+    header        magic, format, number of services and terms, average length
+    sections      offsets of the sections below
+    doc offsets   (services + 1) x u64, offsets of service records in doc blob
+    doc lengths   services x u32, number of tokens of each service
+    term offsets  (terms + 1) x u64, offsets of terms in term blob
+    post offsets  (terms + 1) x u64, offsets of posting lists in postings
+    doc blob      service records as utf-8 json
+    term blob     terms as utf-8, sorted by their bytes
+    postings      (service u32, term frequency u16) per service of a term
+"""
+import argparse
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+from collections import Counter
+
+from actions.servicerec.text import tokenize
+from actions.utils import find_municipality, municipality_name, LOCAL_SEARCH_RESULTS
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b'SVIX'
+INDEX_FORMAT = 1
+
+HEADER = struct.Struct('<4sHHIId')
+SECTIONS = struct.Struct('<7Q')
+OFFSET = struct.Struct('<Q')
+LENGTH = struct.Struct('<I')
+POSTING = struct.Struct('<IH')
+
+MAX_TERM_FREQUENCY = 0xFFFF
+
+# Tokens of the service name are counted this many times, so that a match in
+# the name weighs more than a match in the description.
+NAME_WEIGHT = 3
+
+# Fields of a catalog record, first one found is used.
+ID_FIELDS = ('service_id', 'id')
+NAME_FIELDS = ('service_name', 'name', 'names')
+DESCRIPTION_FIELDS = ('service_description', 'description', 'descriptions')
+MUNICIPALITY_FIELDS = ('municipalities', 'municipality_codes')
+
+# Extra candidates ranked per search when services are filtered by municipality,
+# so that filtered out services seldom leave the results short.
+CANDIDATE_MARGIN = 10
+
+
+def field_text(value, language: str = 'fi') -> str:
+    """ Text of a catalog field, which may be a string, a list of strings or
+        of {language, value} items, or a language -> text dictionary. """
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        if 'value' in value:
+            return field_text(value['value'], language)
+        if language in value:
+            return field_text(value[language], language)
+        return ' '.join(field_text(item, language) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        localized = [item for item in value if isinstance(item, dict) and item.get('language') == language]
+        return ' '.join(field_text(item, language) for item in localized or value)
+    return str(value)
+
+
+def first_field(record: dict, fields: tuple):
+    for field in fields:
+        if record.get(field) is not None:
+            return record[field]
+    return None
+
+
+def municipality_codes(value) -> list:
+    """ Municipality codes of a catalog field of municipality names or codes. """
+    if value is None:
+        return []
+    items = value if isinstance(value, (list, tuple)) else [value]
+    codes = []
+
+    for item in items:
+        if isinstance(item, dict):
+            item = item.get('code') or field_text(item)
+        code = find_municipality(item, fuzzy=False) if item else None
+        if code is not None and code not in codes:
+            codes.append(code)
+
+    return codes
+
+
+def catalog_service(record: dict) -> dict:
+    """ Service of a catalog record in the form of the recommended services of the api. """
+    return {'service_id': str(first_field(record, ID_FIELDS)),
+            'service_name': field_text(first_field(record, NAME_FIELDS)),
+            'service_description': field_text(first_field(record, DESCRIPTION_FIELDS)),
+            'municipality_codes': municipality_codes(first_field(record, MUNICIPALITY_FIELDS))}
+
+
+def service_tokens(service: dict) -> list:
+    names = [municipality_name(code) or '' for code in service['municipality_codes']]
+    return (tokenize(service['service_name']) * NAME_WEIGHT
+            + tokenize(service['service_description'])
+            + tokenize(' '.join(names)))
+
+
+def read_catalog(path: str) -> list:
+    """ Reads services of a services.json catalog, a list of records or a
+        dictionary with the records in 'services' or 'results'. """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        data = data.get('services') or data.get('results') or []
+
+    return [catalog_service(record) for record in data if first_field(record, ID_FIELDS) is not None]
+
+
+def build_index(services: list, path: str):
+    """ Writes inverted index of the services to path. The file is replaced
+        atomically, so a running action server never sees a partial index. """
+    postings = {}
+    lengths = []
+
+    for doc, service in enumerate(services):
+        tokens = service_tokens(service)
+        lengths.append(len(tokens))
+        for term, frequency in Counter(tokens).items():
+            postings.setdefault(term.encode('utf-8'), []).append((doc, min(frequency, MAX_TERM_FREQUENCY)))
+
+    records = [json.dumps(service, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+               for service in services]
+    terms = sorted(postings)
+
+    doc_offsets = cumulative(len(record) for record in records)
+    term_offsets = cumulative(len(term) for term in terms)
+    posting_offsets = cumulative(len(postings[term]) for term in terms)
+
+    sections = [
+        b''.join(OFFSET.pack(offset) for offset in doc_offsets),
+        b''.join(LENGTH.pack(length) for length in lengths),
+        b''.join(OFFSET.pack(offset) for offset in term_offsets),
+        b''.join(OFFSET.pack(offset) for offset in posting_offsets),
+        b''.join(records),
+        b''.join(terms),
+        b''.join(POSTING.pack(doc, frequency) for term in terms for doc, frequency in postings[term])
+    ]
+
+    offsets = []
+    position = HEADER.size + SECTIONS.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+
+    average_length = sum(lengths) / len(lengths) if lengths else 0.0
+    temporary = f'{path}.tmp'
+
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(INDEX_MAGIC, INDEX_FORMAT, 0, len(services), len(terms), average_length))
+        f.write(SECTIONS.pack(*offsets))
+        for section in sections:
+            f.write(section)
+
+    os.replace(temporary, path)
+
+
+def cumulative(sizes) -> list:
+    offsets = [0]
+    for size in sizes:
+        offsets.append(offsets[-1] + size)
+    return offsets
+
+
+class SearchIndex:
+    """
+    Memory-mapped inverted index written by build_index.
+
+    Attributes
+    ----------
+    size : int
+        number of services.
+    terms : int
+        number of distinct terms.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, _, self.size, self.terms, self.average_length = HEADER.unpack_from(self._map, 0)
+            if magic != INDEX_MAGIC or version != INDEX_FORMAT:
+                raise ValueError(f'{path} is not a search index of format {INDEX_FORMAT}')
+            (self._doc_offsets, self._doc_lengths, self._term_offsets, self._posting_offsets,
+             self._docs, self._term_blob, self._postings) = SECTIONS.unpack_from(self._map, HEADER.size)
+        except (struct.error, ValueError):
+            self._map.close()
+            raise ValueError(f'{path} is not a search index of format {INDEX_FORMAT}')
+
+    def close(self):
+        self._map.close()
+
+    def _offset(self, section: int, index: int) -> int:
+        return OFFSET.unpack_from(self._map, section + index * OFFSET.size)[0]
+
+    def _term(self, index: int) -> bytes:
+        return self._map[self._term_blob + self._offset(self._term_offsets, index):
+                         self._term_blob + self._offset(self._term_offsets, index + 1)]
+
+    def _find_term(self, term: bytes):
+        """ Index of the term by binary search over the sorted terms, None if not found. """
+        low, high = 0, self.terms
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < term:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.terms and self._term(low) == term:
+            return low
+        return None
+
+    def postings(self, term: str) -> list:
+        """ (service, term frequency) pairs of the services which have the term. """
+        index = self._find_term(term.encode('utf-8'))
+        if index is None:
+            return []
+        start = self._postings + self._offset(self._posting_offsets, index) * POSTING.size
+        end = self._postings + self._offset(self._posting_offsets, index + 1) * POSTING.size
+        return list(POSTING.iter_unpack(self._map[start:end]))
+
+    def length(self, doc: int) -> int:
+        return LENGTH.unpack_from(self._map, self._doc_lengths + doc * LENGTH.size)[0]
+
+    def service(self, doc: int) -> dict:
+        start = self._docs + self._offset(self._doc_offsets, doc)
+        end = self._docs + self._offset(self._doc_offsets, doc + 1)
+        return json.loads(self._map[start:end])
+
+    def scores(self, query: list) -> dict:
+        """ BM25 score of each service which has any of the query tokens. """
+        scores = {}
+
+        for term in set(query):
+            postings = self.postings(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (self.size - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.length(doc) / self.average_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return scores
+
+    def search(self, search_text: str, limit: int = 5, municipality_codes: list = None,
+               include_national_services: bool = True) -> dict:
+        """
+        Returns the services which best match search_text as a text_search
+        response of the api, marked with LOCAL_SEARCH_RESULTS. With municipality_codes only services of those
+        municipalities are returned, and services without municipalities
+        (national services) unless include_national_services is False.
+        """
+        scores = self.scores(tokenize(search_text or ''))
+        wanted = set(municipality_codes or [])
+        filtered = bool(wanted) or not include_national_services
+        candidates = limit + CANDIDATE_MARGIN if filtered else limit
+
+        while True:
+            ranked = heapq.nsmallest(candidates, scores.items(), key=lambda item: (-item[1], item[0]))
+            services = []
+            for doc, score in ranked:
+                service = self.service(doc)
+                codes = service.pop('municipality_codes', [])
+                if not codes and not include_national_services:
+                    continue
+                if codes and wanted and not wanted.intersection(codes):
+                    continue
+                service['similarity_score'] = round(score, 4)
+                service['service_channels'] = []
+                services.append(service)
+                if len(services) >= limit:
+                    break
+
+            if len(services) >= limit or len(ranked) == len(scores):
+                return {'recommended_services': services, LOCAL_SEARCH_RESULTS: True}
+            candidates *= 4
+
+    def search_params(self, params: dict) -> dict:
+        """ Search with the parameters of a text_search api call. Of the service
+            filters only municipality_codes and include_national_services are
+            used, since the catalog has no regions, service classes or other
+            codes of the filters. """
+        filters = params.get('service_filters') or {}
+        return self.search(params.get('search_text'),
+                           limit=params.get('limit') or 5,
+                           municipality_codes=filters.get('municipality_codes'),
+                           include_national_services=filters.get('include_national_services', True))
+
+
+def open_index(path: str):
+    """ Memory-maps the index at path. Returns None if there is no path or the
+        file is missing or invalid, since the local search is optional. """
+    if not path:
+        return None
+    try:
+        return SearchIndex(path)
+    except (OSError, ValueError) as e:
+        logger.warning('Local search index not in use: %s', e)
+        return None
+
+
+LOCAL_SEARCH_INDEX = open_index(os.getenv('LOCAL_SEARCH_INDEX'))
+
+# Seconds the text search actions wait for the api before answering from the
+# local index. The api call is not cancelled, and its response is cached.
+LOCAL_SEARCH_LATENCY_BUDGET = float(os.getenv('LOCAL_SEARCH_LATENCY_BUDGET', 2.0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or query the local search index of the services catalog.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build')
+    build_parser.add_argument('--output', required=True, help='path of the index file')
+    build_parser.add_argument('catalog', help='services.json catalog export')
+
+    search_parser = subparsers.add_parser('search')
+    search_parser.add_argument('--index', required=True, help='path of the index file')
+    search_parser.add_argument('--limit', type=int, default=10)
+    search_parser.add_argument('--municipality', action='append', help='municipality code or name')
+    search_parser.add_argument('text', help='search text')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        services = read_catalog(args.catalog)
+        build_index(services, args.output)
+        print(f'Wrote search index of {len(services)} services to {args.output}')
+        return
+
+    index = SearchIndex(args.index)
+    codes = municipality_codes(args.municipality)
+    for service in index.search(args.text, args.limit, codes)['recommended_services']:
+        print(f'{service["similarity_score"]:8.3f}  {service["service_id"]}  {service["service_name"]}')
+    index.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
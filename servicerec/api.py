@@ -1,8 +1,20 @@
 import requests
+import aiohttp
+import asyncio
 from dotenv import load_dotenv
 import os
-from requests.auth import HTTPBasicAuth
+import json
+import threading
+import time
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
 import base64
+from .cache import ResponseCache, TextSearchCache, canonical_key
+from .coalesce import SingleFlight
+from .breaker import CircuitBreaker, CircuitOpenError
+from .revalidate import Revalidator
+from .metrics import UPSTREAM_DURATION, UPSTREAM_RESPONSES, UPSTREAM_RESPONSE_SIZE, STALE_RESPONSES, STALE_REFRESHES
+from .tracing import span
 
 load_dotenv()
 
@@ -10,12 +22,273 @@ URL = os.getenv('AURORA_API_ENDPOINT')
 API_KEY = os.getenv('AURORA_API_KEY')
 CLIENT_ID = os.getenv('AURORA_API_CLIENT_ID')
 
+# Connection pool settings of the shared http session. POOL_CONNECTIONS is the
+# number of hosts which have their own pool and POOL_MAXSIZE is the maximum number
+# of kept alive connections per host.
+POOL_CONNECTIONS = int(os.getenv('AURORA_API_POOL_CONNECTIONS', 4))
+POOL_MAXSIZE = int(os.getenv('AURORA_API_POOL_MAXSIZE', 20))
+# Maximum number of simultaneous connections of the asyncio client.
+ASYNC_POOL_MAXSIZE = int(os.getenv('AURORA_API_ASYNC_POOL_MAXSIZE', 200))
+
+REQUEST_TIMEOUT = 10
+
+# Successful responses of the methods below are cached in process. Cache is
+# disabled by setting its size to zero. Expired responses are kept for the
+# stale ttl, and served if the api fails (see serve_stale).
+RECOMMENDATION_CACHE = ResponseCache(maxsize=int(os.getenv('AURORA_API_CACHE_SIZE', 1024)),
+                                     ttl=float(os.getenv('AURORA_API_CACHE_TTL', 300)),
+                                     stale_ttl=float(os.getenv('AURORA_API_CACHE_STALE_TTL', 3600)))
+
+TEXT_SEARCH_CACHE = TextSearchCache(maxsize=int(os.getenv('AURORA_API_TEXT_SEARCH_CACHE_SIZE', 1024)),
+                                    ttl=float(os.getenv('AURORA_API_TEXT_SEARCH_CACHE_TTL', 300)),
+                                    stale_ttl=float(os.getenv('AURORA_API_TEXT_SEARCH_CACHE_STALE_TTL', 3600)))
+
+RESPONSE_CACHES = {
+    'recommend_service': RECOMMENDATION_CACHE,
+    'text_search': TEXT_SEARCH_CACHE
+}
+
+# Identical concurrent requests of the methods below share one upstream call.
+COALESCED_METHODS = ('recommend_service', 'text_search')
+REQUEST_COALESCER = SingleFlight()
+
+# Stale responses served by the asyncio client are refreshed in the background
+# every interval seconds until the api answers again.
+REVALIDATOR = Revalidator(interval=float(os.getenv('AURORA_API_STALE_REFRESH_INTERVAL', 10)))
+
+# All calls to the api go through the circuit breaker. When the api is failing
+# or too slow, calls fail fast with CircuitOpenError (a ConnectionError) instead
+# of waiting for the request timeout.
+CIRCUIT_BREAKER = CircuitBreaker(
+    failure_rate_threshold=float(os.getenv('AURORA_API_BREAKER_FAILURE_RATE', 0.5)),
+    slow_call_threshold=float(os.getenv('AURORA_API_BREAKER_SLOW_CALL_SECONDS', 5)),
+    slow_call_rate_threshold=float(os.getenv('AURORA_API_BREAKER_SLOW_CALL_RATE', 0.8)),
+    window_size=int(os.getenv('AURORA_API_BREAKER_WINDOW_SIZE', 20)),
+    minimum_calls=int(os.getenv('AURORA_API_BREAKER_MINIMUM_CALLS', 10)),
+    open_duration=float(os.getenv('AURORA_API_BREAKER_OPEN_SECONDS', 30))
+)
+
+
+def make_headers(client_id: str = CLIENT_ID, api_key: str = API_KEY) -> dict:
+    """ Creates request headers with basic authentication. """
+    secret_string = f'{client_id}:{api_key}'
+    base64_secret = base64.b64encode(secret_string.encode('ascii'))
+    secret = base64_secret.decode('ascii')
+
+    return {
+        'content-type': 'application/json',
+        'Authorization': 'Basic ' + secret
+    }
+
+
+# Authentication headers do not change during the lifetime of the process.
+HEADERS = make_headers()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """ Returns process wide http session which keeps connections to the
+        aurora api alive between requests. Session is created on first use. """
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                                      pool_maxsize=POOL_MAXSIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+
+    return _session
+
+
+def close_session():
+    """ Closes the shared http session and its pooled connections. """
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+_async_session = None
+_async_session_loop = None
+
+
+def get_async_session() -> aiohttp.ClientSession:
+    """ Returns http session of the asyncio client. Session is bound to the
+        running event loop, so a new one is created if the loop has changed. """
+    global _async_session, _async_session_loop
+
+    loop = asyncio.get_running_loop()
+
+    if _async_session is None or _async_session.closed or _async_session_loop is not loop:
+        if _async_session is not None:
+            release_async_session(_async_session, _async_session_loop)
+        connector = aiohttp.TCPConnector(limit=ASYNC_POOL_MAXSIZE,
+                                         limit_per_host=ASYNC_POOL_MAXSIZE)
+        _async_session = aiohttp.ClientSession(connector=connector,
+                                               timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+        _async_session_loop = loop
+
+    return _async_session
+
+
+def release_async_session(session: aiohttp.ClientSession, loop):
+    """ Releases a session of another event loop. The session is closed in its
+        loop if the loop is still running, otherwise its connections can no
+        longer be closed and the session is only detached from them. """
+    if session.closed:
+        return
+    if loop is not None and loop.is_running():
+        asyncio.run_coroutine_threadsafe(session.close(), loop)
+    else:
+        session.detach()
+
+
+async def close_async_session():
+    """ Closes http session of the asyncio client. """
+    global _async_session, _async_session_loop
+
+    if _async_session is not None:
+        await _async_session.close()
+        _async_session = None
+        _async_session_loop = None
+
+
+def response_cache(params: dict, method: str):
+    """ Returns response cache of the method and cache key of the parameters.
+        Both are None if responses of the method are not cached. """
+    cache = RESPONSE_CACHES.get(method)
+
+    if cache is None or not cache.enabled:
+        return None, None
+
+    return cache, cache.key(params)
+
+
+def lookup_cache(params: dict, method: str):
+    """ Returns response cache of the method, cache key of the parameters and
+        cached response. All are None if responses of the method are not cached. """
+    cache, key = response_cache(params, method)
+
+    if cache is None:
+        return None, None, None
+
+    return cache, key, cache.get(key)
+
+
+def serve_stale(cache, key: str, method: str, reason: str):
+    """ Returns the cached response of a failed request, also an expired one
+        within the grace period of the cache, or None if there is none. Served
+        responses are counted by reason (connection_error, error_response). """
+    if cache is None:
+        return None
+
+    response = cache.get_stale(key)
+    if response is not None:
+        STALE_RESPONSES.inc(method=method, reason=reason)
+    return response
+
+
+def request_key(params: dict, method: str, cache_key: str = None) -> str:
+    """ Key which identifies identical requests for coalescing. """
+    return method + ':' + (cache_key or canonical_key(params))
+
+
+class _UpstreamCall:
+    """ Request made in an upstream_call block. Block sets response and size of the body in bytes. """
+
+    def __init__(self):
+        self.response = None
+        self.size = 0
+
+
+@contextmanager
+def upstream_call(method: str):
+    """ Guards a request to the api with the circuit breaker, and records its
+        duration, status and response size.
+
+        with upstream_call(method) as call:
+            call.response = ApiResponse(...)
+    """
+    upstream = _UpstreamCall()
+    started = time.perf_counter()
+    status = 'error'
+
+    try:
+        with span('aurora_api_request', method=method) as request_span, CIRCUIT_BREAKER.call() as call:
+            yield upstream
+            status = upstream.response.status_code
+            call.failed = status >= 500
+            request_span.set_attribute('http.status_code', status)
+            request_span.set_attribute('response_size', upstream.size)
+    except CircuitOpenError:
+        status = 'circuit_open'
+        raise
+    except Exception:
+        raise
+    except BaseException:
+        status = 'cancelled'
+        raise
+    finally:
+        if status != 'circuit_open':
+            UPSTREAM_DURATION.observe(time.perf_counter() - started, method=method)
+        if upstream.response is not None:
+            UPSTREAM_RESPONSE_SIZE.observe(upstream.size, method=method)
+        UPSTREAM_RESPONSES.inc(method=method, status=status)
+
+
+class ApiResponse:
+    """ Response of an api call. Has the parts of requests.Response used by the
+        actions, and body is decoded from json only once. Decoded body is shared
+        between callers and must not be modified. """
+
+    def __init__(self, status_code: int, reason: str, text: str):
+        self.status_code = status_code
+        self.reason = reason
+        self.text = text
+        self._json = None
+
+    @classmethod
+    def from_requests(cls, response: requests.Response):
+        return cls(status_code=response.status_code,
+                   reason=response.reason,
+                   text=response.text)
+
+    @classmethod
+    def from_json(cls, data, status_code: int = 200, reason: str = 'OK'):
+        """ Response with an already decoded body, e.g. a local search result. """
+        response = cls(status_code=status_code, reason=reason, text=json.dumps(data, ensure_ascii=False))
+        response._json = data
+        return response
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def json(self):
+        if self._json is None:
+            with span('json_decode', size=len(self.text)):
+                self._json = json.loads(self.text)
+        return self._json
+
+    def __repr__(self):
+        return f'<ApiResponse [{self.status_code}]>'
+
 
 class ServiceRecommenderAPI():
     """
     Aurora AI Service Recommendation API class for fetching service recommendations
     using REST API. Documentation: (see link in README.md).
 
+    All instances share the same pooled http session (see get_session).
+
     Attributes
     ----------
     params : dict
@@ -29,17 +302,10 @@ class ServiceRecommenderAPI():
     """
 
     def __init__(self):
+        self.headers = HEADERS
+        self.session = get_session()
 
-        secret_string = f'{CLIENT_ID}:{API_KEY}'
-        base64_secret = base64.b64encode(secret_string.encode('ascii'))
-        secret = base64_secret.decode('ascii')
-
-        self.headers = {
-            'content-type': 'application/json',
-            'Authorization': 'Basic ' + secret
-        }
-
-    def get_recommendations(self, params: dict, method: str) -> dict:
+    def get_recommendations(self, params: dict, method: str) -> ApiResponse:
         """ Fetches service recommendations.
 
         Parameters
@@ -58,24 +324,58 @@ class ServiceRecommenderAPI():
 
         Returns
         -------
-        dict
-            Returns service recommendations as a dictionary. Example of the output
-            can be found from api documentation (see link in README.md).
+        ApiResponse
+            Returns api response, which json() method returns service recommendations
+            as a dictionary. Example of the output can be found from api documentation
+            (see link in README.md).
 
         """
 
+        with span('get_recommendations', method=method) as request_span:
+            cache, cache_key, cached_response = lookup_cache(params, method)
+            request_span.set_attribute('cached', cached_response is not None)
+            if cached_response is not None:
+                return cached_response
+
+            def fetch():
+                response = self._post(params, method)
+                if cache is not None and response.ok:
+                    cache.set(cache_key, response)
+                return response
+
+            try:
+                if method in COALESCED_METHODS:
+                    response = REQUEST_COALESCER.do(request_key(params, method, cache_key), fetch)
+                else:
+                    response = fetch()
+            except ConnectionError:
+                stale_response = serve_stale(cache, cache_key, method, 'connection_error')
+                if stale_response is None:
+                    raise
+                return stale_response
+
+            if not response.ok:
+                return serve_stale(cache, cache_key, method, 'error_response') or response
+
+            return response
+
+    def _post(self, params: dict, method: str) -> ApiResponse:
         endpoint = URL + method
 
-        try:
-            output = requests.post(endpoint,
-                                   json=params,
-                                   headers=self.headers,
-                                   timeout=10)
+        with upstream_call(method) as call:
+            try:
+                output = self.session.post(endpoint,
+                                           json=params,
+                                           headers=self.headers,
+                                           timeout=REQUEST_TIMEOUT)
 
-        except requests.exceptions.RequestException as e:
-            raise ConnectionError(e)
+            except requests.exceptions.RequestException as e:
+                raise ConnectionError(e)
 
-        return output
+            call.response = ApiResponse.from_requests(output)
+            call.size = len(output.content)
+
+        return call.response
 
 
 class SessionAttributesAPI(ServiceRecommenderAPI):
@@ -92,10 +392,153 @@ class SessionAttributesAPI(ServiceRecommenderAPI):
 
         endpoint = URL + self.method
 
+        with upstream_call(self.method) as call:
+            try:
+                output = self.session.get(url=endpoint, params=params)
+
+            except requests.exceptions.RequestException as e:
+                raise ConnectionError(e)
+
+            call.response = ApiResponse.from_requests(output)
+            call.size = len(output.content)
+
+        return call.response
+
+
+class AsyncServiceRecommenderAPI():
+    """
+    Asyncio version of ServiceRecommenderAPI. Requests are made with a shared
+    aiohttp session so that waiting for the api does not block the event loop
+    of the action server.
+
+    Methods
+    -------
+    get_recommendations(params: dict, method: str)
+        Returns service recommendations.
+    cached_response(params: dict, method: str)
+        Returns cached service recommendations or None.
+    fetch(params: dict, method: str)
+        Returns service recommendations from the api.
+    """
+
+    def __init__(self):
+        self.headers = HEADERS
+
+    async def get_recommendations(self, params: dict, method: str) -> ApiResponse:
+        """ Fetches service recommendations. See ServiceRecommenderAPI.get_recommendations.
+
+        Raises
+        ------
+        ConnectionError
+            In the event of a network problem or a timeout.
+        """
+
+        with span('get_recommendations', method=method) as request_span:
+            cached_response = self.cached_response(params, method)
+            request_span.set_attribute('cached', cached_response is not None)
+            if cached_response is not None:
+                return cached_response
+
+            return await self.fetch(params, method)
+
+    def cached_response(self, params: dict, method: str):
+        """ Returns cached response or None if there is no valid cached response. """
+        return lookup_cache(params, method)[2]
+
+    async def fetch(self, params: dict, method: str) -> ApiResponse:
+        """ Calls the api without looking up the cache. Identical concurrent
+            requests are coalesced and successful responses are cached. If the
+            call fails, a stale cached response is returned when there is one,
+            and it is refreshed in the background until the api answers again. """
+        cache, cache_key = response_cache(params, method)
+
         try:
-            output = requests.get(url=endpoint, params=params)
+            response = await self._fetch(params, method, cache, cache_key)
+        except ConnectionError:
+            stale_response = self._serve_stale(params, method, cache, cache_key, 'connection_error')
+            if stale_response is None:
+                raise
+            return stale_response
+
+        if not response.ok:
+            return self._serve_stale(params, method, cache, cache_key, 'error_response') or response
+
+        return response
+
+    async def _fetch(self, params: dict, method: str, cache, cache_key: str) -> ApiResponse:
+        async def fetch():
+            response = await self._post(params, method)
+            if cache is not None and response.ok:
+                cache.set(cache_key, response)
+            return response
+
+        if method in COALESCED_METHODS:
+            return await REQUEST_COALESCER.do_async(request_key(params, method, cache_key), fetch)
+
+        return await fetch()
+
+    def _serve_stale(self, params: dict, method: str, cache, cache_key: str, reason: str):
+        stale_response = serve_stale(cache, cache_key, method, reason)
+
+        if stale_response is not None:
+            async def refresh():
+                return (await self._fetch(params, method, cache, cache_key)).ok
+
+            def on_result(refreshed):
+                STALE_REFRESHES.inc(method=method, result='ok' if refreshed else 'failed')
+
+            REVALIDATOR.schedule(cache, cache_key, refresh, on_result)
+
+        return stale_response
+
+    async def _post(self, params: dict, method: str) -> ApiResponse:
+        endpoint = URL + method
+
+        with upstream_call(method) as call:
+            try:
+                async with get_async_session().post(endpoint,
+                                                    json=params,
+                                                    headers=self.headers) as output:
+                    body = await output.read()
+                    text = await output.text()
 
-        except requests.exceptions.RequestException as e:
-            raise ConnectionError(e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise ConnectionError(e)
 
+            call.response = ApiResponse(status_code=output.status,
+                                        reason=output.reason,
+                                        text=text)
+            call.size = len(body)
+
+        return call.response
+
+
+class AsyncSessionAttributesAPI(AsyncServiceRecommenderAPI):
+    def __init__(self):
+        super().__init__()
+
+        self.method = 'session_attributes'
+
+    async def post_attributes(self, params: dict):
+        output = await self.get_recommendations(params=params, method=self.method)
         return output
+
+    async def get_attributes(self, params: dict):
+
+        endpoint = URL + self.method
+
+        with upstream_call(self.method) as call:
+            try:
+                async with get_async_session().get(url=endpoint, params=params) as response:
+                    body = await response.read()
+                    text = await response.text()
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise ConnectionError(e)
+
+            call.response = ApiResponse(status_code=response.status,
+                                        reason=response.reason,
+                                        text=text)
+            call.size = len(body)
+
+        return call.response
@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(ConnectionError):
+    """ Raised instead of calling the api when the circuit is open. As a
+        ConnectionError it is handled like any other api connection problem. """
+
+
+class _Call:
+    """ Outcome of a call. Caller sets failed if the api answered with an error. """
+
+    def __init__(self):
+        self.failed = False
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for the aurora api. Outcomes of the latest calls are kept in a
+    rolling window. When the share of failed or slow calls in the window exceeds
+    its threshold the circuit opens, and calls fail fast with CircuitOpenError.
+    After open_duration seconds the circuit is half open and a limited number of
+    probe calls are let through. A successful probe closes the circuit, a failed
+    one opens it again.
+
+    Attributes
+    ----------
+    failure_rate_threshold : float
+        share of failed calls (exceptions and server errors) which opens the circuit.
+    slow_call_threshold : float
+        calls taking at least this many seconds are slow.
+    slow_call_rate_threshold : float
+        share of slow calls which opens the circuit.
+    window_size : int
+        number of latest calls used to compute the rates.
+    minimum_calls : int
+        rates are not computed before the window has this many calls.
+    open_duration : float
+        seconds the circuit stays open before probing.
+    half_open_calls : int
+        number of concurrent probe calls allowed when the circuit is half open.
+    """
+
+    def __init__(self,
+                 failure_rate_threshold: float = 0.5,
+                 slow_call_threshold: float = 5.0,
+                 slow_call_rate_threshold: float = 0.8,
+                 window_size: int = 20,
+                 minimum_calls: int = 10,
+                 open_duration: float = 30,
+                 half_open_calls: int = 1,
+                 clock=time.monotonic):
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+
+        self.rejected = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._window = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def _update_state(self):
+        if self._state == OPEN and self.clock() - self._opened_at >= self.open_duration:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = self.clock()
+        self._window.clear()
+
+    def before_call(self):
+        """ Raises CircuitOpenError if the call is not allowed. """
+        with self._lock:
+            self._update_state()
+
+            if self._state == CLOSED:
+                return
+
+            if self._state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return
+
+            self.rejected += 1
+            raise CircuitOpenError('Circuit breaker of the aurora api is open')
+
+    def record(self, success: bool, duration: float):
+        """ Records outcome of an allowed call. """
+        slow = duration >= self.slow_call_threshold
+
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
+                if success and not slow:
+                    self._state = CLOSED
+                    self._window.clear()
+                else:
+                    self._open()
+                return
+
+            if self._state == OPEN:
+                return
+
+            self._window.append((not success, slow))
+
+            if len(self._window) < self.minimum_calls:
+                return
+
+            failures = sum(failed for failed, _ in self._window) / len(self._window)
+            slow_calls = sum(slow for _, slow in self._window) / len(self._window)
+
+            if failures >= self.failure_rate_threshold or slow_calls >= self.slow_call_rate_threshold:
+                self._open()
+
+    def release(self):
+        """ Releases probe slot of a call which ended without an outcome (e.g. was cancelled). """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
+
+    @contextmanager
+    def call(self):
+        """ Guards a call to the api. Exceptions raised in the block are recorded as
+            failures and the duration of the block is measured.
+
+            with breaker.call() as call:
+                response = ...
+                call.failed = response.status_code >= 500
+        """
+        self.before_call()
+        call = _Call()
+        started = self.clock()
+
+        try:
+            yield call
+        except Exception:
+            self.record(False, self.clock() - started)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        else:
+            self.record(not call.failed, self.clock() - started)
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'rejected': self.rejected
+        }
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from .text import normalize_text
+
+
+def canonical_key(params: dict) -> str:
+    """ Canonical key of api parameters. Dictionaries with same content
+        have the same key regardless of the order of their items. """
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+FRESH = 'fresh'
+STALE = 'stale'
+
+
+class ResponseCache:
+    """
+    In-process cache for api responses. Entries expire after ttl seconds, and
+    when the cache is full the least recently used entry is evicted. Expired
+    entries are kept for a grace period of stale_ttl seconds, during which
+    get_stale still returns them, e.g. while the api is down.
+
+    Attributes
+    ----------
+    maxsize : int
+        maximum number of entries. Cache is disabled if maxsize is zero.
+    ttl : float
+        time to live of an entry in seconds.
+    stale_ttl : float
+        seconds an expired entry is kept for get_stale.
+    hits : int
+        number of lookups which found a valid entry.
+    misses : int
+        number of lookups which did not find a valid entry.
+    stale_hits : int
+        number of expired entries returned by get_stale.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300, stale_ttl: float = 0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def key(self, params: dict) -> str:
+        return canonical_key(params)
+
+    def get(self, key: str):
+        """ Returns cached value or None if key is not cached or has expired. """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, value = entry
+            now = self.clock()
+            if expires <= now:
+                if expires + self.stale_ttl <= now:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_stale(self, key: str):
+        """ Returns cached value, also an expired one within the grace period,
+            or None if there is neither. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires, value = entry
+            now = self.clock()
+            if expires + self.stale_ttl <= now:
+                del self._entries[key]
+                return None
+
+            if expires <= now:
+                self.stale_hits += 1
+            return value
+
+    def state(self, key: str):
+        """ FRESH if key has a valid entry, STALE if its entry has expired but is
+            within the grace period, otherwise None. Does not count as a lookup. """
+        with self._lock:
+            entry = self._entries.get(key)
+            now = self.clock()
+            if entry is None or entry[0] + self.stale_ttl <= now:
+                return None
+            return FRESH if entry[0] > now else STALE
+
+    def set(self, key: str, value):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.stale_hits = 0
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_hits': self.stale_hits
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TextSearchCache(ResponseCache):
+    """
+    Response cache for text search. Search text is normalized before the key
+    is computed, so that e.g. 'Nuorten työttömyys' and 'nuorten  työttömyys '
+    share the same entry. Other parameters (filters, limit) are part of the key as is.
+    """
+
+    def key(self, params: dict) -> str:
+        if 'search_text' in params:
+            params = dict(params, search_text=normalize_text(params['search_text']))
+        return super().key(params)
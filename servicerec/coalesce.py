@@ -0,0 +1,97 @@
+import asyncio
+import threading
+
+
+class _Call:
+    """ Upstream call made by the first caller of a key, and shared with the others. """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent requests. The first caller of a key makes the
+    request, and callers arriving with the same key while the request is in
+    flight wait for it and get the same result (or exception).
+
+    Both threads (do) and asyncio tasks (do_async) are supported. An async
+    request runs in a task of its own, so cancelling a caller never cancels the
+    request the other callers are waiting for.
+
+    Attributes
+    ----------
+    calls : int
+        number of requests actually made.
+    merged : int
+        number of callers which shared a request made by another caller.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.merged = 0
+        self._calls = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn):
+        """ Calls fn unless a call with the same key is already in flight. """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+            else:
+                self.merged += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+    async def do_async(self, key: str, fn):
+        """ Awaits fn() unless a call with the same key is already in flight. """
+        loop = asyncio.get_running_loop()
+        task = self._futures.get(key)
+
+        if task is not None and task.get_loop() is loop:
+            self.merged += 1
+        else:
+            # The shared call runs in its own task, so that it is not cancelled
+            # with any of its callers, including the first one.
+            task = asyncio.ensure_future(fn())
+            self._futures[key] = task
+            self.calls += 1
+            task.add_done_callback(lambda done: self._call_done(key, done))
+
+        return await asyncio.shield(task)
+
+    def _call_done(self, key: str, task):
+        if self._futures.get(key) is task:
+            del self._futures[key]
+        # Mark exception retrieved in case every caller was cancelled.
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'merged': self.merged
+        }
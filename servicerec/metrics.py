@@ -0,0 +1,252 @@
+""" In-process metrics of the actions and api calls in Prometheus text format.
+
+Metrics are served at /metrics by start_metrics_server, which the action
+server starts when ACTIONS_METRICS_PORT is set:
+
+    curl http://localhost:9100/metrics
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS_PORT = os.getenv('ACTIONS_METRICS_PORT')
+METRICS_ADDRESS = os.getenv('ACTIONS_METRICS_ADDRESS', '')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """
+    Base class of metrics. A metric has a value per combination of label
+    values, given as keyword arguments.
+    """
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple, *extra) -> tuple:
+        return tuple(zip(self.labelnames, key)) + extra
+
+    def samples(self) -> list:
+        """ Returns (name, labels, value) tuples. """
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines += [f'{name}{format_labels(labels)} {format_value(value)}' for name, labels, value in self.samples()]
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name + '_total', self._labels(key), value) for key, value in values]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        counts, _ = self._values.get(self._key(labels)) or ([0], 0.0)
+        return sum(counts)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+
+        samples = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', self._labels(key, ('le', format_value(float(bound)))), cumulative))
+            samples.append((self.name + '_sum', self._labels(key), total))
+            samples.append((self.name + '_count', self._labels(key), cumulative))
+        return samples
+
+
+class Registry:
+    """ Metrics exposed by the metrics server. """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, **kwargs))
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return ''.join(metric.expose() for metric in metrics)
+
+    def clear(self):
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+ACTION_DURATION = REGISTRY.histogram(
+    'actions_action_duration_seconds', 'Duration of action runs.', ('action',))
+STAGE_DURATION = REGISTRY.histogram(
+    'actions_pipeline_stage_duration_seconds', 'Duration of recommendation pipeline stages.', ('action', 'stage'))
+UPSTREAM_DURATION = REGISTRY.histogram(
+    'actions_upstream_request_duration_seconds', 'Duration of aurora api requests.', ('method',))
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    'actions_upstream_responses', 'Aurora api requests by response status code, error or circuit_open.',
+    ('method', 'status'))
+UPSTREAM_RESPONSE_SIZE = REGISTRY.histogram(
+    'actions_upstream_response_size_bytes', 'Size of aurora api response bodies.', ('method',),
+    buckets=SIZE_BUCKETS)
+STALE_RESPONSES = REGISTRY.counter(
+    'actions_upstream_stale_responses', 'Expired cached responses served because the aurora api failed.',
+    ('method', 'reason'))
+STALE_REFRESHES = REGISTRY.counter(
+    'actions_upstream_stale_refreshes', 'Background refreshes of expired cached responses by result.',
+    ('method', 'result'))
+PREFETCHES = REGISTRY.counter(
+    'actions_prefetches', 'Speculative api calls by result: ok, error, cancelled or cached (not made).',
+    ('method', 'result'))
+FALLBACK_MESSAGES = REGISTRY.counter(
+    'actions_fallback_messages', 'Fallback messages shown instead of recommendations.', ('action', 'fallback'))
+
+
+def measure_action(run):
+    """ Decorator of Action.run which records duration of the action. """
+    if asyncio.iscoroutinefunction(run):
+        @functools.wraps(run)
+        async def measured_run(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await run(self, *args, **kwargs)
+            finally:
+                ACTION_DURATION.observe(time.perf_counter() - started, action=self.name())
+    else:
+        @functools.wraps(run)
+        def measured_run(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return run(self, *args, **kwargs)
+            finally:
+                ACTION_DURATION.observe(time.perf_counter() - started, action=self.name())
+
+    return measured_run
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = self.registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, address: str = '') -> ThreadingHTTPServer:
+    """ Serves the metrics from a daemon thread. Only one server is started per process. """
+    global _server
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((address, port), MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+        return _server
+
+
+def stop_metrics_server():
+    global _server
+
+    with _server_lock:
+        if _server is not None:
+            _server.shutdown()
+            _server.server_close()
+            _server = None
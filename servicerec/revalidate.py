@@ -0,0 +1,74 @@
+import asyncio
+
+from .cache import STALE
+
+
+class Revalidator:
+    """
+    Refreshes stale cache entries in the background while the api is failing.
+    Each key has at most one refresh loop, which calls refresh() every interval
+    seconds until it succeeds, the entry is fresh again (e.g. refreshed by a
+    request of a user) or the entry has left the grace period of the cache.
+
+    Attributes
+    ----------
+    interval : float
+        seconds between refresh attempts.
+    refreshed : int
+        number of entries refreshed.
+    failed : int
+        number of failed refresh attempts.
+    """
+
+    def __init__(self, interval: float = 10):
+        self.interval = interval
+        self.refreshed = 0
+        self.failed = 0
+        self._tasks = {}
+
+    def schedule(self, cache, key: str, refresh, on_result=None) -> bool:
+        """ Starts a refresh loop of the key unless one is already running.
+            refresh is an async function which returns True when the entry was
+            refreshed, and on_result(refreshed) is called after each attempt. """
+        loop = asyncio.get_running_loop()
+        task = self._tasks.get(key)
+
+        if task is not None and not task.done() and task.get_loop() is loop:
+            return False
+
+        self._tasks[key] = loop.create_task(self._run(cache, key, refresh, on_result))
+        return True
+
+    async def _run(self, cache, key: str, refresh, on_result):
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                if cache.state(key) != STALE:
+                    return
+
+                try:
+                    refreshed = await refresh()
+                except ConnectionError:
+                    refreshed = False
+
+                if on_result is not None:
+                    on_result(refreshed)
+                if refreshed:
+                    self.refreshed += 1
+                    return
+                self.failed += 1
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+    def pending(self) -> int:
+        """ Number of keys being refreshed. """
+        return sum(not task.done() for task in self._tasks.values())
+
+    async def cancel(self):
+        """ Cancels all refresh loops. """
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
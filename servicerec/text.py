@@ -0,0 +1,56 @@
+import re
+import unicodedata
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_text(text: str) -> str:
+    """ Normalizes free text for comparison. Text is casefolded and punctuation is
+        replaced with whitespace, which is then collapsed. Finnish and Swedish
+        letters (å, ä, ö) are kept as they are, but decomposed forms are composed
+        first so that differently encoded 'ä' characters are equal. """
+    text = unicodedata.normalize('NFC', str(text)).casefold()
+    return ' '.join(_NON_WORD.sub(' ', text).split())
+
+
+# Frequent finnish words which do not tell what a service is about.
+FINNISH_STOPWORDS = frozenset('''
+ja tai sekä myös eli ei en et emme ette eivät on ovat oli olivat olla ole ollut
+se ne tämä nämä tuo nuo joka jotka mikä mitkä kuka ketkä jos kun kuin että
+mutta vaan vain niin jo nyt voi voit voivat sen niiden sitä niitä siitä
+mukaan kautta sekä myöskin jne esim mm ym kanssa ilman yli alle
+'''.split())
+
+# Possessive suffixes, and case endings and plural markers of finnish nouns,
+# longest first. Stripping them is a light stemming which maps most inflected
+# forms of a word (e.g. nuori, nuoret, nuorten, nuorille) to the same stem.
+_POSSESSIVE_SUFFIXES = ('nsa', 'nsä', 'mme', 'nne')
+_CASE_SUFFIXES = tuple(sorted('''
+ineen itten issa issä ista istä illa illä ilta iltä ille ihin iden tten
+ssa ssä sta stä lla llä lta ltä lle ksi tta ttä den ten han hen hin hon hun
+hyn hän hön ien jen na nä ta tä ja jä in en an än n t
+'''.split(), key=len, reverse=True))
+_VOWELS = frozenset('aeiouyäö')
+
+MIN_STEM_LENGTH = 3
+
+
+def stem(word: str) -> str:
+    """ Light stemming of a finnish word: a possessive suffix, a case ending and
+        a final vowel are removed, if at least MIN_STEM_LENGTH characters remain. """
+    for suffixes in (_POSSESSIVE_SUFFIXES, _CASE_SUFFIXES):
+        for suffix in suffixes:
+            if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+                word = word[:-len(suffix)]
+                break
+
+    if len(word) > MIN_STEM_LENGTH and word[-1] in _VOWELS:
+        word = word[:-1]
+
+    return word
+
+
+def tokenize(text: str) -> list:
+    """ Splits normalized text into stemmed words, leaving out stopwords and numbers. """
+    return [stem(word) for word in normalize_text(text).split()
+            if word not in FINNISH_STOPWORDS and not word.isdigit()]
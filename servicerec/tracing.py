@@ -0,0 +1,128 @@
+""" Optional tracing of the actions with the OpenTelemetry span api.
+
+Tracing is off by default and spans cost next to nothing. It is turned on with
+ACTIONS_TRACING=1 when opentelemetry-api is installed; spans are then created
+with the globally configured OpenTelemetry tracer provider, e.g.
+
+    pip install opentelemetry-sdk opentelemetry-exporter-otlp
+    ACTIONS_TRACING=1 opentelemetry-instrument rasa run actions
+
+Any tracer with the OpenTelemetry start_as_current_span api can also be set
+with set_tracer. Spans made within an action carry the sender id of the
+conversation as sender_id attribute.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+TRACING = os.getenv('ACTIONS_TRACING', '').lower() in ('1', 'true', 'yes')
+TRACER_NAME = 'auroraai.actions'
+
+SENDER_ID = contextvars.ContextVar('sender_id', default=None)
+
+
+class NoopSpan:
+    """ Span which records nothing. Is its own context manager. """
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def add_event(self, name, attributes=None, timestamp=None):
+        pass
+
+    def record_exception(self, exception, attributes=None, timestamp=None, escaped=False):
+        pass
+
+    def set_status(self, status, description=None):
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+_tracer = None
+
+
+def set_tracer(tracer):
+    """ Sets the tracer used for spans, None turns tracing off. """
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name: str, **attributes):
+    """ Context manager of a span which is a child of the current span.
+
+        with span('validate_filters') as s:
+            s.set_attribute('filters', len(filters))
+    """
+    if _tracer is None:
+        return NOOP_SPAN
+
+    sender_id = SENDER_ID.get()
+    if sender_id is not None:
+        attributes['sender_id'] = sender_id
+
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+
+def traced(name: str = None):
+    """ Decorator which runs the function in a span, named after the function by default. """
+
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def traced_fn(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def traced_fn(*args, **kwargs):
+                with span(span_name):
+                    return fn(*args, **kwargs)
+
+        return traced_fn
+
+    return decorator
+
+
+def trace_action(run):
+    """ Decorator of Action.run which runs the action in a span named after the
+        action, and sets the sender id of the conversation to the spans within. """
+
+    @functools.wraps(run)
+    async def traced_run(self, dispatcher, tracker, domain):
+        token = SENDER_ID.set(getattr(tracker, 'sender_id', None))
+        try:
+            with span(self.name()):
+                return await run(self, dispatcher, tracker, domain)
+        finally:
+            SENDER_ID.reset(token)
+
+    return traced_run
+
+
+if TRACING and otel_trace is not None:
+    set_tracer(otel_trace.get_tracer(TRACER_NAME))
@@ -0,0 +1,219 @@
+""" Typed snapshot of the slots used in service recommendations.
+
+All slots a recommendation action needs are read from the tracker in one pass
+by extract_slots, driven by SLOT_SCHEMA, into a SlotSnapshot:
+
+    snapshot = extract_slots(tracker)
+    snapshot.limit, snapshot.life_situation_meters, snapshot.service_filters
+
+Every field has a converter which turns the raw slot value into a valid value
+or the default of the field, so invalid slot values never raise. The same
+converters back the validate methods of ValidateSlots in actions.py.
+"""
+from actions.ranking import NULL_TERM
+from actions.servicerec.tracing import traced
+from actions.utils import (
+    Filters,
+    find_municipality,
+    LIFE_SITUATION_SLOTS,
+    DEFAULT_LIFE_SITUATION_METER_VALUES,
+    MIN_FEATURE_VALUE,
+    MAX_FEATURE_VALUE,
+    AGE_SLOT,
+    DEFAULT_AGE_VALUE,
+    MUNICIPALITY_SLOT,
+    DEFAULT_MUNICIPALITY_VALUE,
+    SEARCH_TEXT_SLOT,
+    DEFAULT_SEARCH_TEXT_VALUE,
+    INCLUDE_NATIONAL_SERVICES_SLOT,
+    RESULT_LIMIT_SLOT,
+    DEFAULT_RESULT_LIMIT,
+    RERANK_SLOT,
+    SHOW_API_CALL_PARAMETERS_SLOT,
+    WHITELIST_SLOT,
+    BLACKLIST_SLOT
+)
+
+CODE_FILTERS = Filters().filters
+
+
+def to_int(value, default=None):
+    """ Integer value of a slot, default if it is not a number. """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def to_bool(value):
+    """ Boolean value of a slot: True for booleans True, '1' and 'yes', False for
+        other strings and False, and None for other values. """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        number = to_int(value)
+        if number is not None:
+            return number == 1
+        return value.lower() == 'yes'
+    return None
+
+
+def to_municipality(value):
+    """ Municipality code of a municipality code or name. """
+    if isinstance(value, str):
+        return find_municipality(value) or DEFAULT_MUNICIPALITY_VALUE
+    return DEFAULT_MUNICIPALITY_VALUE
+
+
+def to_search_text(value) -> str:
+    if value is None:
+        return DEFAULT_SEARCH_TEXT_VALUE
+    return str(value)
+
+
+def to_sort_term(value):
+    return value or NULL_TERM
+
+
+def to_meter(value):
+    """ Value of a 3x10d life situation meter, None if it is not between
+        MIN_FEATURE_VALUE and MAX_FEATURE_VALUE. """
+    number = to_int(value)
+    if number is None or not MIN_FEATURE_VALUE <= number <= MAX_FEATURE_VALUE:
+        return None
+    return number
+
+
+def to_filter(codefilter, value):
+    """ Valid codes of a filter slot, None if there are none. """
+    try:
+        return codefilter.validate_selection(value)
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class SlotField:
+    """ Field of a snapshot read from one slot with a converter. """
+    __slots__ = ('name', 'slot', 'convert')
+
+    def __init__(self, name: str, slot: str, convert):
+        self.name = name
+        self.slot = slot
+        self.convert = convert
+
+    def read(self, values: dict):
+        return self.convert(values.get(self.slot))
+
+
+class MeterField:
+    """ Life situation meters, read from the slots of LIFE_SITUATION_SLOTS. Meters
+        without a valid value are left out, and if none is valid the default
+        meter values are used. """
+    __slots__ = ('name', 'slots')
+
+    def __init__(self, name: str, slots: dict):
+        self.name = name
+        self.slots = tuple(slots.items())
+
+    @traced('validate_feat')
+    def read(self, values: dict):
+        meters = {}
+        for meter, slot in self.slots:
+            value = to_meter(values.get(slot))
+            if value is not None:
+                meters[meter] = [value]
+        return meters or DEFAULT_LIFE_SITUATION_METER_VALUES
+
+
+class FilterField:
+    """ Service filters of the api, read from the include national services slot
+        and the code filter slots. Filters without a valid value are left out. """
+    __slots__ = ('name', 'filters')
+
+    def __init__(self, name: str, filters: dict):
+        self.name = name
+        self.filters = tuple(filters.values())
+
+    @traced('validate_filters')
+    def read(self, values: dict):
+        filters = {}
+
+        include_national_services = to_bool(values.get(INCLUDE_NATIONAL_SERVICES_SLOT))
+        if include_national_services is not None:
+            filters['include_national_services'] = include_national_services
+
+        for codefilter in self.filters:
+            codes = to_filter(codefilter, values.get(codefilter.slot))
+            if codes:
+                filters[codefilter.api_parameter] = codes
+
+        return filters
+
+
+# Fields of a snapshot. Names of the fields are the names of the values in api parameters.
+SLOT_SCHEMA = (
+    SlotField('limit', RESULT_LIMIT_SLOT, lambda value: to_int(value, DEFAULT_RESULT_LIMIT)),
+    SlotField('rerank', RERANK_SLOT, to_bool),
+    SlotField('age', AGE_SLOT, lambda value: to_int(value, DEFAULT_AGE_VALUE)),
+    SlotField('municipality', MUNICIPALITY_SLOT, to_municipality),
+    SlotField('search_text', SEARCH_TEXT_SLOT, to_search_text),
+    MeterField('life_situation_meters', LIFE_SITUATION_SLOTS),
+    FilterField('service_filters', CODE_FILTERS),
+    SlotField('whitelist', WHITELIST_SLOT, to_sort_term),
+    SlotField('blacklist', BLACKLIST_SLOT, to_sort_term),
+    SlotField('show_params', SHOW_API_CALL_PARAMETERS_SLOT, lambda value: bool(to_bool(value)))
+)
+
+SCHEMA_FIELDS = {field.name: field for field in SLOT_SCHEMA}
+
+
+class SlotSnapshot:
+    """
+    Validated slot values of one turn. Fields which were not extracted are None.
+
+    Attributes
+    ----------
+    limit : int
+        number of recommendations.
+    rerank : bool
+        rerank parameter, None if not set.
+    age : int
+        age of the user, None if not set.
+    municipality : str
+        municipality code of the user, None if not set.
+    search_text : str
+        text of a text search.
+    life_situation_meters : dict
+        3x10d meter values as lists by meter name.
+    service_filters : dict
+        filters of the api.
+    whitelist, blacklist : str
+        sort terms, 'NULL' if not set.
+    show_params : bool
+        api parameters are shown to the user.
+    """
+    __slots__ = tuple(SCHEMA_FIELDS)
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    def as_dict(self, names: tuple = None) -> dict:
+        """ Fields as a dictionary, optionally only the named ones. """
+        return {name: getattr(self, name) for name in names or self.__slots__}
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'SlotSnapshot({fields})'
+
+
+def extract_slots(tracker, names: tuple = None) -> SlotSnapshot:
+    """ Reads the named fields (default all fields of SLOT_SCHEMA) from the slots
+        of tracker in one pass. """
+    values = tracker.current_slot_values()
+    fields = SLOT_SCHEMA if names is None else [SCHEMA_FIELDS[name] for name in names]
+
+    snapshot = SlotSnapshot()
+    for field in fields:
+        setattr(snapshot, field.name, field.read(values))
+    return snapshot
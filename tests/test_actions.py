@@ -0,0 +1,236 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+from rasa_sdk import Tracker
+from rasa_sdk.events import SlotSet
+from actions.actions import (
+    ElementTemplate,
+    CarouselElement,
+    CarouselTemplate,
+    ServiceListByLifeSituation,
+    ServiceListByTextSearch,
+    ActionShowInfo,
+    FanOutSearch,
+    LIFE_SITUATION_PREFETCHER
+)
+from actions.pipeline import UpstreamCall, LocalSearchFallback
+from actions.servicerec.api import ApiResponse, AsyncServiceRecommenderAPI, TEXT_SEARCH_CACHE
+from actions.pipeline import PipelineContext
+from rasa_sdk.executor import CollectingDispatcher
+from actions.utils import (
+    BUTTON_PRESSED_INTENT,
+    BUTTON_PRESSED_SLOT,
+    LIFE_SITUATION_SLOTS,
+    MUNICIPALITY_FILTER_SLOT,
+    RECOMMENDATIONS_SLOT,
+    RESULT_LIMIT_SLOT,
+    SEARCH_TEXT_SLOT,
+    SERVICE_DETAILS_EXPIRED_MESSAGE
+)
+
+
+def make_tracker(slots):
+    return Tracker('test', slots, {}, [], False, None, {}, None)
+
+
+class TestElementTemplate(unittest.TestCase):
+
+    def test_payload(self):
+        template = ElementTemplate()
+        self.assertEqual(template.payload('abc-123', 'moreinfo'),
+                         f'/{BUTTON_PRESSED_INTENT}{{"{BUTTON_PRESSED_SLOT}":"abc-123_moreinfo"}}')
+
+    def test_payload_is_escaped(self):
+        template = ElementTemplate()
+        service_id = 'a"b\\c\nd'
+        payload = template.payload(service_id, 'homepage')
+
+        entities = json.loads(payload[len(f'/{BUTTON_PRESSED_INTENT}'):])
+        self.assertEqual(entities, {BUTTON_PRESSED_SLOT: f'{service_id}_homepage'})
+
+    def test_rendered_elements_are_cached(self):
+        template = ElementTemplate()
+        element = template.render('1', 'Palvelu')
+
+        self.assertIs(template.render('1', 'Palvelu'), element)
+        self.assertIsNot(template.render('1', 'Toinen palvelu'), element)
+        self.assertEqual([button['title'] for button in element['buttons']],
+                         ['Lisätietoja', 'Yhteystiedot', 'Palvelun kotisivu'])
+
+    def test_carousel(self):
+        ct = CarouselTemplate()
+        ct.add_element(CarouselElement('1', 'Palvelu'))
+        ct.add_rendered_element(ElementTemplate().render('2', 'Toinen palvelu'))
+
+        elements = ct.template['payload']['elements']
+        self.assertEqual([element['title'] for element in elements], ['Palvelu', 'Toinen palvelu'])
+        self.assertTrue(elements[1]['buttons'][1]['payload'].endswith('"2_contactinfo"}'))
+
+
+class TestActionShowInfo(unittest.TestCase):
+
+    def test_service_id_with_underscore(self):
+        services = {'recommended_services': [{'service_id': 'a_1', 'service_name': 'Palvelu',
+                                              'service_channels': [{'service_channel_name': 'Kanava',
+                                                                    'web_pages': ['https://a.fi']}]}]}
+        dispatcher = CollectingDispatcher()
+        tracker = make_tracker({RECOMMENDATIONS_SLOT: services, BUTTON_PRESSED_SLOT: 'a_1_homepage'})
+        ActionShowInfo().run(dispatcher, tracker, {})
+
+        self.assertEqual(dispatcher.messages[0]['template'], 'Palvelu -palvelun palvelukanavien kotisivut:')
+
+    def test_expired_details(self):
+        services = {'recommended_services': [{'service_id': 'a', 'service_name': 'Palvelu'}]}
+        dispatcher = CollectingDispatcher()
+        tracker = make_tracker({RECOMMENDATIONS_SLOT: services, BUTTON_PRESSED_SLOT: 'a_homepage'})
+        ActionShowInfo().run(dispatcher, tracker, {})
+
+        self.assertEqual(dispatcher.messages[0]['text'], SERVICE_DETAILS_EXPIRED_MESSAGE)
+
+
+class TestLifeSituationPrefetch(unittest.IsolatedAsyncioTestCase):
+
+    async def test_params_match_action(self):
+        slots = {RESULT_LIMIT_SLOT: '3'}
+        events = [SlotSet(LIFE_SITUATION_SLOTS['family'], '4'),
+                  SlotSet(LIFE_SITUATION_SLOTS['health'], '7'),
+                  SlotSet(MUNICIPALITY_FILTER_SLOT, '091')]
+
+        prefetched = await LIFE_SITUATION_PREFETCHER.params(make_tracker(slots), events)
+
+        tracker = make_tracker(dict(slots, **{event['name']: event['value'] for event in events}))
+        context = PipelineContext(None, tracker, {}, method=ServiceListByLifeSituation.method)
+        await ServiceListByLifeSituation.pipeline.before('show_params').run(context)
+
+        self.assertEqual(prefetched, context.params)
+        self.assertEqual(prefetched['life_situation_meters'], {'family': [4], 'health': [7]})
+        self.assertEqual(prefetched['service_filters']['municipality_codes'], ['091'])
+
+
+class SearchApi:
+    """ Api stub which returns services by search text, and fails for texts in errors. """
+
+    def __init__(self, results, errors=(), delay=0):
+        self.results = results
+        self.errors = errors
+        self.delay = delay
+        self.searches = []
+
+    def cached_response(self, params, method):
+        return None
+
+    async def fetch(self, params, method):
+        self.searches.append(params['search_text'])
+        await asyncio.sleep(self.delay)
+        if params['search_text'] in self.errors:
+            raise ConnectionError()
+        services = [{'service_id': service_id, 'service_name': service_id}
+                    for service_id in self.results.get(params['search_text'], [])]
+        return ApiResponse.from_json({'recommended_services': services})
+
+
+class LocalIndex:
+    """ Search index stub which finds one service. """
+
+    def search_params(self, params):
+        return {'recommended_services': [{'service_id': 'local', 'service_name': params['search_text']}]}
+
+
+class TestFanOutPipeline(unittest.IsolatedAsyncioTestCase):
+
+    RESULTS = {'Nuoret ja työ': ['a', 'b'], 'nuoret työ': ['b', 'c'], 'Nuoret ja työ Tampere': ['c', 'b']}
+
+    def setUp(self):
+        TEXT_SEARCH_CACHE.clear()
+
+    def tearDown(self):
+        TEXT_SEARCH_CACHE.clear()
+
+    async def post(self, params, method):
+        services = [{'service_id': service_id, 'service_name': service_id}
+                    for service_id in self.RESULTS.get(params['search_text'], [])]
+        return ApiResponse.from_json({'recommended_services': services})
+
+    async def run_turn(self, pipeline):
+        tracker = make_tracker({SEARCH_TEXT_SLOT: 'Nuoret ja työ', MUNICIPALITY_FILTER_SLOT: 'Tampere'})
+        context = PipelineContext(CollectingDispatcher(), tracker, {}, method=ServiceListByTextSearch.method)
+        await pipeline.run(context)
+        return [service['service_id'] for service in context.response.json()['recommended_services']]
+
+    async def test_repeated_search_is_fused(self):
+        pipeline = ServiceListByTextSearch.pipeline
+        fanout = next(stage for stage in pipeline.stages if isinstance(stage, FanOutSearch))
+
+        with mock.patch.object(fanout, 'mode', 'fanout'), \
+                mock.patch.object(AsyncServiceRecommenderAPI, '_post', self.post):
+            first = await self.run_turn(pipeline)
+            second = await self.run_turn(pipeline)
+
+        self.assertEqual(first, ['b', 'c', 'a'])
+        self.assertEqual(second, first)
+
+
+class TestFanOutSearch(unittest.IsolatedAsyncioTestCase):
+
+    async def run_stage(self, api, mode='fanout', upstream=None, response=None):
+        context = PipelineContext(CollectingDispatcher(), None, {}, method='text_search')
+        context.params = {'search_text': 'Nuoret ja työ', 'limit': 3,
+                          'service_filters': {'municipality_codes': ['837']}}
+        context.response = response
+        await FanOutSearch(upstream or UpstreamCall(api), mode=mode)(context)
+        return context
+
+    def ids(self, context):
+        return [service['service_id'] for service in context.response.json()['recommended_services']]
+
+    async def test_results_are_fused(self):
+        api = SearchApi({'Nuoret ja työ': ['a', 'b'], 'nuoret työ': ['b', 'c'], 'Nuoret ja työ Tampere': ['d', 'b']})
+        context = await self.run_stage(api)
+
+        self.assertEqual(sorted(api.searches), sorted(['Nuoret ja työ', 'nuoret työ', 'Nuoret ja työ Tampere']))
+        self.assertEqual(self.ids(context), ['b', 'a', 'd'])
+
+    async def test_failed_variants_are_left_out(self):
+        api = SearchApi({'Nuoret ja työ': ['a'], 'nuoret työ': ['c']}, errors=('Nuoret ja työ Tampere',))
+        context = await self.run_stage(api)
+
+        self.assertEqual(self.ids(context), ['a', 'c'])
+
+    async def test_run_stops_if_all_variants_fail(self):
+        api = SearchApi({}, errors=('Nuoret ja työ', 'nuoret työ', 'Nuoret ja työ Tampere'))
+        context = await self.run_stage(api)
+
+        self.assertTrue(context.stopped)
+        self.assertEqual(len(api.searches), 3)
+
+    async def test_local_search_if_all_variants_fail(self):
+        api = SearchApi({}, errors=('Nuoret ja työ', 'nuoret työ', 'Nuoret ja työ Tampere'))
+        context = await self.run_stage(api, upstream=LocalSearchFallback(api, index=LocalIndex()))
+
+        self.assertFalse(context.stopped)
+        self.assertEqual(self.ids(context), ['local'])
+        self.assertEqual(len(api.searches), 3)
+
+    async def test_latency_budget(self):
+        api = SearchApi({'Nuoret ja työ': ['a']}, delay=0.2)
+        upstream = LocalSearchFallback(api, index=LocalIndex(), latency_budget=0.01)
+        context = await self.run_stage(api, upstream=upstream)
+
+        self.assertEqual(self.ids(context), ['local'])
+        self.assertEqual(len(api.searches), 3)
+
+    async def test_cached_response_is_kept(self):
+        api = SearchApi({'Nuoret ja työ': ['a']})
+        response = ApiResponse.from_json({'recommended_services': []})
+        context = await self.run_stage(api, response=response)
+
+        self.assertIs(context.response, response)
+        self.assertEqual(api.searches, [])
+
+    async def test_single_mode(self):
+        api = SearchApi({'Nuoret ja työ': ['a']})
+        context = await self.run_stage(api, mode='single')
+
+        self.assertEqual(api.searches, ['Nuoret ja työ'])
+        self.assertEqual(self.ids(context), ['a'])
@@ -1,8 +1,28 @@
+import asyncio
+import threading
 import unittest
-from servicerec.api import ServiceRecommenderAPI
+from unittest import mock
+from aiohttp import web
+from servicerec.api import (
+    ServiceRecommenderAPI,
+    SessionAttributesAPI,
+    AsyncServiceRecommenderAPI,
+    close_async_session,
+    get_async_session,
+    RECOMMENDATION_CACHE,
+    REVALIDATOR
+)
 
 class TestApi(unittest.TestCase):
 
+    def test_shared_session(self):
+        api = ServiceRecommenderAPI()
+        session_api = SessionAttributesAPI()
+
+        self.assertIs(api.session, session_api.session)
+        self.assertIs(api.headers, session_api.headers)
+        self.assertTrue(api.headers['Authorization'].startswith('Basic '))
+
     def test_parameter_based_endpoint(self):
         api = ServiceRecommenderAPI()
 
@@ -50,3 +70,121 @@ class TestApi(unittest.TestCase):
             json = response.json()
             services = json.get('recommended_services', [])
             self.assertTrue(len(services) > 0)
+
+
+class TestAsyncSession(unittest.TestCase):
+
+    def test_session_of_old_loop_is_released(self):
+        async def session():
+            return get_async_session()
+
+        first = asyncio.run(session())
+        second = asyncio.run(session())
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+        asyncio.run(close_async_session())
+
+    def test_session_of_running_loop_is_closed(self):
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        async def session():
+            return get_async_session()
+
+        first = asyncio.run_coroutine_threadsafe(session(), loop).result()
+        asyncio.run(session())
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01), loop).result()
+
+        self.assertTrue(first.closed)
+        asyncio.run(close_async_session())
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+class TestAsyncApi(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.calls = 0
+
+        async def recommend_service(request):
+            self.calls += 1
+            params = await request.json()
+            await asyncio.sleep(0.01)
+            services = [{'service_id': str(i), 'service_name': f'Palvelu {i}'}
+                        for i in range(params['limit'])]
+            return web.json_response({'recommended_services': services})
+
+        app = web.Application()
+        app.router.add_post('/recommend_service', recommend_service)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        self.url_patch = mock.patch('servicerec.api.URL', f'http://127.0.0.1:{port}/')
+        self.url_patch.start()
+
+    async def asyncTearDown(self):
+        RECOMMENDATION_CACHE.clear()
+        self.url_patch.stop()
+        await close_async_session()
+        await self.runner.cleanup()
+
+    async def test_get_recommendations(self):
+        api = AsyncServiceRecommenderAPI()
+
+        response = await api.get_recommendations(params={'limit': 3},
+                                                 method='recommend_service')
+        self.assertTrue(response.ok)
+        self.assertEqual(len(response.json()['recommended_services']), 3)
+
+    async def test_cached_recommendations(self):
+        api = AsyncServiceRecommenderAPI()
+
+        first = await api.get_recommendations(params={'limit': 2}, method='recommend_service')
+        second = await api.get_recommendations(params={'limit': 2}, method='recommend_service')
+        self.assertIs(first, second)
+        self.assertEqual(self.calls, 1)
+
+    async def test_coalesced_recommendations(self):
+        api = AsyncServiceRecommenderAPI()
+
+        responses = await asyncio.gather(*[api.get_recommendations(params={'limit': 4},
+                                                                   method='recommend_service')
+                                           for _ in range(5)])
+        self.assertTrue(all(response is responses[0] for response in responses))
+        self.assertEqual(self.calls, 1)
+
+    async def test_unknown_method(self):
+        api = AsyncServiceRecommenderAPI()
+
+        response = await api.get_recommendations(params={'limit': 3}, method='unknown_method')
+        self.assertFalse(response.ok)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_connection_error(self):
+        api = AsyncServiceRecommenderAPI()
+
+        with mock.patch('servicerec.api.URL', 'http://127.0.0.1:1/'):
+            with self.assertRaises(ConnectionError):
+                await api.get_recommendations(params={'limit': 3}, method='recommend_service')
+
+    async def test_stale_response_on_connection_error(self):
+        api = AsyncServiceRecommenderAPI()
+        response = await api.get_recommendations(params={'limit': 6}, method='recommend_service')
+
+        now = RECOMMENDATION_CACHE.clock() + RECOMMENDATION_CACHE.ttl + 1
+        with mock.patch.object(RECOMMENDATION_CACHE, 'clock', lambda: now), \
+                mock.patch.object(REVALIDATOR, 'interval', 0.01):
+            with mock.patch('servicerec.api.URL', 'http://127.0.0.1:1/'):
+                stale = await api.get_recommendations(params={'limit': 6}, method='recommend_service')
+                self.assertIs(stale, response)
+
+            while REVALIDATOR.pending():
+                await asyncio.sleep(0.01)
+
+        self.assertEqual(self.calls, 2)
@@ -0,0 +1,73 @@
+import unittest
+from servicerec.breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_rate_threshold=0.5,
+                                      slow_call_threshold=2,
+                                      slow_call_rate_threshold=0.5,
+                                      window_size=4,
+                                      minimum_calls=4,
+                                      open_duration=30,
+                                      clock=self.clock)
+
+    def fail(self):
+        with self.assertRaises(ConnectionError):
+            with self.breaker.call():
+                raise ConnectionError('api down')
+
+    def test_opens_on_failure_rate(self):
+        for _ in range(2):
+            with self.breaker.call():
+                pass
+        self.fail()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state, OPEN)
+
+        with self.assertRaises(CircuitOpenError):
+            with self.breaker.call():
+                self.assertTrue(False, 'call should not be made')
+        self.assertEqual(self.breaker.rejected, 1)
+
+    def test_opens_on_slow_calls(self):
+        for _ in range(4):
+            self.breaker.record(True, 3)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_server_error_is_failure(self):
+        for _ in range(4):
+            with self.breaker.call() as call:
+                call.failed = True
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_half_open_probe(self):
+        for _ in range(4):
+            self.fail()
+        self.clock.now = 30
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+        self.breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+        self.breaker.record(True, 0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_failed_probe_opens_again(self):
+        for _ in range(4):
+            self.fail()
+        self.clock.now = 30
+        self.fail()
+        self.assertEqual(self.breaker.state, OPEN)
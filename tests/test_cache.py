@@ -0,0 +1,129 @@
+import asyncio
+import unittest
+from servicerec.cache import ResponseCache, TextSearchCache, FRESH, STALE
+from servicerec.revalidate import Revalidator
+from servicerec.text import normalize_text
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_canonical_key(self):
+        a = {'limit': 5, 'life_situation_meters': {'family': [5], 'health': [3]}}
+        b = {'life_situation_meters': {'health': [3], 'family': [5]}, 'limit': 5}
+
+        self.assertEqual(self.cache.key(a), self.cache.key(b))
+        self.assertNotEqual(self.cache.key(a), self.cache.key({**a, 'limit': 4}))
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_ttl(self):
+        self.cache.set('a', 1)
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('c'), 3)
+
+    def test_stale_entries(self):
+        cache = ResponseCache(maxsize=2, ttl=10, stale_ttl=20, clock=self.clock)
+        cache.set('a', 1)
+        self.assertEqual(cache.state('a'), FRESH)
+
+        self.clock.now = 15
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.state('a'), STALE)
+        self.assertEqual(cache.get_stale('a'), 1)
+        self.assertEqual(cache.stale_hits, 1)
+
+        self.clock.now = 30
+        self.assertIsNone(cache.get_stale('a'))
+        self.assertIsNone(cache.state('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_disabled(self):
+        cache = ResponseCache(maxsize=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+
+class TestTextSearchCache(unittest.TestCase):
+
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text(' Nuorten  TYÖTTÖMYYS?! '), 'nuorten työttömyys')
+        self.assertEqual(normalize_text('Ha\u0308meenlinna'), 'hämeenlinna')
+
+    def test_normalized_key(self):
+        cache = TextSearchCache()
+        params = {'search_text': 'Nuorten työttömyys', 'limit': 5}
+
+        self.assertEqual(cache.key(params), cache.key({'limit': 5, 'search_text': 'nuorten  työttömyys. '}))
+        self.assertNotEqual(cache.key(params), cache.key({**params, 'limit': 4}))
+        self.assertNotEqual(cache.key(params),
+                            cache.key({**params, 'service_filters': {'municipality_codes': ['837']}}))
+
+
+class TestRevalidator(unittest.IsolatedAsyncioTestCase):
+
+    async def test_refresh_until_success(self):
+        clock = FakeClock()
+        cache = ResponseCache(ttl=10, stale_ttl=100, clock=clock)
+        cache.set('a', 1)
+        clock.now = 20
+        results = []
+
+        async def refresh():
+            if len(results) < 2:
+                raise ConnectionError()
+            cache.set('a', 2)
+            return True
+
+        revalidator = Revalidator(interval=0.001)
+        self.assertTrue(revalidator.schedule(cache, 'a', refresh, results.append))
+        self.assertFalse(revalidator.schedule(cache, 'a', refresh, results.append))
+
+        while revalidator.pending():
+            await asyncio.sleep(0.001)
+
+        self.assertEqual(results, [False, False, True])
+        self.assertEqual((revalidator.refreshed, revalidator.failed), (1, 2))
+        self.assertEqual(cache.get('a'), 2)
+
+    async def test_fresh_entry_is_not_refreshed(self):
+        cache = ResponseCache(ttl=10, stale_ttl=100, clock=FakeClock())
+        cache.set('a', 1)
+        calls = []
+
+        async def refresh():
+            calls.append(1)
+            return True
+
+        revalidator = Revalidator(interval=0.001)
+        revalidator.schedule(cache, 'a', refresh)
+        while revalidator.pending():
+            await asyncio.sleep(0.001)
+
+        self.assertEqual(calls, [])
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+import unittest
+from servicerec.coalesce import SingleFlight
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+
+    async def test_concurrent_calls_are_merged(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'recommended_services': []}
+
+        results = await asyncio.gather(*[flight.do_async('a', fetch) for _ in range(10)])
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(flight.stats(), {'calls': 1, 'merged': 9})
+
+    async def test_exception_is_shared(self):
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ConnectionError('api down')
+
+        results = await asyncio.gather(*[flight.do_async('a', fetch) for _ in range(3)],
+                                       return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+
+    async def test_cancelled_leader(self):
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return 1
+
+        leader = asyncio.ensure_future(flight.do_async('a', fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do_async('a', fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        self.assertEqual(await follower, 1)
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(flight.stats(), {'calls': 1, 'merged': 1})
+
+    async def test_sequential_calls_are_not_merged(self):
+        flight = SingleFlight()
+
+        async def fetch():
+            return 1
+
+        await flight.do_async('a', fetch)
+        await flight.do_async('a', fetch)
+        self.assertEqual(flight.stats(), {'calls': 2, 'merged': 0})
+
+    def test_threads(self):
+        flight = SingleFlight()
+        calls = []
+        results = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.05)
+            return 1
+
+        threads = [threading.Thread(target=lambda: results.append(flight.do('a', fetch)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [1] * 5)
+        self.assertEqual(flight.merged, 4)
@@ -0,0 +1,30 @@
+import unittest
+from actions.fuzzy import edit_distance, DeletionIndex, FuzzyMatcher
+
+
+class TestFuzzy(unittest.TestCase):
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance('tampere', 'tampere'), 0)
+        self.assertEqual(edit_distance('tampre', 'tampere'), 1)
+        self.assertEqual(edit_distance('tmapere', 'tampere'), 1)
+        self.assertEqual(edit_distance('hmeenlina', 'hämeenlinna'), 2)
+        self.assertEqual(edit_distance('', 'oulu'), 4)
+
+    def test_deletion_index(self):
+        index = DeletionIndex({'tampere': '837', 'turku': '853', 'tammela': '834'})
+
+        matches = index.search('tampre', 2)
+        self.assertEqual(matches[0], (1, 'tampere', '837'))
+        self.assertEqual(index.search('helsinki', 2), [])
+
+    def test_matcher(self):
+        matcher = FuzzyMatcher({'kuopio': '297', 'kuopion': 'x', 'oulu': '564', 'espoo': '049'})
+
+        self.assertEqual(matcher.match('kupio'), '297')
+        self.assertIsNone(matcher.match('ouli'))
+        self.assertIsNone(matcher.match('tukholma'))
+
+    def test_ambiguous_match(self):
+        matcher = FuzzyMatcher({'saloa': '1', 'salob': '2'}, min_confidence=0.75)
+        self.assertIsNone(matcher.match('salo'))
@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+from actions.koodisto import KoodistoSnapshot, KoodistoStore, compile_tables
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestKoodisto(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'koodisto.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_compile_export(self):
+        export = os.path.join(self.directory.name, 'kunta.json')
+        with open(export, 'w', encoding='utf-8') as f:
+            json.dump({'results': [
+                {'codeValue': '837', 'prefLabel': {'fi': 'Tampere', 'sv': 'Tammerfors'}},
+                {'codeValue': '091', 'prefLabel': {'fi': 'Helsinki', 'sv': 'Helsingfors'}},
+                {'codeValue': '179', 'prefLabel': {'fi': 'Jyväskylä', 'sv': 'Jyväskylä'}}
+            ]}, f)
+
+        tables = compile_tables({'municipality': export})
+
+        self.assertEqual(tables['municipality'], {'837': 'Tampere', '091': 'Helsinki', '179': 'Jyväskylä'})
+        self.assertEqual(tables['municipality_sv'], {'837': 'Tammerfors', '091': 'Helsingfors'})
+        self.assertIn('06', tables['region'])
+
+    def test_write_and_load(self):
+        KoodistoSnapshot({'region': {'06': 'Pirkanmaa', '01': 'Uusimaa'}}, version='v1').write(self.path)
+        snapshot = KoodistoSnapshot.load(self.path)
+
+        self.assertEqual(snapshot.version, 'v1')
+        self.assertEqual(list(snapshot.table('region')), ['01', '06'])
+
+    def test_hot_reload(self):
+        clock = FakeClock()
+        KoodistoSnapshot({'region': {'01': 'Uusimaa'}}, version='v1').write(self.path)
+        store = KoodistoStore(path=self.path, reload_interval=60, clock=clock)
+
+        first = store.snapshot
+        self.assertEqual(first.version, 'v1')
+        self.assertEqual(first.cached('key', lambda: 1), 1)
+
+        KoodistoSnapshot({'region': {'02': 'Varsinais-Suomi'}}, version='v2').write(self.path)
+        os.utime(self.path, ns=(0, 10 ** 18))
+        self.assertIs(store.snapshot, first)
+
+        clock.now = 60
+        self.assertEqual(store.snapshot.version, 'v2')
+        self.assertEqual(store.snapshot.cached('key', lambda: 2), 2)
+
+    def test_malformed_file(self):
+        KoodistoSnapshot({'region': {'01': 'Uusimaa'}}, version='v1').write(self.path)
+        store = KoodistoStore(path=self.path)
+        first = store.snapshot
+
+        for tables in ({'region': {'01': 'Uusimaa'}}, {'region': ['01', 'Uusimaa']}, ['region']):
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump({'format': 1, 'version': 'v2', 'tables': tables}, f)
+            os.utime(self.path, ns=(0, 10 ** 18))
+
+            with self.assertRaises(ValueError):
+                KoodistoSnapshot.load(self.path)
+            self.assertIs(store.reload(), first)
+
+    def test_missing_file(self):
+        store = KoodistoStore(path=self.path)
+        self.assertEqual(store.snapshot.version, 'classification_codes')
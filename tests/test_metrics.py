@@ -0,0 +1,97 @@
+import unittest
+import urllib.request
+from servicerec.metrics import (
+    Counter,
+    Histogram,
+    Registry,
+    measure_action,
+    start_metrics_server,
+    stop_metrics_server,
+    ACTION_DURATION,
+    UPSTREAM_RESPONSES,
+    UPSTREAM_DURATION,
+    UPSTREAM_RESPONSE_SIZE
+)
+from servicerec.api import ApiResponse, upstream_call
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self):
+        counter = Counter('requests', 'Requests.', ('method',))
+        counter.inc(method='text_search')
+        counter.inc(2, method='text_search')
+
+        self.assertEqual(counter.value(method='text_search'), 3)
+        self.assertEqual(counter.expose(), '# HELP requests Requests.\n'
+                                           '# TYPE requests counter\n'
+                                           'requests_total{method="text_search"} 3\n')
+
+    def test_wrong_labels(self):
+        counter = Counter('requests', 'Requests.', ('method',))
+        with self.assertRaises(ValueError):
+            counter.inc(status='200')
+
+    def test_histogram(self):
+        histogram = Histogram('latency', 'Latency.', ('action',), buckets=(0.1, 1))
+        histogram.observe(0.05, action='a')
+        histogram.observe(0.5, action='a')
+        histogram.observe(5, action='a')
+
+        lines = histogram.expose().splitlines()
+        self.assertIn('latency_bucket{action="a",le="0.1"} 1', lines)
+        self.assertIn('latency_bucket{action="a",le="1"} 2', lines)
+        self.assertIn('latency_bucket{action="a",le="+Inf"} 3', lines)
+        self.assertIn('latency_sum{action="a"} 5.55', lines)
+        self.assertIn('latency_count{action="a"} 3', lines)
+
+    def test_label_values_are_escaped(self):
+        counter = Counter('messages', 'Messages.', ('text',))
+        counter.inc(text='a "b"\n\\')
+        self.assertIn('messages_total{text="a \\"b\\"\\n\\\\"} 1', counter.expose())
+
+    def test_registry_names_are_unique(self):
+        registry = Registry()
+        registry.counter('requests', 'Requests.')
+        with self.assertRaises(ValueError):
+            registry.counter('requests', 'Requests.')
+
+    def test_measure_action(self):
+        class Action:
+            def name(self):
+                return 'action_test_measure'
+
+            @measure_action
+            def run(self, dispatcher, tracker, domain):
+                return []
+
+        Action().run(None, None, None)
+        self.assertEqual(ACTION_DURATION.count(action='action_test_measure'), 1)
+
+    def test_upstream_call(self):
+        before = UPSTREAM_DURATION.count(method='test_method')
+
+        with upstream_call('test_method') as call:
+            call.response = ApiResponse(404, 'Not Found', 'not found')
+            call.size = 9
+
+        with self.assertRaises(ConnectionError):
+            with upstream_call('test_method'):
+                raise ConnectionError('api down')
+
+        self.assertEqual(UPSTREAM_RESPONSES.value(method='test_method', status='404'), 1)
+        self.assertEqual(UPSTREAM_RESPONSES.value(method='test_method', status='error'), 1)
+        self.assertEqual(UPSTREAM_DURATION.count(method='test_method'), before + 2)
+        self.assertEqual(UPSTREAM_RESPONSE_SIZE.count(method='test_method'), 1)
+
+    def test_server(self):
+        server = start_metrics_server(0, '127.0.0.1')
+        self.addCleanup(stop_metrics_server)
+        port = server.server_address[1]
+
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics') as response:
+            body = response.read().decode('utf-8')
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+
+        self.assertIn('# TYPE actions_action_duration_seconds histogram', body)
+        self.assertIn('# TYPE actions_upstream_responses counter', body)
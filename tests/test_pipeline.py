@@ -0,0 +1,170 @@
+import unittest
+from rasa_sdk.events import SlotSet
+from rasa_sdk.executor import CollectingDispatcher
+from actions.pipeline import (
+    Pipeline,
+    PipelineContext,
+    Stage,
+    CacheLookup,
+    UpstreamCall,
+    ParseServices,
+    SetRecommendationsSlot,
+    SlotOverlay,
+    Prefetcher
+)
+from actions.servicerec.api import ApiResponse
+from actions.utils import API_ERROR_MESSAGE, RECOMMENDATIONS_SLOT
+
+
+class Record(Stage):
+
+    def __init__(self, name, stop=False, always_run=False):
+        self.name = name
+        self.stop = stop
+        self.always_run = always_run
+
+    async def __call__(self, context):
+        context.slots.setdefault('run', []).append(self.name)
+        if self.stop:
+            context.stop()
+
+
+class StubApi:
+
+    def __init__(self, response=None, cached=None, error=None):
+        self.response = response
+        self.cached = cached
+        self.error = error
+        self.calls = 0
+
+    def cached_response(self, params, method):
+        return self.cached
+
+    async def fetch(self, params, method):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.response
+
+
+def services_response(status_code=200):
+    text = '{"recommended_services": [{"service_id": "1", "service_name": "Palvelu"}]}'
+    return ApiResponse(status_code, 'OK' if status_code < 400 else 'Error', text)
+
+
+def make_context():
+    return PipelineContext(CollectingDispatcher(), tracker=None, domain={}, method='text_search')
+
+
+class TestPipeline(unittest.IsolatedAsyncioTestCase):
+
+    async def test_stages_are_run_in_order_and_timed(self):
+        context = await Pipeline([Record('a'), Record('b')]).run(make_context())
+
+        self.assertEqual(context.slots['run'], ['a', 'b'])
+        self.assertEqual(set(context.timings), {'a', 'b'})
+
+    async def test_stop_skips_stages_except_always_run(self):
+        pipeline = Pipeline([Record('a', stop=True), Record('b'), Record('c', always_run=True)])
+        context = await pipeline.run(make_context())
+
+        self.assertEqual(context.slots['run'], ['a', 'c'])
+
+    def test_replace_and_without(self):
+        pipeline = Pipeline([Record('a'), Record('b')])
+        stage = Record('b')
+
+        self.assertIs(pipeline.replace('b', stage).stages[1], stage)
+        self.assertEqual(pipeline.without('a').names, ['b'])
+        self.assertEqual(pipeline.names, ['a', 'b'])
+        with self.assertRaises(KeyError):
+            pipeline.replace('c', stage)
+
+    def test_before(self):
+        pipeline = Pipeline([Record('a'), Record('b'), Record('c')])
+
+        self.assertEqual(pipeline.before('c').names, ['a', 'b'])
+        with self.assertRaises(KeyError):
+            pipeline.before('d')
+
+
+class TestRecommendationStages(unittest.IsolatedAsyncioTestCase):
+
+    def pipeline(self, api, error_messages=None):
+        return Pipeline([CacheLookup(api), UpstreamCall(api),
+                         ParseServices(error_messages), SetRecommendationsSlot()])
+
+    async def test_cached_response_skips_upstream(self):
+        api = StubApi(cached=services_response())
+        context = await self.pipeline(api).run(make_context())
+
+        self.assertEqual(api.calls, 0)
+        self.assertEqual(context.services['recommended_services'][0]['service_id'], '1')
+        self.assertEqual(context.events[0]['name'], RECOMMENDATIONS_SLOT)
+
+    async def test_connection_error(self):
+        context = await self.pipeline(StubApi(error=ConnectionError())).run(make_context())
+
+        self.assertEqual(context.dispatcher.messages[0]['template'], API_ERROR_MESSAGE)
+        self.assertIsNone(context.events[0]['value'])
+
+    async def test_error_response(self):
+        api = StubApi(response=services_response(500))
+        context = await self.pipeline(api, lambda response: [response.text]).run(make_context())
+
+        self.assertEqual(context.dispatcher.messages[0]['template'], api.response.text)
+        self.assertIsNone(context.events[0]['value'])
+
+
+class FakeTracker:
+
+    def __init__(self, slots):
+        self.slots = slots
+
+    def get_slot(self, key):
+        return self.slots.get(key)
+
+
+class SlotParams(Stage):
+    name = 'params'
+
+    async def __call__(self, context):
+        context.params = {'limit': context.tracker.get_slot('limit'), 'age': context.tracker.get_slot('age')}
+
+
+class TestPrefetcher(unittest.IsolatedAsyncioTestCase):
+
+    def test_slot_overlay(self):
+        tracker = SlotOverlay(FakeTracker({'a': 1, 'b': 2}), [SlotSet('b', 3), {'event': 'restart'}])
+
+        self.assertEqual((tracker.get_slot('a'), tracker.get_slot('b')), (1, 3))
+        self.assertEqual(tracker.slots, {'b': 3})
+
+    async def test_params_after_events(self):
+        prefetcher = Prefetcher(Pipeline([SlotParams()]), 'recommend_service', StubApi())
+        params = await prefetcher.params(FakeTracker({'limit': 5}), [SlotSet('age', '30')])
+
+        self.assertEqual(params, {'limit': 5, 'age': '30'})
+
+    async def test_prefetch(self):
+        api = StubApi(response=services_response())
+        prefetcher = Prefetcher(Pipeline([SlotParams()]), 'recommend_service', api)
+
+        task = await prefetcher.prefetch(FakeTracker({'limit': 5}))
+        self.assertIs(await task, api.response)
+        self.assertEqual((api.calls, prefetcher.pending()), (1, 0))
+
+    async def test_cached_response_is_not_prefetched(self):
+        api = StubApi(cached=services_response())
+        prefetcher = Prefetcher(Pipeline([SlotParams()]), 'recommend_service', api)
+
+        self.assertIsNone(await prefetcher.prefetch(FakeTracker({})))
+        self.assertEqual(api.calls, 0)
+
+    async def test_failed_prefetch_is_silent(self):
+        prefetcher = Prefetcher(Pipeline([SlotParams()]), 'recommend_service', StubApi(error=ConnectionError()))
+        task = await prefetcher.prefetch(FakeTracker({}))
+
+        with self.assertRaises(ConnectionError):
+            await task
+        self.assertEqual(prefetcher.pending(), 0)
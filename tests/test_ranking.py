@@ -0,0 +1,125 @@
+import random
+import unittest
+from actions.ranking import (
+    AhoCorasick,
+    parse_terms,
+    compile_terms,
+    term_matcher,
+    rank_services,
+    Bm25Index,
+    bm25_rerank,
+    query_variants,
+    reciprocal_rank_fusion
+)
+from actions.servicerec.text import stem, tokenize
+
+
+def service(service_id, description):
+    return {'service_id': service_id,
+            'service_name': f'Palvelu {service_id}',
+            'service_description': description,
+            'service_channels': [{'service_channel_name': 'kanava'}]}
+
+
+class TestAhoCorasick(unittest.TestCase):
+
+    def test_matches(self):
+        automaton = AhoCorasick(['he', 'she', 'his', 'hers'])
+        self.assertEqual(automaton.matches('ushers'), {0, 1, 3})
+        self.assertEqual(automaton.matches('xyz'), set())
+
+    def test_same_as_substring_search(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            patterns = list({''.join(rng.choice('abc') for _ in range(rng.randint(1, 4)))
+                             for _ in range(rng.randint(1, 6))})
+            text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 20)))
+            self.assertEqual(AhoCorasick(patterns).matches(text),
+                             {i for i, pattern in enumerate(patterns) if pattern in text})
+
+
+class TestRanking(unittest.TestCase):
+
+    def test_parse_terms(self):
+        self.assertEqual(parse_terms('Nuoret^2, perhe; NULL'), [('nuoret', 2.0), ('perhe', 1.0)])
+        self.assertEqual(parse_terms(['päihteet'], -1), [('päihteet', -1.0)])
+        self.assertEqual(parse_terms('klo 8:00'), [('klo 8:00', 1.0)])
+        self.assertEqual(parse_terms(None), [])
+        self.assertEqual(parse_terms('NULL'), [])
+
+    def test_matcher_is_cached_per_term_set(self):
+        self.assertIs(term_matcher('a, b', 'c'), term_matcher('b,a', 'c'))
+        self.assertIsNone(term_matcher('NULL', 'NULL'))
+
+    def test_score_is_casefolded(self):
+        matcher = compile_terms((('nuoret', 2.0), ('päihteet', -1.0)))
+        self.assertEqual(matcher.score('NUORET ja Päihteet'), 1.0)
+
+    def test_rank_services(self):
+        services = {'recommended_services': [service('1', 'aikuiset'),
+                                             service('2', 'päihteet'),
+                                             service('3', 'Nuoret'),
+                                             service('4', 'nuoret ja perheet')]}
+
+        ranked = rank_services(services, whitelist='nuoret, perhe^0.5', blacklist='päihteet')
+
+        self.assertEqual([s['service_id'] for s in ranked['recommended_services']], ['4', '3', '1', '2'])
+        self.assertEqual(ranked['recommended_services'][0]['service_channels'], [{'service_channel_name': 'kanava'}])
+        self.assertEqual([s['service_id'] for s in services['recommended_services']], ['1', '2', '3', '4'])
+
+    def test_no_terms_keeps_order(self):
+        services = {'recommended_services': [service('1', 'b'), service('2', 'a')]}
+        self.assertIs(rank_services(services, 'NULL', None), services)
+
+
+class TestBm25(unittest.TestCase):
+
+    def test_stem(self):
+        self.assertEqual({stem(word) for word in ('nuori', 'nuoret', 'nuorten', 'nuorille')}, {'nuor'})
+        self.assertEqual({stem(word) for word in ('palvelu', 'palvelut', 'palveluja', 'palveluiden')}, {'palvel'})
+        self.assertEqual(stem('perhe'), stem('perheiden'))
+        self.assertEqual(stem('työ'), 'työ')
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Nuorten ja perheiden palvelut 2022'), ['nuor', 'perh', 'palvel'])
+
+    def test_scores(self):
+        index = Bm25Index([['nuor', 'palvel'], ['vanhu', 'palvel'], ['nuor', 'nuor', 'tyo']])
+        scores = index.scores(['nuor'])
+        self.assertEqual(scores[1], 0)
+        self.assertGreater(scores[2], scores[0])
+
+    def test_rerank(self):
+        services = {'recommended_services': [service('1', 'Ikäihmisten kotihoito'),
+                                             service('2', 'Perheneuvola lapsille'),
+                                             service('3', 'Työpaja nuorille'),
+                                             service('4', 'Nuorten työllisyyspalvelut ja nuorisotyö')]}
+
+        reranked = bm25_rerank(services, 'nuorten työpaja', limit=3)
+
+        self.assertEqual([s['service_id'] for s in reranked['recommended_services']], ['3', '4', '1'])
+        self.assertIn('service_channels', reranked['recommended_services'][0])
+
+
+class TestFanOut(unittest.TestCase):
+
+    def test_query_variants(self):
+        self.assertEqual(query_variants('Nuoret ja työ', municipality='Tampere'),
+                         ['Nuoret ja työ', 'nuoret työ', 'Nuoret ja työ Tampere'])
+        self.assertEqual(query_variants('työ tampere', municipality='Tampere', municipality_words=('tampere',)),
+                         ['työ tampere', 'työ'])
+        self.assertEqual(query_variants('Työ.'), ['Työ.'])
+        self.assertEqual(query_variants(None), [])
+
+    def test_reciprocal_rank_fusion(self):
+        first = [service('1', 'a'), service('2', 'b'), service('3', 'c')]
+        second = [service('3', 'c'), service('4', 'd')]
+
+        fused = reciprocal_rank_fusion([first, second], k=1)
+        self.assertEqual([s['service_id'] for s in fused], ['3', '1', '2', '4'])
+        self.assertIs(fused[0], first[2])
+        self.assertEqual(len(reciprocal_rank_fusion([first, second], limit=2)), 2)
+
+    def test_ties_keep_first_ranking(self):
+        fused = reciprocal_rank_fusion([[service('1', 'a')], [service('2', 'b')]])
+        self.assertEqual([s['service_id'] for s in fused], ['1', '2'])
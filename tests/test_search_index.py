@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from rasa_sdk import Tracker
+from rasa_sdk.executor import CollectingDispatcher
+from actions.actions import ActionShowInfo
+from actions.pipeline import PipelineContext, LocalSearchFallback, ParseServices, SetRecommendationsSlot
+from actions import search_index
+from actions.search_index import SearchIndex, build_index, read_catalog, field_text, open_index
+from actions.servicerec.api import ApiResponse
+from actions.utils import compact_recommendations, SERVICE_DETAILS, RECOMMENDATIONS_SLOT, BUTTON_PRESSED_SLOT
+
+CATALOG = [
+    {'id': 'a', 'names': [{'language': 'fi', 'value': 'Nuorten työpaja'}],
+     'descriptions': [{'language': 'fi', 'value': 'Työpaja tukee nuoria työnhaussa.'}],
+     'municipalities': ['Tampere']},
+    {'id': 'b', 'names': [{'language': 'fi', 'value': 'Kotihoito'}],
+     'descriptions': [{'language': 'fi', 'value': 'Kotihoito ikäihmisille ja nuorille perheille.'}],
+     'municipalities': ['Helsinki']},
+    {'id': 'c', 'names': [{'language': 'fi', 'value': 'Nuorisotyö'}],
+     'descriptions': [{'language': 'fi', 'value': 'Valtakunnallinen neuvonta nuorille.'}],
+     'municipalities': []},
+]
+
+
+class StubApi:
+
+    def __init__(self, response=None, error=None, delay=0):
+        self.response = response
+        self.error = error
+        self.delay = delay
+
+    def cached_response(self, params, method):
+        return None
+
+    async def fetch(self, params, method):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.response
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        catalog = os.path.join(self.directory.name, 'services.json')
+        with open(catalog, 'w', encoding='utf-8') as f:
+            json.dump(CATALOG, f)
+
+        self.path = os.path.join(self.directory.name, 'services.idx')
+        build_index(read_catalog(catalog), self.path)
+        self.index = SearchIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        self.directory.cleanup()
+
+    def ids(self, response):
+        return [service['service_id'] for service in response['recommended_services']]
+
+    def test_field_text(self):
+        self.assertEqual(field_text([{'language': 'sv', 'value': 'x'}, {'language': 'fi', 'value': 'y'}]), 'y')
+        self.assertEqual(field_text({'fi': 'a', 'sv': 'b'}), 'a')
+        self.assertEqual(field_text(None), '')
+
+    def test_catalog_municipalities_are_codes(self):
+        self.assertEqual(self.index.service(0)['municipality_codes'], ['837'])
+
+    def test_search(self):
+        self.assertEqual(self.ids(self.index.search('nuorten työpaja', limit=5)), ['a', 'c', 'b'])
+        self.assertEqual(self.ids(self.index.search('nuoret', limit=1)), ['a'])
+        self.assertEqual(self.ids(self.index.search('tuntematon')), [])
+
+    def test_search_by_municipality_name(self):
+        self.assertEqual(self.ids(self.index.search('helsinki')), ['b'])
+
+    def test_municipality_filter(self):
+        self.assertEqual(self.ids(self.index.search('nuoret', municipality_codes=['091'])), ['c', 'b'])
+        self.assertEqual(self.ids(self.index.search('nuoret', municipality_codes=['091'],
+                                                    include_national_services=False)), ['b'])
+
+    def test_national_services_filter(self):
+        self.assertEqual(self.ids(self.index.search('nuoret', include_national_services=False)), ['a', 'b'])
+
+    def test_filtered_candidates_are_widened(self):
+        with mock.patch.object(search_index, 'CANDIDATE_MARGIN', 0):
+            self.assertEqual(self.ids(self.index.search('nuoret', limit=1, municipality_codes=['091'],
+                                                        include_national_services=False)), ['b'])
+
+    def test_search_params(self):
+        params = {'search_text': 'nuoret', 'limit': 5, 'service_filters': {'municipality_codes': ['837']}}
+        response = self.index.search_params(params)
+        self.assertEqual(self.ids(response), ['a', 'c'])
+        self.assertEqual(response['recommended_services'][0]['service_channels'], [])
+
+    def test_invalid_file(self):
+        path = os.path.join(self.directory.name, 'invalid.idx')
+        with open(path, 'wb') as f:
+            f.write(b'not an index')
+
+        with self.assertRaises(ValueError):
+            SearchIndex(path)
+        self.assertIsNone(open_index(path))
+        self.assertIsNone(open_index(None))
+
+
+class TestLocalSearchFallback(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'services.idx')
+        build_index([{'service_id': 'local', 'service_name': 'Nuorten työpaja',
+                      'service_description': '', 'municipality_codes': []}], path)
+        self.index = SearchIndex(path)
+
+    def tearDown(self):
+        self.index.close()
+        self.directory.cleanup()
+        SERVICE_DETAILS.clear()
+
+    async def run_stage(self, api, latency_budget=1.0):
+        context = PipelineContext(CollectingDispatcher(), tracker=None, domain={}, method='text_search')
+        context.params = {'search_text': 'työpaja', 'limit': 5}
+        await LocalSearchFallback(api, index=self.index, latency_budget=latency_budget)(context)
+        return context
+
+    async def test_api_response_is_used(self):
+        response = ApiResponse.from_json({'recommended_services': []})
+        context = await self.run_stage(StubApi(response))
+        self.assertIs(context.response, response)
+
+    async def test_connection_error(self):
+        context = await self.run_stage(StubApi(error=ConnectionError()))
+        self.assertFalse(context.stopped)
+        self.assertEqual(context.response.json()['recommended_services'][0]['service_id'], 'local')
+
+    async def test_server_error(self):
+        context = await self.run_stage(StubApi(ApiResponse(503, 'Unavailable', '')))
+        self.assertTrue(context.response.ok)
+
+    async def test_client_error_is_kept(self):
+        context = await self.run_stage(StubApi(ApiResponse(400, 'Bad Request', '')))
+        self.assertEqual(context.response.status_code, 400)
+
+    async def test_api_details_are_kept(self):
+        channels = [{'service_channel_name': 'Kanava', 'web_pages': ['https://työpaja.fi']}]
+        compact_recommendations({'recommended_services': [{'service_id': 'local', 'service_name': 'Nuorten työpaja',
+                                                           'service_channels': channels}]})
+        context = await self.run_stage(StubApi(error=ConnectionError()))
+        await ParseServices()(context)
+        await SetRecommendationsSlot()(context)
+
+        dispatcher = CollectingDispatcher()
+        tracker = Tracker('test', {RECOMMENDATIONS_SLOT: context.events[0]['value'],
+                                   BUTTON_PRESSED_SLOT: 'local_homepage'}, {}, [], False, None, {}, None)
+        ActionShowInfo().run(dispatcher, tracker, {})
+
+        self.assertIn('Web-sivut: https://työpaja.fi', [message['template'] for message in dispatcher.messages])
+
+    async def test_latency_budget(self):
+        api = StubApi(ApiResponse.from_json({'recommended_services': []}), delay=0.2)
+        context = await self.run_stage(api, latency_budget=0.01)
+        self.assertEqual(len(context.response.json()['recommended_services']), 1)
@@ -0,0 +1,135 @@
+import unittest
+from contextlib import contextmanager
+from rasa_sdk import Tracker
+from rasa_sdk.events import SlotSet
+from actions.actions import ValidateSlots
+from actions.pipeline import SlotOverlay
+from actions.servicerec import tracing
+from actions.slots import SlotSnapshot, extract_slots, to_int, to_bool, to_meter, to_search_text
+from actions.utils import (
+    LIFE_SITUATION_SLOTS,
+    DEFAULT_LIFE_SITUATION_METER_VALUES,
+    DEFAULT_RESULT_LIMIT,
+    DEFAULT_SEARCH_TEXT_VALUE,
+    RESULT_LIMIT_SLOT,
+    RERANK_SLOT,
+    AGE_SLOT,
+    MUNICIPALITY_SLOT,
+    MUNICIPALITY_FILTER_SLOT,
+    INCLUDE_NATIONAL_SERVICES_SLOT,
+    SEARCH_TEXT_SLOT,
+    SHOW_API_CALL_PARAMETERS_SLOT,
+    WHITELIST_SLOT
+)
+
+
+class RecordingTracer:
+    """ Tracer which records the names of its spans. """
+
+    def __init__(self):
+        self.spans = []
+
+    @contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        self.spans.append(name)
+        yield None
+
+
+def make_tracker(slots):
+    return Tracker('test', slots, {}, [], False, None, {}, None)
+
+
+class TestConverters(unittest.TestCase):
+
+    def test_to_int(self):
+        self.assertEqual(to_int('7'), 7)
+        self.assertEqual(to_int('x', 5), 5)
+        self.assertIsNone(to_int(None))
+
+    def test_to_bool(self):
+        self.assertEqual([to_bool(value) for value in (True, '1', 'Yes', '0', 'no', False, None, 1)],
+                         [True, True, True, False, False, False, None, None])
+
+    def test_to_meter(self):
+        self.assertEqual([to_meter(value) for value in ('0', '10', '11', '-1', 'x', None)],
+                         [0, 10, None, None, None, None])
+
+    def test_to_search_text(self):
+        self.assertEqual(to_search_text('nuoret'), 'nuoret')
+        self.assertEqual(to_search_text(None), DEFAULT_SEARCH_TEXT_VALUE)
+
+
+class TestSlotSnapshot(unittest.TestCase):
+
+    SLOTS = {
+        RESULT_LIMIT_SLOT: '3',
+        RERANK_SLOT: 'yes',
+        AGE_SLOT: '42',
+        MUNICIPALITY_SLOT: 'Tampere',
+        MUNICIPALITY_FILTER_SLOT: ['Tampere', 'Tukholma'],
+        INCLUDE_NATIONAL_SERVICES_SLOT: '0',
+        SEARCH_TEXT_SLOT: 'nuorten työttömyys',
+        SHOW_API_CALL_PARAMETERS_SLOT: '1',
+        LIFE_SITUATION_SLOTS['family']: '4',
+        LIFE_SITUATION_SLOTS['health']: '12'
+    }
+
+    def test_extract_slots(self):
+        snapshot = extract_slots(make_tracker(self.SLOTS))
+
+        self.assertEqual((snapshot.limit, snapshot.rerank, snapshot.age), (3, True, 42))
+        self.assertEqual(snapshot.municipality, '837')
+        self.assertEqual(snapshot.search_text, 'nuorten työttömyys')
+        self.assertEqual(snapshot.life_situation_meters, {'family': [4]})
+        self.assertEqual(snapshot.service_filters, {'include_national_services': False,
+                                                    'municipality_codes': ['837']})
+        self.assertEqual((snapshot.whitelist, snapshot.blacklist), ('NULL', 'NULL'))
+        self.assertTrue(snapshot.show_params)
+
+    def test_same_as_validate_slots(self):
+        tracker = make_tracker(self.SLOTS)
+        snapshot = extract_slots(tracker)
+        validate = ValidateSlots()
+
+        self.assertEqual(snapshot.limit, validate.validate_result_limit(tracker))
+        self.assertEqual(snapshot.municipality, validate.validate_municipality(tracker))
+        self.assertEqual(snapshot.life_situation_meters, validate.validate_feat(tracker))
+        self.assertEqual(snapshot.service_filters, validate.validate_filters(tracker))
+        self.assertEqual(snapshot.whitelist, validate.validate_sort_term(tracker, WHITELIST_SLOT))
+
+    def test_defaults(self):
+        snapshot = extract_slots(make_tracker({RESULT_LIMIT_SLOT: 'many', AGE_SLOT: None}))
+
+        self.assertEqual(snapshot.limit, DEFAULT_RESULT_LIMIT)
+        self.assertIsNone(snapshot.age)
+        self.assertIsNone(snapshot.rerank)
+        self.assertEqual(snapshot.life_situation_meters, DEFAULT_LIFE_SITUATION_METER_VALUES)
+        self.assertEqual(snapshot.service_filters, {})
+        self.assertFalse(snapshot.show_params)
+
+    def test_named_fields(self):
+        snapshot = extract_slots(make_tracker(self.SLOTS), ('limit', 'search_text'))
+
+        self.assertEqual(snapshot.as_dict(('limit', 'search_text')), {'limit': 3, 'search_text': 'nuorten työttömyys'})
+        self.assertIsNone(snapshot.service_filters)
+
+    def test_snapshot_has_no_dict(self):
+        snapshot = SlotSnapshot(limit=1)
+
+        self.assertFalse(hasattr(snapshot, '__dict__'))
+        with self.assertRaises(AttributeError):
+            snapshot.unknown = 1
+
+    def test_validation_is_traced(self):
+        tracer = RecordingTracer()
+        previous = tracing.get_tracer()
+        tracing.set_tracer(tracer)
+        self.addCleanup(tracing.set_tracer, previous)
+
+        extract_slots(make_tracker(self.SLOTS))
+
+        self.assertEqual(tracer.spans, ['validate_feat', 'validate_filters'])
+
+    def test_slot_overlay(self):
+        tracker = SlotOverlay(make_tracker(self.SLOTS), [SlotSet(RESULT_LIMIT_SLOT, '8')])
+        self.assertEqual(extract_slots(tracker, ('limit',)).limit, 8)
@@ -0,0 +1,78 @@
+import unittest
+from contextlib import contextmanager
+from servicerec import tracing
+from servicerec.tracing import NOOP_SPAN, span, traced, trace_action, set_tracer, get_tracer
+from servicerec.api import ApiResponse
+
+
+class RecordingSpan:
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = dict(attributes or {})
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class RecordingTracer:
+    """ Tracer with the start_as_current_span api of OpenTelemetry. """
+
+    def __init__(self):
+        self.spans = []
+
+    @contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        recorded = RecordingSpan(name, attributes)
+        self.spans.append(recorded)
+        yield recorded
+
+
+class Tracker:
+    sender_id = 'sender-1'
+
+
+class TestTracing(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tracer = RecordingTracer()
+        previous = get_tracer()
+        set_tracer(self.tracer)
+        self.addCleanup(set_tracer, previous)
+
+    def test_noop_by_default(self):
+        set_tracer(None)
+        with span('validate_feat') as s:
+            s.set_attribute('a', 1)
+        self.assertIs(s, NOOP_SPAN)
+        self.assertFalse(s.is_recording())
+
+    def test_traced(self):
+        @traced()
+        def validate_feat():
+            return 1
+
+        self.assertEqual(validate_feat(), 1)
+        self.assertEqual([s.name for s in self.tracer.spans], ['validate_feat'])
+
+    def test_json_decoding_is_traced_once(self):
+        response = ApiResponse(200, 'OK', '{"recommended_services": []}')
+        response.json()
+        response.json()
+        self.assertEqual([s.name for s in self.tracer.spans], ['json_decode'])
+
+    async def test_sender_id_is_set_in_action(self):
+        class Action:
+            def name(self):
+                return 'action_test'
+
+            @trace_action
+            async def run(self, dispatcher, tracker, domain):
+                with span('get_recommendations', method='text_search'):
+                    return []
+
+        await Action().run(None, Tracker(), {})
+
+        self.assertEqual([s.name for s in self.tracer.spans], ['action_test', 'get_recommendations'])
+        self.assertTrue(all(s.attributes['sender_id'] == 'sender-1' for s in self.tracer.spans))
+        self.assertIsNone(tracing.SENDER_ID.get())
@@ -0,0 +1,110 @@
+import unittest
+from actions.utils import (
+    find_municipality,
+    municipality_index,
+    Filters,
+    compact_recommendations,
+    find_service,
+    remove_duplicates,
+    SERVICE_DETAILS
+)
+from actions.classification_codes import MUNICIPALITY_CODES
+
+
+class TestFindMunicipality(unittest.TestCase):
+
+    def test_code(self):
+        self.assertEqual(find_municipality('837'), '837')
+        self.assertEqual(find_municipality('91'), '091')
+        self.assertIsNone(find_municipality('000'))
+
+    def test_name(self):
+        self.assertEqual(find_municipality('Tampere'), '837')
+        self.assertEqual(find_municipality(' tampere '), '837')
+        self.assertEqual(find_municipality('MÄNTTÄ-VILPPULA'), '508')
+        self.assertIsNone(find_municipality('Tukholma'))
+
+    def test_variants(self):
+        self.assertEqual(find_municipality('Tammerfors'), '837')
+        self.assertEqual(find_municipality('hameenlinna'), '109')
+        self.assertEqual(find_municipality('Mariehamn'), '478')
+        self.assertEqual(find_municipality('Pedersöre'), '599')
+
+    def test_typos(self):
+        self.assertEqual(find_municipality('Tampre'), '837')
+        self.assertEqual(find_municipality('Hämenlinna'), '109')
+        self.assertIsNone(find_municipality('Tampre', fuzzy=False))
+
+    def test_every_official_name(self):
+        for code, name in MUNICIPALITY_CODES.items():
+            self.assertEqual(find_municipality(name), code)
+        self.assertTrue(len(municipality_index()) > len(MUNICIPALITY_CODES))
+
+
+class TestCodeFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.filters = Filters().filters
+
+    def test_invalid_codes_are_removed(self):
+        selection = ['837', 'x', 'y', '091']
+        validated = self.filters['municipality_filter'].validate_selection(selection)
+
+        self.assertEqual(validated, ['837', '091'])
+        self.assertEqual(selection, ['837', 'x', 'y', '091'])
+
+    def test_single_code(self):
+        self.assertEqual(self.filters['region_filter'].validate_selection('06'), ['06'])
+        self.assertIsNone(self.filters['region_filter'].validate_selection('99'))
+        self.assertIsNone(self.filters['region_filter'].validate_selection(6))
+
+    def test_municipality_names(self):
+        validated = self.filters['municipality_filter'].validate_selection(['Tampre', '091', 'Tukholma'])
+        self.assertEqual(validated, ['837', '091'])
+
+    def test_value_over_key(self):
+        validated = self.filters['service_class_filter'].validate_selection(['P1', 'P0'])
+        self.assertEqual(validated, ['http://uri.suomi.fi/codelist/ptv/ptvserclass2/code/P1'])
+
+    def test_codes_not_validated(self):
+        validated = self.filters['service_collection_filter'].validate_selection(['abc'])
+        self.assertEqual(validated, ['abc'])
+
+
+class TestServiceDetails(unittest.TestCase):
+
+    def tearDown(self):
+        SERVICE_DETAILS.clear()
+
+    def test_compact_recommendations(self):
+        service = {'service_id': 'a', 'service_name': 'Palvelu', 'service_channels': [{'emails': []}]}
+        compact = compact_recommendations({'recommended_services': [service]})
+
+        self.assertEqual(compact, {'recommended_services': [{'service_id': 'a', 'service_name': 'Palvelu'}]})
+        self.assertEqual(find_service(compact, 'a').service_name, 'Palvelu')
+        self.assertIsNone(compact_recommendations(None))
+
+    def test_expired_details(self):
+        compact = compact_recommendations({'recommended_services': [{'service_id': 'a', 'service_name': 'Palvelu',
+                                                                     'service_channels': []}]})
+        SERVICE_DETAILS.clear()
+        self.assertIsNone(find_service(compact, 'a'))
+
+    def test_find_service_from_slot(self):
+        service = {'service_id': 'b',
+                   'service_name': 'Palvelu',
+                   'service_channels': [{'service_channel_name': 'Kanava',
+                                         'emails': ['a@b.fi', 'c@d.fi', 'a@b.fi'],
+                                         'phone_numbers': [],
+                                         'address': None,
+                                         'service_hours': [],
+                                         'web_pages': ['https://b.fi']}]}
+
+        service_info = find_service({'recommended_services': [service]}, 'b')
+        self.assertEqual(service_info.channels[0].emails, 'a@b.fi\nc@d.fi')
+        self.assertEqual(service_info.channels[0].web_pages, 'https://b.fi')
+        self.assertIsNone(find_service(None, 'b'))
+
+    def test_remove_duplicates(self):
+        self.assertEqual(remove_duplicates(['b', 'a', 'b', 'c', 'a']), ['b', 'a', 'c'])
+        self.assertEqual(remove_duplicates(None), [])
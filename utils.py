@@ -1,11 +1,8 @@
-from actions.classification_codes import (
-    REGION_CODES,
-    MUNICIPALITY_CODES,
-    HOSPITAL_DISTRICT_CODES,
-    SERVICE_CLASS_CODES,
-    TARGET_GROUP_CODES,
-    SERCVICE_COLLECTION_CODES
-)
+import os
+from actions.koodisto import KOODISTO
+from actions.fuzzy import FuzzyMatcher
+from actions.servicerec.cache import ResponseCache
+from actions.servicerec.text import normalize_text
 
 ### SLOTS CONFIGURATIONS ###
 
@@ -66,6 +63,21 @@ DEFAULT_RESULT_LIMIT = 5
 
 RERANK_SLOT = 'sr_param_rerank'
 
+# How text search results are reranked when RERANK_SLOT is set: 'remote' asks the api to
+# rerank, 'local' fetches LOCAL_RERANK_CANDIDATES services without reranking and reranks
+# them with BM25 in the action server (see ranking.bm25_rerank).
+RERANK_MODE = os.getenv('SERVICE_RERANK_MODE', 'remote')
+LOCAL_RERANK_CANDIDATES = int(os.getenv('SERVICE_LOCAL_RERANK_CANDIDATES', 20))
+
+# How text search actions call the api: 'single' sends the search text as is, 'fanout'
+# sends variants of it concurrently and fuses the results (see ranking.query_variants).
+TEXT_SEARCH_MODE = os.getenv('SERVICE_TEXT_SEARCH_MODE', 'single')
+FANOUT_RRF_K = int(os.getenv('SERVICE_FANOUT_RRF_K', 60))
+
+# If set, recommendations by life situation are requested in the background as soon as
+# session attributes are fetched, so that they are cached when the user asks for them.
+PREFETCH_RECOMMENDATIONS = os.getenv('SERVICE_PREFETCH_RECOMMENDATIONS', '0') == '1'
+
 DEFAULT_SESSION_ID = 'xyz-123'
 
 # SLOT NAMES FOR API FILTER PARAMETERS
@@ -79,60 +91,85 @@ SERCVICE_COLLECTION_FILTER_SLOT = 'sr_filter_service_collection'
 # FILTER CONFIGURATION DICTIONARY
 """ For each filter following parameters must be defined:
     slot_name: Fixed name of the slot which holds the value of the filter.
-    codes: If the filter in api expects fixed values defined in koodistot.suomi.fi, the codes must be stored here.
+    koodisto_table: If the filter in api expects fixed values defined in koodistot.suomi.fi, name of the
+                    koodisto snapshot table (see koodisto.py) which holds the codes.
     default_value: Default value of filter (not used at the moment)
     validate_codes: Whether or not slot values should be validated agains koodistot codes defined in codes.
                     If used koodistot codes are not up to date, disable validate_codes.
     use_value_over_key: If koodistot codes dictionary value item is the one filter needs as input instead of key.
+    api_parameter: Name of the filter in service_filters parameter of the api.
+    match_names: Whether slot values which are not codes are matched to codes by name, allowing typos
+                 (municipalities only, see find_municipality).
 """
 API_FILTERS = {
     'region_filter': {
         'slot_name': REGION_FILTER_SLOT,
-        'codes': REGION_CODES,
+        'koodisto_table': 'region',
         'default_value': None,
         'validate_codes': True,
-        'use_value_over_key': False
+        'use_value_over_key': False,
+        'api_parameter': 'region_codes',
+        'match_names': False
     },
     'municipality_filter': {
         'slot_name': MUNICIPALITY_FILTER_SLOT,
-        'codes': MUNICIPALITY_CODES,
+        'koodisto_table': 'municipality',
         'default_value': None,
         'validate_codes': True,
-        'use_value_over_key': False
+        'use_value_over_key': False,
+        'api_parameter': 'municipality_codes',
+        'match_names': True
     },
     'hospital_district_filter': {
         'slot_name': HOSPITAL_DISTRICT_FILTER_SLOT,
-        'codes': HOSPITAL_DISTRICT_CODES,
+        'koodisto_table': 'hospital_district',
         'default_value': None,
         'validate_codes': True,
-        'use_value_over_key': False
+        'use_value_over_key': False,
+        'api_parameter': 'hospital_district_codes',
+        'match_names': False
     },
     'service_class_filter': {
         'slot_name': SERVICE_CLASS_FILTER_SLOT,
-        'codes': SERVICE_CLASS_CODES,
+        'koodisto_table': 'service_class',
         'default_value': None,
         'validate_codes': True,
-        'use_value_over_key': True
+        'use_value_over_key': True,
+        'api_parameter': 'service_classes',
+        'match_names': False
     },
     'target_group_filter': {
         'slot_name': TARGET_GROUP_FILTER_SLOT,
-        'codes': TARGET_GROUP_CODES,
+        'koodisto_table': 'target_group',
         'default_value': None,
         'validate_codes': True,
-        'use_value_over_key': False
+        'use_value_over_key': False,
+        'api_parameter': 'target_groups',
+        'match_names': False
     },
     'service_collection_filter': {
         'slot_name': SERCVICE_COLLECTION_FILTER_SLOT,
-        'codes': SERCVICE_COLLECTION_CODES,
+        'koodisto_table': 'service_collection',
         'default_value': None,
         'validate_codes': False,
-        'use_value_over_key': False
+        'use_value_over_key': False,
+        'api_parameter': 'service_collections',
+        'match_names': False
     }
 }
 
 # FUNCTIONAL SLOTS (are needed when recommendations are presented in botfront)
 RECOMMENDATIONS_SLOT = 'sr_recommended_services'
 
+# Recommendations slot holds only ids and names of the services, and full service
+# records (service channels etc.) are kept in this process wide store. Setting the
+# size to zero disables the store and full records are kept in the slot.
+SERVICE_DETAILS = ResponseCache(maxsize=int(os.getenv('SERVICE_DETAIL_STORE_SIZE', 5000)),
+                                ttl=float(os.getenv('SERVICE_DETAIL_STORE_TTL', 6 * 60 * 60)))
+
+# Key which marks a response answered from the local search index (see search_index.py).
+LOCAL_SEARCH_RESULTS = 'local_search'
+
 BUTTON_PRESSED_SLOT = 'sr_button_pressed'
 BUTTON_PRESSED_INTENT = 'sr.buttonpressed'
 
@@ -147,62 +184,84 @@ API_ERROR_MESSAGE = 'En valitettavasti pysty hakemaan palveluita juuri nyt.'
 NO_SERVICES_MESSAGE = 'En löytänyt yhtään tilanteeseesi sopivaa palvelua.'
 NO_SERVICE_CHANNELS_MESSAGE = 'Palvelulla ei toistaiseksi ole yhtään palvelukanavaa.'
 NO_SERVICE_CHANNEL_ITEMS_MESSAGE = '...tätä tietoa ei ole saatavilla.'
+SERVICE_DETAILS_EXPIRED_MESSAGE = 'Palvelun tiedot eivät ole enää saatavilla. Hae palveluita uudelleen.'
+
+# Lowest confidence (1 - edit distance / length of the name) of a misspelled municipality name match.
+MUNICIPALITY_MATCH_MIN_CONFIDENCE = 0.8
 
 class CodeFilter:
     """ Filter object for each koodisto classification codes.
         This class is used to validate if user input in filter
         slot is valid and can be sent to api as is or needs
-        preparation."""
-    def __init__(self, codes: dict, slot_name: str, default_value: str, validate_codes: bool, use_value_over_key: bool):
-        self.codes = codes
+        preparation. Valid codes and the values sent to api are
+        precomputed for each koodisto snapshot, so a selection is
+        validated in one pass."""
+    def __init__(self, koodisto_table: str, slot_name: str, default_value: str, validate_codes: bool,
+                 use_value_over_key: bool, api_parameter: str = None, match_names: bool = False):
+        self.koodisto_table = koodisto_table
         self.slot = slot_name
         self.default_value = default_value
         self.validate_codes = validate_codes
         self.use_value_over_key = use_value_over_key
+        self.api_parameter = api_parameter
+        self.match_names = match_names
+
+        # Unknown codes are passed as is only if they are not validated nor mapped to values.
+        self.pass_unknown = not validate_codes and not use_value_over_key
+
+    @property
+    def codes(self) -> dict:
+        return KOODISTO.table(self.koodisto_table)
+
+    def lookup(self):
+        """ Returns set of valid codes and the value sent to api for each of them
+            in the koodisto snapshot in use. """
+        snapshot = KOODISTO.snapshot
+
+        def build():
+            codes = snapshot.table(self.koodisto_table)
+            api_values = dict(codes) if self.use_value_over_key else {code: code for code in codes}
+            return frozenset(codes), api_values
+
+        return snapshot.cached(('code_filter', self.koodisto_table, self.use_value_over_key), build)
 
     def validate_selection(self, selection):
-        if isinstance(selection, list):
-            checked_selection = self.check_codes(selection)
-        elif isinstance(selection, str):
-            checked_selection = self.check_codes([selection])
-        else:
+        """ Returns a new list of api values of the selection, or None if
+            nothing in the selection is valid. Selection is not modified. """
+        if isinstance(selection, str):
+            selection = (selection,)
+        elif not isinstance(selection, list):
             return None
 
-        if checked_selection:
-            if self.use_value_over_key:
-                value_based_selection = self.value_over_key(checked_selection)
-                return value_based_selection
-            else:
-                return checked_selection
-        else:
-            return None
+        code_set, api_values = self.lookup()
+        validated = []
+
+        for code in selection:
+            if code in code_set:
+                validated.append(api_values[code])
+            elif self.match_names:
+                matched_code = find_municipality(code)
+                if matched_code in code_set:
+                    validated.append(api_values[matched_code])
+            elif self.pass_unknown:
+                validated.append(code)
+
+        return validated or None
 
     def check_codes(self, selection: list):
         """ Go through codes selected and check if they exists in the codes dictionary.
-            Pass validation if filter settings say so."""
+            Pass validation if filter settings say so. Returns a new list."""
         if not self.validate_codes:
-            return selection
+            return list(selection)
 
-        for code in selection:
-            if code in self.codes.keys():
-                continue
-            else:
-                selection.remove(code)
-        return selection
+        code_set, _ = self.lookup()
+        return [code for code in selection if code in code_set]
 
     def value_over_key(self, selection: list):
         """ If api parameter is based on code values instead of code key,
         we must select parameter value accordingly."""
-        selection_values = []
-
-        for code in selection:
-            try:
-                value = self.codes[code]
-                selection_values.append(value)
-            except KeyError:
-                continue
-
-        return selection_values
+        codes = self.codes
+        return [codes[code] for code in selection if code in codes]
 
 class Filters:
     """ Generates filter objects as initialization. """
@@ -212,17 +271,152 @@ class Filters:
 
     def make_filters(self):
         for key, value in API_FILTERS.items():
-            self.filters[key] = CodeFilter(codes=API_FILTERS[key]['codes'],
+            self.filters[key] = CodeFilter(koodisto_table=API_FILTERS[key]['koodisto_table'],
                                            slot_name=API_FILTERS[key]['slot_name'],
                                            default_value=API_FILTERS[key]['default_value'],
                                            validate_codes=API_FILTERS[key]['validate_codes'],
-                                           use_value_over_key=API_FILTERS[key]['use_value_over_key'])
-
-def find_municipality(text: str):
-    """ Helper to find municipality by code or value """
-    if text in MUNICIPALITY_CODES.keys():
-        return text
-    else:
-        TEMP = dict((k, v.lower()) for k,v in MUNICIPALITY_CODES.items())
-        if text.lower() in TEMP.values():
-            return (list(TEMP.keys())[list(TEMP.values()).index(text.lower())])
+                                           use_value_over_key=API_FILTERS[key]['use_value_over_key'],
+                                           api_parameter=API_FILTERS[key]['api_parameter'],
+                                           match_names=API_FILTERS[key]['match_names'])
+
+# Letters replaced when users write without Finnish and Swedish characters.
+_ASCII_FOLD = str.maketrans({'ä': 'a', 'ö': 'o', 'å': 'a'})
+
+
+def municipality_name_variants(name: str) -> list:
+    """ Normalized spellings of a municipality name: the name itself and, for names
+        like 'Maarianhamina - Mariehamn' or 'Pedersören kunta', the shorter forms. """
+    names = [name] + name.split(' - ')
+    if name.endswith(' kunta'):
+        names.append(name[:-len(' kunta')])
+    return [normalize_text(variant) for variant in names]
+
+
+def build_municipality_index(codes: dict, swedish_names: dict) -> dict:
+    """ Builds normalized name -> municipality code index. Official names take
+        precedence over Swedish names, and exact spellings over the ones written
+        without Finnish and Swedish characters. """
+    index = {}
+    names = [(code, variant)
+             for table in (codes, swedish_names)
+             for code, name in table.items()
+             for variant in municipality_name_variants(name)]
+
+    for code, variant in names:
+        index.setdefault(variant, code)
+    for code, variant in names:
+        index.setdefault(variant.translate(_ASCII_FOLD), code)
+
+    return index
+
+
+def municipality_index() -> dict:
+    """ Normalized name -> code index of the municipalities in the koodisto
+        snapshot in use. Index is built once per snapshot. """
+    snapshot = KOODISTO.snapshot
+    return snapshot.cached('municipality_index',
+                           lambda: build_municipality_index(snapshot.table('municipality'),
+                                                            snapshot.table('municipality_sv')))
+
+
+def municipality_matcher() -> FuzzyMatcher:
+    """ Matcher of misspelled municipality names, built once per koodisto snapshot. """
+    snapshot = KOODISTO.snapshot
+    return snapshot.cached('municipality_matcher',
+                           lambda: FuzzyMatcher(municipality_index(),
+                                                min_confidence=MUNICIPALITY_MATCH_MIN_CONFIDENCE))
+
+
+def municipality_name(code: str):
+    """ Returns name of the municipality with the code. """
+    return KOODISTO.table('municipality').get(code)
+
+
+def find_municipality(text: str, fuzzy: bool = True):
+    """ Helper to find municipality by code or name. Names are matched case
+        insensitively, and Swedish names and spellings without Finnish
+        characters are accepted. If fuzzy is set, names with typos (e.g.
+        'Tampre') are matched to the closest municipality name. """
+    text = str(text).strip()
+
+    if text.isdigit():
+        code = text.zfill(3)
+        if code in KOODISTO.table('municipality'):
+            return code
+        return None
+
+    normalized_text = normalize_text(text)
+    code = municipality_index().get(normalized_text)
+
+    if code is None and fuzzy:
+        code = municipality_matcher().match(normalized_text)
+
+    return code
+
+
+def remove_duplicates(records: list) -> list:
+    """ Returns records as strings without duplicates, keeping the original order. """
+    return list(dict.fromkeys(map(str, records or [])))
+
+
+class ServiceChannelInfo:
+    """ Texts of a service channel shown by action_show_info, prepared once. """
+    __slots__ = ('name', 'emails', 'phone_numbers', 'address', 'service_hours', 'web_pages')
+
+    def __init__(self, channel: dict):
+        self.name = channel.get('service_channel_name')
+        self.emails = '\n'.join(remove_duplicates(channel.get('emails')))
+        self.phone_numbers = '\n'.join(remove_duplicates(channel.get('phone_numbers')))
+        self.address = channel.get('address')
+        self.service_hours = '\n'.join(map(str, channel.get('service_hours') or []))
+        self.web_pages = '\n'.join(map(str, channel.get('web_pages') or []))
+
+
+class ServiceInfo:
+    """ Recommended service with its service channels prepared for action_show_info. """
+    __slots__ = ('service_id', 'service_name', 'channels')
+
+    def __init__(self, service: dict):
+        self.service_id = service['service_id']
+        self.service_name = service.get('service_name')
+        self.channels = [ServiceChannelInfo(channel) for channel in service.get('service_channels') or []]
+
+
+def index_services(services: dict) -> dict:
+    """ Returns service id -> ServiceInfo index of recommended services. """
+    return {service['service_id']: ServiceInfo(service)
+            for service in (services or {}).get('recommended_services', [])}
+
+
+def compact_recommendations(services: dict):
+    """ Stores recommended services to SERVICE_DETAILS and returns recommendations
+        with only ids and names of the services for the slot. """
+    if not services or not SERVICE_DETAILS.enabled:
+        return services
+
+    # Results of the local search index have no service channels, so they must
+    # not replace the full records of the api already in the store.
+    local = services.get(LOCAL_SEARCH_RESULTS, False)
+    for service_id, service_info in index_services(services).items():
+        if not (local and SERVICE_DETAILS.state(service_id) is not None):
+            SERVICE_DETAILS.set(service_id, service_info)
+
+    compact_services = [{'service_id': service['service_id'], 'service_name': service['service_name']}
+                        for service in services.get('recommended_services', [])]
+
+    return dict(services, recommended_services=compact_services)
+
+
+def find_service(services: dict, service_id: str):
+    """ Returns ServiceInfo of a recommended service from SERVICE_DETAILS, or from
+        the recommendations slot value if the service is not in the store. None
+        if the service is not found, or the slot holds only its id and name
+        because its details have expired from the store. """
+    service_info = SERVICE_DETAILS.get(service_id)
+    if service_info is not None:
+        return service_info
+
+    for service in (services or {}).get('recommended_services', []):
+        if service['service_id'] == service_id:
+            return ServiceInfo(service) if 'service_channels' in service else None
+    return None